@@ -0,0 +1,79 @@
+# Per-row CPU cost of turning backend search rows into a JSON response.
+#
+#   cd src && python ../benchmarks/search_serialization.py --rows 10000
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from api.models import Blob  # noqa: E402
+from api.responses import dumps  # noqa: E402
+
+
+def make_documents(rows: int, tags: int) -> list[dict]:
+    return [
+        {
+            "id": f"00000000-0000-0000-0000-{i:012d}",
+            "name": f"blob-{i}",
+            "type": "application/json",
+            "timestamp": "2022-05-01T12:00:00",
+            "source": "benchmark",
+            "user_tags": [{"name": f"tag{j}", "value": str(j)} for j in range(tags)],
+            "system_tags": [
+                {"name": "content-type", "value": "application/json"},
+                {"name": "content-length", "value": "1024"},
+            ],
+            "size": "1024",
+        }
+        for i in range(rows)
+    ]
+
+
+def validated(documents: list[dict]) -> bytes:
+    # the previous path: validated models, then FastAPI's encoder
+    blobs = [
+        Blob(
+            blob_id=d["id"],
+            name=d["name"],
+            content_type=d["type"],
+            timestamp=d["timestamp"],
+            source=d["source"],
+            user_tags=d["user_tags"],
+            system_tags=d["system_tags"],
+            size=d["size"],
+        )
+        for d in documents
+    ]
+    return json.dumps(jsonable_encoder(blobs)).encode()
+
+
+def trusted(documents: list[dict]) -> bytes:
+    return dumps([Blob.from_document(d) for d in documents])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--tags", type=int, default=5, help="user tags per row")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    documents = make_documents(args.rows, args.tags)
+    assert json.loads(validated(documents)) == json.loads(trusted(documents))
+
+    for name, func in (("validated", validated), ("trusted", trusted)):
+        best = min(timeit.repeat(lambda: func(documents), number=1, repeat=args.repeat))
+        print(
+            f"{name:>10}: {best * 1000:8.1f} ms per {args.rows} rows, "
+            f"{best / args.rows * 1e6:6.2f} us per row"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,25 @@
+import asyncio
+
 import sentry_sdk
 from fastapi import FastAPI
 from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 
 from api.dependencies import UnauthenticatedException
-from api.error_handling import handle_unauthenticated_exception
+from api.error_handling import handle_timeout_error, handle_unauthenticated_exception
 from api.router.blob import blob_router
+from api.router.metrics import metrics_router
+from api.router.project import project_router
 from config import settings
+from database.db import (
+    ensure_content_digest_indexes,
+    ensure_first_step_indexes,
+    ensure_search_generation_indexes,
+)
+from shared.blob_data_handlers.client_registry import CLIENT_REGISTRY
+from shared.deploy_service_client import DeployServiceClient
+from shared.exiftool_pool import EXIFTOOL_POOL
 from shared.gcp_time_tracking import TimeTrackingBigQuery
+from utils.executors import shutdown_executors
 from utils.logger import setup_logger
 
 LOGGER = setup_logger()
@@ -15,12 +28,32 @@ LOGGER = setup_logger()
 def get_application():
     sentry_sdk.init(dsn=settings.sentry_url, traces_sample_rate=1.0)
 
-    app = FastAPI(title="API Service")
+    app = FastAPI(
+        title="API Service",
+        on_startup=[
+            DeployServiceClient.initialize,
+            TimeTrackingBigQuery.start,
+            ensure_first_step_indexes,
+            ensure_content_digest_indexes,
+            ensure_search_generation_indexes,
+            EXIFTOOL_POOL.start,
+        ],
+        on_shutdown=[
+            TimeTrackingBigQuery.shutdown,
+            DeployServiceClient.close,
+            CLIENT_REGISTRY.close_all,
+            EXIFTOOL_POOL.shutdown,
+            shutdown_executors,
+        ],
+    )
     app.add_exception_handler(
         UnauthenticatedException, handle_unauthenticated_exception
     )
+    app.add_exception_handler(asyncio.TimeoutError, handle_timeout_error)
 
     app.include_router(blob_router)
+    app.include_router(metrics_router)
+    app.include_router(project_router)
 
     TimeTrackingBigQuery.initialize()
 
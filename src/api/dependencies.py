@@ -1,4 +1,3 @@
-import httpx
 from fastapi import Depends
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import ExpiredSignatureError, JWTError, jwt
@@ -6,6 +5,8 @@ from pydantic import UUID4
 
 from api.models import FullProjectStructure, JwtUserData
 from config import settings
+from shared.deploy_service_client import DeployServiceClient
+from utils.cache import AsyncTTLCache
 
 
 class UnauthenticatedException(Exception):
@@ -17,6 +18,19 @@ class UnauthenticatedException(Exception):
 
 http_bearer = HTTPBearer(auto_error=False)
 
+# (user_id, project_id) -> FullProjectStructure. Projects change through the
+# deploy service, which invalidates them here, see api/router/project.py.
+PROJECT_CACHE: AsyncTTLCache[tuple[str, str], FullProjectStructure] = AsyncTTLCache(
+    max_size=settings.project_cache_max_size,
+    ttl=settings.project_cache_ttl,
+    stale_ttl=settings.project_cache_stale_ttl,
+)
+
+
+def invalidate_project_cache(project_id: UUID4 | str):
+    # the project of every user, including loads in flight
+    PROJECT_CACHE.invalidate_where(lambda key: key[1] == str(project_id))
+
 
 async def get_current_user(
     authorization: HTTPAuthorizationCredentials | None = Depends(http_bearer),
@@ -52,9 +66,16 @@ async def get_current_project(
     )
     payload["project_id"] = str(project_id)
     jwt_token = jwt.encode(payload, settings.jwt_secret, algorithm=jwt.ALGORITHMS.HS256)
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            f"{settings.deploy_service_base_url}/v1/full_projects",
+
+    async def load_project() -> FullProjectStructure:
+        resp = await DeployServiceClient.get_client().get(
+            "/v1/full_projects",
             headers={"Authorization": f"Bearer {jwt_token}"},
         )
-    return FullProjectStructure(**resp.json())
+        full_project_structure = FullProjectStructure(**resp.json())
+        full_project_structure.project_id = str(project_id)
+        return full_project_structure
+
+    return await PROJECT_CACHE.get_or_load(
+        (str(jwt_user_data.user_id), str(project_id)), load_project
+    )
@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import Request, status
 from fastapi.responses import JSONResponse
 
@@ -11,3 +13,12 @@ async def handle_unauthenticated_exception(
         status_code=status.HTTP_403_FORBIDDEN,
         content={"detail": exc.message or "Forbidden"},
     )
+
+
+async def handle_timeout_error(
+    request: Request, exc: asyncio.TimeoutError
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={"detail": "Upstream call timed out"},
+    )
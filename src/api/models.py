@@ -23,6 +23,68 @@ class Blob(BlobCreate):
     name: str = ""
     blob_id: str  # UUID?
 
+    @classmethod
+    def from_document(cls, document: dict, blob_id: str | None = None) -> "Blob":
+        # Builds the blob from a metadata document read back from a backend.
+        # The document was validated before it was stored, so the models are
+        # constructed without validating it again.
+        return cls.construct(
+            blob_id=blob_id or document["id"],
+            name=document.get("name") or "",
+            content_type=document.get("type") or "application/json",
+            timestamp=document.get("timestamp") or "",
+            source=document.get("source") or "",
+            user_tags=[
+                Tag.construct(name=tag["name"], value=tag.get("value"))
+                for tag in document.get("user_tags") or []
+            ],
+            system_tags=[
+                Tag.construct(name=tag["name"], value=tag.get("value"))
+                for tag in document.get("system_tags") or []
+            ],
+            size=int(document.get("size") or 0),
+        )
+
+
+class BlobBatchItemResult(BaseModel):
+    blob_id: str | None = None
+    error: str | None = None
+
+
+class TimeRange(BaseModel):
+    timestamp_from: datetime.datetime | None = None
+    timestamp_to: datetime.datetime | None = None
+
+
+class SearchEstimate(BaseModel):
+    total_bytes_processed: int
+    maximum_bytes_billed: int | None = None
+
+
+class SearchPage(BaseModel):
+    blobs: list[Blob]
+    next_cursor: str | None = None
+
+
+class SignedUrl(BaseModel):
+    # a URL to send the data to or read it from the storage directly
+    url: str
+    method: str
+    headers: dict[str, str] = {}  # to send with the request
+    expires_at: datetime.datetime
+    content_encoding: str | None = None  # of the data read from the URL
+
+
+class BlobDirectUpload(Blob):
+    upload: SignedUrl
+
+
+class BlobDataBatchItem(BaseModel):
+    # one line of a bulk data upload
+    blob_id: str
+    content_type: str | None = None
+    data: str  # base64
+
 
 class BlobDataJson(BaseModel):
     data: dict | None = None
@@ -92,6 +154,7 @@ class FullProjectStructure(BaseModel):
     project: Project
     credentials: GCPCredentials | AWSCredentials | AzureCredentials
     deploy: ProjectDeploy
+    project_id: str | None = None  # set from the request path
 
 
 #########################
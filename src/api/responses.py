@@ -0,0 +1,23 @@
+import typing
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def default(obj: typing.Any) -> typing.Any:
+    # models are serialized from their fields, orjson recurses into them
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: typing.Any) -> bytes:
+    return orjson.dumps(content, default=default)
+
+
+class ORJSONResponse(JSONResponse):
+    # For content built from trusted models: returning it skips FastAPI's
+    # response_model validation and jsonable_encoder.
+    def render(self, content: typing.Any) -> bytes:
+        return dumps(content)
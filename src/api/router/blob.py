@@ -1,13 +1,36 @@
+import base64
+import binascii
+import datetime
 import time
+import typing
 
-from fastapi import APIRouter, Depends, Request, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from starlette.datastructures import Headers
 
 from api.dependencies import get_current_project
-from api.models import Blob, BlobCreate, FullProjectStructure, Tag
+from api.models import (
+    Blob,
+    BlobBatchItemResult,
+    BlobCreate,
+    BlobDataBatchItem,
+    BlobDirectUpload,
+    FullProjectStructure,
+    SearchEstimate,
+    SignedUrl,
+    Tag,
+    TimeRange,
+)
+from api.responses import ORJSONResponse, dumps
+from config import settings
 from shared.blob_data_handlers import BLOB_HANDLER_CLASSES
-from shared.data_processors.general_processor import GeneralDataProcessor
+from shared.blob_data_handlers.base import BaseBlobHandler, BlobDataItem
+from shared.compression import decode_stream
+from shared.data_processors.general_processor import ContentType, GeneralDataProcessor
 from shared.gcp_time_tracking import TimeTrackingBigQuery
 from utils.logger import setup_logger
+from utils.streams import LineTooLongError, iter_bytes, iter_lines
 
 blob_router = APIRouter(prefix="/v1/blobs", tags=["blobs"], dependencies=[])
 
@@ -15,15 +38,32 @@ LOGGER = setup_logger()
 
 
 @blob_router.post(
-    "/{project_id}", status_code=status.HTTP_201_CREATED, response_model=Blob
+    "/{project_id}",
+    status_code=status.HTTP_201_CREATED,
+    # the subclass first, a direct upload would lose its URL as a Blob
+    response_model=BlobDirectUpload | Blob,
+    response_class=ORJSONResponse,
 )
 async def create_blob(
     blob: BlobCreate,
+    direct_upload: bool = False,
     full_project_structure: FullProjectStructure = Depends(get_current_project),
-) -> Blob:
+) -> Blob | BlobDirectUpload:
+    # with direct_upload the response has a signed URL to upload the data to,
+    # the blob is then indexed by POST .../{blob_id}/finalize
     blob_handler = BLOB_HANDLER_CLASSES[full_project_structure.deploy.deploy_type]()
     s_time = time.time()
     blob_id = await blob_handler.insert_blob(full_project_structure, blob)
+    created = Blob.construct(**blob.__dict__, blob_id=blob_id)
+    if direct_upload:
+        try:
+            upload = await blob_handler.create_upload_url(
+                full_project_structure, blob_id, blob.content_type
+            )
+        except BaseException:
+            await blob_handler.delete_blob_from_first_step(blob_id)
+            raise
+        created = BlobDirectUpload.construct(**created.__dict__, upload=upload)
     e_time = time.time()
     await TimeTrackingBigQuery.track_time(
         "create_blob",
@@ -31,7 +71,135 @@ async def create_blob(
         e_time - s_time,
         e_time,
     )
-    return Blob(**blob.dict(), blob_id=blob_id)
+    return created
+
+
+@blob_router.post(
+    "/{project_id}/batch",
+    status_code=status.HTTP_201_CREATED,
+    response_model=list[BlobBatchItemResult],
+)
+async def create_blobs_batch(
+    blobs: list[BlobCreate],
+    full_project_structure: FullProjectStructure = Depends(get_current_project),
+) -> list[BlobBatchItemResult]:
+    if len(blobs) > settings.blob_batch_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.blob_batch_max_size} blobs per batch",
+        )
+    blob_handler = BLOB_HANDLER_CLASSES[full_project_structure.deploy.deploy_type]()
+    s_time = time.time()
+    results = await blob_handler.insert_blobs(full_project_structure, blobs)
+    e_time = time.time()
+    await TimeTrackingBigQuery.track_time(
+        "create_blobs_batch",
+        full_project_structure.deploy.deploy_type,
+        e_time - s_time,
+        e_time,
+        number_of_blobs=len(blobs),
+    )
+    return results
+
+
+async def process_blob_data_batch(
+    blob_handler: BaseBlobHandler,
+    full_project_structure: FullProjectStructure,
+    lines: list[bytes],
+) -> tuple[list[BlobBatchItemResult], int]:
+    results: list[BlobBatchItemResult | None] = []
+    items = []
+    positions = []
+    for line in lines:
+        try:
+            batch_item = BlobDataBatchItem.parse_raw(line)
+            data = base64.b64decode(batch_item.data, validate=True)
+        except (ValidationError, binascii.Error) as e:
+            results.append(BlobBatchItemResult(error=f"Invalid line: {e}"))
+            continue
+
+        headers = {"content-length": str(len(data))}
+        if batch_item.content_type:
+            headers["content-type"] = batch_item.content_type
+        try:
+            processed_data = await GeneralDataProcessor().process_stream(
+                iter_bytes(data, settings.upload_chunk_size), Headers(headers=headers)
+            )
+        except Exception as e:
+            results.append(
+                BlobBatchItemResult(
+                    blob_id=batch_item.blob_id, error=f"Processing failed: {e!r}"
+                )
+            )
+            continue
+        positions.append(len(results))
+        results.append(None)
+        items.append(BlobDataItem(batch_item.blob_id, processed_data))
+
+    if items:
+        item_results = await blob_handler.update_blobs_data(
+            full_project_structure, items
+        )
+        for position, result in zip(positions, item_results):
+            results[position] = result
+    return results, sum(item.processed_data.size for item in items)
+
+
+@blob_router.post(
+    "/{project_id}/batch/data",
+    status_code=status.HTTP_201_CREATED,
+    response_model=list[BlobBatchItemResult],
+)
+async def create_blobs_data_batch(
+    request: Request,
+    full_project_structure: FullProjectStructure = Depends(get_current_project),
+) -> list[BlobBatchItemResult]:
+    # NDJSON body, one {"blob_id", "content_type", "data" (base64)} per line,
+    # results are returned in the order of the lines
+    blob_handler = BLOB_HANDLER_CLASSES[full_project_structure.deploy.deploy_type]()
+    s_time = time.time()
+    results = []
+    content_size = 0
+    lines = []
+    try:
+        async for line in iter_lines(
+            request.stream(), settings.blob_data_batch_max_line_size
+        ):
+            if not line.strip():
+                continue
+            if len(results) + len(lines) >= settings.blob_batch_max_size:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"At most {settings.blob_batch_max_size} blobs per batch",
+                )
+            lines.append(line)
+            if len(lines) >= settings.blob_data_batch_size:
+                batch_results, batch_size = await process_blob_data_batch(
+                    blob_handler, full_project_structure, lines
+                )
+                results.extend(batch_results)
+                content_size += batch_size
+                lines = []
+    except LineTooLongError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)
+        )
+    if lines:
+        batch_results, batch_size = await process_blob_data_batch(
+            blob_handler, full_project_structure, lines
+        )
+        results.extend(batch_results)
+        content_size += batch_size
+    e_time = time.time()
+    await TimeTrackingBigQuery.track_time(
+        "create_blobs_data_batch",
+        full_project_structure.deploy.deploy_type,
+        e_time - s_time,
+        e_time,
+        number_of_blobs=len(results),
+        content_size=content_size,
+    )
+    return results
 
 
 @blob_router.post("/{project_id}/{blob_id}", status_code=status.HTTP_201_CREATED)
@@ -39,42 +207,299 @@ async def create_blob_data(
     blob_id: str,
     request: Request,
     full_project_structure: FullProjectStructure = Depends(get_current_project),
-):
+) -> list[BlobBatchItemResult] | None:
     # TODO:
     blob_handler = BLOB_HANDLER_CLASSES[full_project_structure.deploy.deploy_type]()
     s_time = time.time()
-    processed_data = await GeneralDataProcessor().process_request(request)
+    general_data_processor = GeneralDataProcessor()
+    if (
+        general_data_processor.content_type_to_internal_content_type(
+            request.headers.get("content-type")
+        )
+        == ContentType.MULTIPART_FORM_DATA_CONTENT_TYPE
+    ):
+        # one blob per file of the form, the results are in the form order
+        results = await blob_handler.update_blob_parts(
+            full_project_structure,
+            general_data_processor.iter_form_parts(request.stream(), request.headers),
+            blob_id,
+        )
+        e_time = time.time()
+        await TimeTrackingBigQuery.track_time(
+            "create_blob_data",
+            full_project_structure.deploy.deploy_type,
+            e_time - s_time,
+            e_time,
+            content_type=ContentType.MULTIPART_FORM_DATA_CONTENT_TYPE.value,
+            number_of_blobs=len(results),
+        )
+        return results
+
+    processed_data = await general_data_processor.process_request(request)
     await blob_handler.update_blob_data(full_project_structure, processed_data, blob_id)
     e_time = time.time()
-    system_tags = processed_data.dict()["system_tags"]
-    content_size = None
     content_type = None
-    for st in system_tags:
-        if st["name"] == "content-length":
-            content_size = st["value"]
-        elif st["name"] == "content-type":
-            content_type = st["value"]
+    for st in processed_data.system_tags:
+        if st.name == "content-type":
+            content_type = st.value
     await TimeTrackingBigQuery.track_time(
         "create_blob_data",
         full_project_structure.deploy.deploy_type,
         e_time - s_time,
         e_time,
         content_type=content_type,
-        content_size=content_size,
+        content_size=processed_data.size,
+    )
+
+
+@blob_router.post(
+    "/{project_id}/{blob_id}/finalize", status_code=status.HTTP_201_CREATED
+)
+async def finalize_blob_data(
+    blob_id: str,
+    full_project_structure: FullProjectStructure = Depends(get_current_project),
+):
+    # indexes the data uploaded to the signed URL from create_blob
+    blob_handler = BLOB_HANDLER_CLASSES[full_project_structure.deploy.deploy_type]()
+    s_time = time.time()
+    await blob_handler.finalize_upload(full_project_structure, blob_id)
+    e_time = time.time()
+    await TimeTrackingBigQuery.track_time(
+        "finalize_blob_data",
+        full_project_structure.deploy.deploy_type,
+        e_time - s_time,
+        e_time,
+    )
+
+
+@blob_router.get(
+    "/{project_id}/{blob_id}/download-url",
+    status_code=status.HTTP_200_OK,
+    response_model=SignedUrl,
+)
+async def get_blob_download_url(
+    blob_id: str,
+    full_project_structure: FullProjectStructure = Depends(get_current_project),
+) -> SignedUrl:
+    blob_handler = BLOB_HANDLER_CLASSES[full_project_structure.deploy.deploy_type]()
+    return await blob_handler.create_download_url(full_project_structure, blob_id)
+
+
+def parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    # A single "bytes=" range as an inclusive (start, end), None when the
+    # header is invalid or asks for several ranges so the whole object is
+    # sent. Raises 416 when the range is outside the object.
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    if start >= size or (not first and not int(last)):
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison, as required for If-None-Match
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+@blob_router.get("/{project_id}/{blob_id}/data", status_code=status.HTTP_200_OK)
+async def get_blob_data(
+    blob_id: str,
+    request: Request,
+    full_project_structure: FullProjectStructure = Depends(get_current_project),
+) -> Response:
+    # Streams the stored data in download_chunk_size reads. Compressed data
+    # is sent as stored with a Content-Encoding when the client accepts it,
+    # otherwise it is decoded on the fly and Range requests are ignored.
+    blob_handler = BLOB_HANDLER_CLASSES[full_project_structure.deploy.deploy_type]()
+    s_time = time.time()
+    blob = await blob_handler.get_blob(full_project_structure, blob_id)
+    if blob is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    system_tags = {tag.name: tag.value for tag in blob.system_tags}
+    object_name = system_tags.get("content-ref") or blob_id
+    encoding = system_tags.get("content-encoding")
+    content_type = system_tags.get("content-type") or blob.content_type
+    accept_encoding = request.headers.get("accept-encoding", "")
+    accepted = {value.split(";")[0].strip() for value in accept_encoding.split(",")}
+    decode = bool(encoding) and encoding not in accepted
+
+    etag = f'"{system_tags.get("content-sha256") or blob_id}'
+    etag += f'-{encoding}"' if encoding and not decode else '"'
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    stored_object = await blob_handler.open_object(full_project_structure, object_name)
+    if stored_object is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Blob has no data"
+        )
+
+    status_code = status.HTTP_200_OK
+    start, end = 0, stored_object.size - 1
+    stream = (
+        stored_object.read(start, end) if stored_object.size else iter_bytes(b"", 1)
+    )
+    if decode:
+        stream = decode_stream(stream, encoding)
+    else:
+        headers["Accept-Ranges"] = "bytes"
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        range_header = request.headers.get("range")
+        byte_range = (
+            parse_range(range_header, stored_object.size)
+            if range_header and stored_object.size
+            else None
+        )
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            headers["Content-Range"] = f"bytes {start}-{end}/{stored_object.size}"
+            stream = stored_object.read(start, end)
+        headers["Content-Length"] = str(end - start + 1)
+
+    async def stream_data() -> typing.AsyncIterator[bytes]:
+        content_size = 0
+        async for chunk in stream:
+            content_size += len(chunk)
+            yield chunk
+        e_time = time.time()
+        await TimeTrackingBigQuery.track_time(
+            "get_blob_data",
+            full_project_structure.deploy.deploy_type,
+            e_time - s_time,
+            e_time,
+            content_type=content_type,
+            content_size=content_size,
+        )
+
+    return StreamingResponse(
+        stream_data(),
+        status_code=status_code,
+        media_type=content_type,
+        headers=headers,
     )
 
 
-@blob_router.get("/{project_id}", status_code=status.HTTP_200_OK)
+# query parameters that are not tags
+SEARCH_PARAMS = {"limit", "cursor", "format", "timestamp_from", "timestamp_to"}
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def get_search_tags(request: Request) -> list[Tag]:
+    return [
+        Tag(name=k, value=v)
+        for k, v in request.query_params.items()
+        if k not in SEARCH_PARAMS
+    ]
+
+
+def get_time_range(
+    timestamp_from: datetime.datetime | None = None,
+    timestamp_to: datetime.datetime | None = None,
+) -> TimeRange | None:
+    if timestamp_from is None and timestamp_to is None:
+        return None
+    return TimeRange(timestamp_from=timestamp_from, timestamp_to=timestamp_to)
+
+
+@blob_router.get(
+    "/{project_id}/search/estimate",
+    status_code=status.HTTP_200_OK,
+    response_model=SearchEstimate,
+)
+async def estimate_search(
+    tags: list[Tag] = Depends(get_search_tags),
+    time_range: TimeRange | None = Depends(get_time_range),
+    full_project_structure: FullProjectStructure = Depends(get_current_project),
+) -> SearchEstimate:
+    blob_handler = BLOB_HANDLER_CLASSES[full_project_structure.deploy.deploy_type]()
+    return await blob_handler.estimate_search(full_project_structure, tags, time_range)
+
+
+@blob_router.get(
+    "/{project_id}", status_code=status.HTTP_200_OK, response_model=list[Blob]
+)
 async def search_by_tags(
     request: Request,
+    limit: int | None = Query(None, ge=1, le=settings.search_max_limit),
+    cursor: str | None = None,
+    format: str | None = None,
+    tags: list[Tag] = Depends(get_search_tags),
+    time_range: TimeRange | None = Depends(get_time_range),
     full_project_structure: FullProjectStructure = Depends(get_current_project),
-) -> list[Blob]:
+) -> ORJSONResponse | StreamingResponse:
     # TODO:
     blob_handler = BLOB_HANDLER_CLASSES[full_project_structure.deploy.deploy_type]()
-    tags = [Tag(name=k, value=v) for k, v in request.query_params.items()]
     LOGGER.debug(f"Search tags: {tags}")
     s_time = time.time()
-    response = await blob_handler.search_by_tags(full_project_structure, tags)
+
+    if format == "ndjson" or NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        # results are written out page by page as they are fetched
+        async def stream_results() -> typing.AsyncIterator[bytes]:
+            number_of_blobs = 0
+            async for blob in blob_handler.iter_search_results(
+                full_project_structure,
+                tags,
+                cursor=cursor,
+                limit=limit,
+                time_range=time_range,
+            ):
+                number_of_blobs += 1
+                yield dumps(blob) + b"\n"
+            e_time = time.time()
+            await TimeTrackingBigQuery.track_time(
+                "search_by_tags",
+                full_project_structure.deploy.deploy_type,
+                e_time - s_time,
+                e_time,
+                number_of_tags=len(tags),
+                number_of_blobs=number_of_blobs,
+            )
+
+        return StreamingResponse(stream_results(), media_type=NDJSON_MEDIA_TYPE)
+
+    headers = {}
+    if limit is None and cursor is None:
+        blobs = await blob_handler.search_by_tags(
+            full_project_structure, tags, time_range
+        )
+    else:
+        page = await blob_handler.search_by_tags_page(
+            full_project_structure,
+            tags,
+            limit or settings.search_page_size,
+            cursor,
+            time_range,
+        )
+        blobs = page.blobs
+        if page.next_cursor is not None:
+            headers["X-Next-Cursor"] = page.next_cursor
     e_time = time.time()
 
     await TimeTrackingBigQuery.track_time(
@@ -83,6 +508,6 @@ async def search_by_tags(
         e_time - s_time,
         e_time,
         number_of_tags=len(tags),
-        number_of_blobs=len(response),
+        number_of_blobs=len(blobs),
     )
-    return response
+    return ORJSONResponse(blobs, headers=headers)
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends, status
+
+from api.dependencies import PROJECT_CACHE, get_current_user
+from database.staging_store import get_staging_store
+from shared.blob_data_handlers.client_registry import CLIENT_REGISTRY
+from shared.blob_data_handlers.gcp_data_handlers import gcp_1
+from shared.exiftool_pool import EXIFTOOL_POOL
+from shared.gcp_time_tracking import TimeTrackingBigQuery
+from shared.search_cache import SEARCH_CACHE
+from utils.executors import executors_stats
+
+metrics_router = APIRouter(
+    prefix="/v1/metrics", tags=["metrics"], dependencies=[Depends(get_current_user)]
+)
+
+
+@metrics_router.get("", status_code=status.HTTP_200_OK)
+async def get_metrics() -> dict:
+    return {
+        "project_cache": PROJECT_CACHE.stats(),
+        "search_cache": SEARCH_CACHE.stats(),
+        "staging_store": get_staging_store().stats(),
+        "cloud_clients": CLIENT_REGISTRY.stats(),
+        "gcp_1_rows": {
+            "blobs": gcp_1.BLOB_CACHE.stats(),
+            "data": gcp_1.DATA_CACHE.stats(),
+        },
+        "executors": executors_stats(),
+        "exiftool": EXIFTOOL_POOL.stats(),
+        "time_tracking": TimeTrackingBigQuery.stats(),
+    }
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends, Response, status
+from pydantic import UUID4
+
+from api.dependencies import get_current_user, invalidate_project_cache
+from shared.search_cache import SEARCH_CACHE
+
+project_router = APIRouter(
+    prefix="/v1/projects", tags=["projects"], dependencies=[Depends(get_current_user)]
+)
+
+
+@project_router.post("/{project_id}/invalidate", status_code=status.HTTP_204_NO_CONTENT)
+async def invalidate_project(project_id: UUID4) -> Response:
+    # called by the deploy service when a project or its credentials change,
+    # the next request loads them again
+    invalidate_project_cache(project_id)
+    await SEARCH_CACHE.invalidate_project(str(project_id))
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
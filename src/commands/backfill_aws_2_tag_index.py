@@ -0,0 +1,60 @@
+import argparse
+import json
+
+from api.models import FullProjectStructure
+from shared.blob_data_handlers.aws_data_handlers.aws_2 import (
+    AWSDeployedResources2,
+    build_aws_clients_2,
+    build_tag_items,
+    put_items,
+)
+from utils.logger import setup_logger
+
+LOGGER = setup_logger()
+
+
+def backfill_tag_index(full_project_structure: FullProjectStructure):
+    # writes the tag index items of every blob already in the table, safe to
+    # run again since the items are overwritten
+    deployed_resources = AWSDeployedResources2(
+        **full_project_structure.deploy.project_structure
+    )
+    if deployed_resources.dynamodb_tag_index is None:
+        raise SystemExit("The project has no dynamodb_tag_index table")
+
+    clients = build_aws_clients_2(full_project_structure.credentials)
+    dynamodb_table = clients.dynamodb.Table(deployed_resources.dynamodb.dynamodb_name)
+    tag_table = clients.dynamodb.Table(deployed_resources.dynamodb_tag_index.table_name)
+
+    key_names = [key["AttributeName"] for key in dynamodb_table.key_schema]
+
+    scan_kwargs = {}
+    number_of_blobs = 0
+    while True:
+        res = dynamodb_table.scan(**scan_kwargs)
+        put_items(
+            tag_table,
+            [
+                tag_item
+                for item in res["Items"]
+                for tag_item in build_tag_items(item, key_names)
+            ],
+        )
+        number_of_blobs += len(res["Items"])
+        LOGGER.info(f"Indexed {number_of_blobs} blobs")
+        if "LastEvaluatedKey" not in res:
+            break
+        scan_kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Backfill the tag index table of an AWS_2 project"
+    )
+    parser.add_argument(
+        "project_structure",
+        help="JSON file with the full project structure from the deploy service",
+    )
+    args = parser.parse_args()
+    with open(args.project_structure) as f:
+        backfill_tag_index(FullProjectStructure(**json.load(f)))
@@ -0,0 +1,70 @@
+import argparse
+import json
+
+from google.cloud.bigtable.row import DirectRow
+from google.cloud.bigtable.table import Table
+
+from api.models import FullProjectStructure
+from shared.blob_data_handlers.gcp_data_handlers.gcp_2 import (
+    INDEX_PREFIX,
+    GCPDeployedResources2,
+    build_gcp_clients_2,
+    build_index_rows,
+    row_to_blob,
+)
+from utils.logger import setup_logger
+
+LOGGER = setup_logger()
+
+BATCH_SIZE = 500  # blob rows per mutate_rows call
+
+
+def backfill_tag_index(full_project_structure: FullProjectStructure):
+    # writes the index rows of every blob row already in the table, safe to
+    # run again since the rows are overwritten
+    deployed_resources = GCPDeployedResources2(
+        **full_project_structure.deploy.project_structure
+    )
+    clients = build_gcp_clients_2(full_project_structure.credentials)
+    instance = clients.bigtable.instance(deployed_resources.bigtable.instance)
+    table = instance.table(deployed_resources.bigtable.table)
+
+    number_of_blobs = 0
+    index_rows = []
+    for row in table.read_rows(end_key=INDEX_PREFIX):
+        blob = row_to_blob(row)
+        index_rows.extend(
+            build_index_rows(
+                table,
+                blob.blob_id,
+                [tag.dict() for tag in [*blob.user_tags, *blob.system_tags]],
+            )
+        )
+        number_of_blobs += 1
+        if number_of_blobs % BATCH_SIZE == 0:
+            write_rows(table, index_rows)
+            index_rows = []
+            LOGGER.info(f"Indexed {number_of_blobs} blobs")
+    write_rows(table, index_rows)
+    LOGGER.info(f"Indexed {number_of_blobs} blobs")
+
+
+def write_rows(table: Table, rows: list[DirectRow]):
+    if not rows:
+        return
+    for status in table.mutate_rows(rows):
+        if status.code:
+            raise RuntimeError(f"Failed to write index rows: {status.message}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Backfill the tag index rows of a GCP_2 project"
+    )
+    parser.add_argument(
+        "project_structure",
+        help="JSON file with the full project structure from the deploy service",
+    )
+    args = parser.parse_args()
+    with open(args.project_structure) as f:
+        backfill_tag_index(FullProjectStructure(**json.load(f)))
@@ -8,9 +8,138 @@ class Settings(BaseSettings):
     jwt_secret: str = "SECRET"
     sentry_url: str = None
     deploy_service_base_url: str = "http://datalake-deploy-service:8000"
+    deploy_service_http2: bool = False
+    deploy_service_max_connections: int = 100
+    deploy_service_max_keepalive_connections: int = 20
+    deploy_service_keepalive_expiry: float = 30.0  # seconds
+    deploy_service_timeout: float = 10.0  # seconds
+    deploy_service_connect_timeout: float = 5.0  # seconds
     gcp_credentials_path: str | None = None
     time_tracking_bigquery_dataset: str | None = None
     time_tracking_bigquery_table: str | None = None
+    time_tracking_batch_size: int = 500  # rows per insert call
+    time_tracking_flush_interval: float = 5.0  # seconds
+    time_tracking_queue_size: int = 10000
+    time_tracking_block_when_full: bool = False  # drop rows otherwise
+    time_tracking_sample_rate: float = 1.0
+
+    # FullProjectStructure cache, seconds / entries
+    project_cache_ttl: float = 30.0
+    project_cache_stale_ttl: float = 300.0
+    project_cache_max_size: int = 1024
+
+    # staged blobs without data are removed after this many seconds
+    first_step_ttl: int = 7 * 24 * 60 * 60
+    # write-through cache of staged blobs, 0 disables it
+    staging_cache_max_size: int = 10000
+    staging_cache_ttl: float = 60.0  # seconds
+
+    blob_batch_max_size: int = 1000  # blobs per batch create request
+    # NDJSON bulk data upload, payloads are indexed in batches of this size
+    blob_data_batch_size: int = 100
+    blob_data_batch_max_line_size: int = 16 * 1024 * 1024  # bytes
+    blob_data_batch_upload_concurrency: int = 16
+
+    # search results are fetched from the backends in pages of this size
+    search_page_size: int = 1000
+    search_max_limit: int = 10000  # largest ``limit`` a client can ask for
+    # tag index items read per searched tag to pick the tag to query
+    dynamodb_tag_probe_limit: int = 100
+    bigtable_read_batch_size: int = 500  # row keys per read_rows request
+    bigquery_maximum_bytes_billed: int | None = None  # per search query
+
+    # search result pages, "memory" or "none"
+    search_cache_backend: str = "memory"
+    search_cache_ttl: float = 30.0  # seconds
+    # must be longer than search_cache_ttl
+    search_cache_generation_ttl: float = 24 * 3600.0  # seconds
+    # how long a worker may serve pages cached before a write on another one
+    search_cache_local_generation_ttl: float = 2.0  # seconds
+    search_cache_local_generation_max_size: int = 10000
+    search_cache_max_bytes: int = 64 * 1024 * 1024
+    search_cache_max_entry_bytes: int = 1024 * 1024  # larger pages aren't cached
+
+    # GCP_1 rows read back for the requests of a download, seconds / entries
+    gcp_1_row_cache_ttl: float = 60.0
+    gcp_1_blob_cache_max_size: int = 1024
+    gcp_1_data_cache_max_size: int = 16  # the inline data, up to 10 MB each
+
+    # cloud SDK clients reused across requests
+    cloud_client_registry_max_size: int = 256
+    cloud_client_registry_ttl: float = 3600.0  # seconds
+    cloud_client_max_pool_connections: int = 10  # per client
+    gcp_credentials_cache_max_size: int = 256
+
+    # thread pools for blocking cloud SDK calls
+    aws_executor_max_workers: int = 32
+    gcp_executor_max_workers: int = 32
+    azure_executor_max_workers: int = 16
+    telemetry_executor_max_workers: int = 2
+    file_executor_max_workers: int = 8
+    executor_max_queue: int = 256  # per pool, callers beyond it wait
+    blocking_call_timeout: float | None = 300.0  # seconds
+
+    # exiftool processes kept running in -stay_open mode for JPEG metadata
+    exiftool_pool_size: int = 4
+    exiftool_max_queue: int = 64  # waiting uploads beyond it get a 503
+    exiftool_call_timeout: float = 30.0  # seconds, the process is killed after it
+    exiftool_health_check_interval: float = 60.0  # seconds
+    exiftool_tmp_dir: str | None = None  # /dev/shm when it exists
+    # JSON blobs are stored as received ("passthrough") or re-serialized
+    # compact with sorted keys ("canonicalize")
+    json_ingest_mode: str = "passthrough"
+    json_structural_tags: bool = True  # type, top-level keys, array length
+    json_structural_tags_max_keys: int = 50
+    # JPEG tags stored as system tags, read from the header in process when
+    # the native parser knows them all, by exiftool otherwise. An empty list
+    # stores every tag exiftool finds.
+    jpeg_metadata_tags: list[str] = [
+        "File:ImageWidth",
+        "File:ImageHeight",
+        "EXIF:Make",
+        "EXIF:Model",
+        "EXIF:Orientation",
+        "EXIF:DateTimeOriginal",
+        "EXIF:CreateDate",
+        "EXIF:ModifyDate",
+        "EXIF:GPSLatitude",
+        "EXIF:GPSLongitude",
+        "EXIF:GPSAltitude",
+        "Composite:GPSLatitude",
+        "Composite:GPSLongitude",
+    ]
+    jpeg_header_max_size: int = 256 * 1024  # bytes buffered to find the tags
+
+    # uploads with the same sha256 in a project share one stored object
+    content_dedup_enabled: bool = True
+    content_spool_max_memory: int = 8 * 1024 * 1024  # larger bodies go to disk
+
+    # stored blob data of these content types is compressed, "zstd" (gzip
+    # when zstandard isn't installed), "gzip" or "none"
+    compression_encoding: str = "zstd"
+    compression_content_types: list[str] = [
+        "application/json",
+        "application/x-ndjson",
+        "application/xml",
+        "text/",
+    ]
+    zstd_level: int = 3
+    gzip_level: int = 6
+
+    # each file part of a multipart/form-data upload is stored as a blob
+    multipart_max_parts: int = 100
+    multipart_max_header_size: int = 16 * 1024  # bytes per part
+    multipart_field_max_size: int = 64 * 1024  # bytes per form field value
+
+    # blob data is streamed to the storage in chunks of this size, S3 needs
+    # at least 5 MiB per multipart part, GCS a multiple of 256 KiB
+    upload_chunk_size: int = 8 * 1024 * 1024
+    download_chunk_size: int = 1024 * 1024  # bytes per ranged storage read
+
+    # data uploaded to a signed URL is processed from its first bytes only,
+    # content types that need the whole data are processed up to this size
+    signed_url_expiration: int = 15 * 60  # seconds
+    direct_upload_head_size: int = 256 * 1024
 
 
 settings = Settings()
@@ -0,0 +1,37 @@
+import datetime
+
+from pymongo.errors import DuplicateKeyError
+
+from database.db import get_content_digest_collection
+
+# Per-project map of content digests to the stored object holding that
+# content, so an upload of known content can reference it instead.
+
+
+async def find_object(project_id: str, digest: str) -> tuple[str, str | None] | None:
+    # returns the object name and the encoding it is stored with
+    document = await get_content_digest_collection().find_one(
+        {"project_id": project_id, "digest": digest},
+        projection={"_id": False, "object_name": True, "encoding": True},
+    )
+    if document is None:
+        return None
+    return document["object_name"], document.get("encoding")
+
+
+async def record_object(
+    project_id: str, digest: str, object_name: str, encoding: str | None
+):
+    try:
+        await get_content_digest_collection().insert_one(
+            {
+                "project_id": project_id,
+                "digest": digest,
+                "object_name": object_name,
+                "encoding": encoding,
+                "created_at": datetime.datetime.utcnow(),
+            }
+        )
+    except DuplicateKeyError:
+        # a concurrent upload of the same content recorded its object first
+        pass
@@ -1,13 +1,73 @@
+import datetime
+
 import motor.motor_asyncio
+from pymongo.errors import OperationFailure
 
 from config import settings
+from utils.logger import setup_logger
+
+LOGGER = setup_logger()
 
 client = motor.motor_asyncio.AsyncIOMotorClient(
     settings.database_url, uuidRepresentation="standard"
 )
 db = client[settings.database_name]
 first_step_collection = db["first_step_collection"]
+content_digest_collection = db["content_digest_collection"]
+search_generation_collection = db["search_generation_collection"]
+
+# staged records are returned without the Mongo and bookkeeping fields
+FIRST_STEP_PROJECTION = {"_id": False, "created_at": False}
 
 
 def get_first_step_collection():
     return first_step_collection
+
+
+def get_content_digest_collection():
+    return content_digest_collection
+
+
+def get_search_generation_collection():
+    return search_generation_collection
+
+
+async def ensure_ttl_index(collection, field: str, ttl: float):
+    try:
+        await collection.create_index(field, expireAfterSeconds=int(ttl))
+    except OperationFailure:
+        # the index exists with another TTL
+        await db.command(
+            "collMod",
+            collection.name,
+            index={"keyPattern": {field: 1}, "expireAfterSeconds": int(ttl)},
+        )
+
+
+async def ensure_first_step_indexes():
+    await first_step_collection.create_index("id", unique=True)
+    # blobs that never get their data are removed after the TTL
+    await ensure_ttl_index(first_step_collection, "created_at", settings.first_step_ttl)
+    # records staged before the TTL index existed expire a TTL from now
+    await first_step_collection.update_many(
+        {"created_at": {"$exists": False}},
+        {"$set": {"created_at": datetime.datetime.utcnow()}},
+    )
+    LOGGER.info("first_step_collection indexes are in place")
+
+
+async def ensure_content_digest_indexes():
+    await content_digest_collection.create_index(
+        [("project_id", 1), ("digest", 1)], unique=True
+    )
+    LOGGER.info("content_digest_collection indexes are in place")
+
+
+async def ensure_search_generation_indexes():
+    # projects without writes for the TTL go back to the initial generation
+    await ensure_ttl_index(
+        search_generation_collection,
+        "updated_at",
+        settings.search_cache_generation_ttl,
+    )
+    LOGGER.info("search_generation_collection indexes are in place")
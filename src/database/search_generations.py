@@ -0,0 +1,32 @@
+import datetime
+import uuid
+
+from database.db import get_search_generation_collection
+
+# Per-project search cache generations, shared by all the workers. A bump sets
+# a new random generation rather than incrementing it, so a generation that
+# expired and is bumped again never matches pages cached before.
+
+INITIAL_GENERATION = "0"
+
+
+async def get_generation(project_id: str) -> str:
+    document = await get_search_generation_collection().find_one(
+        {"_id": project_id}, projection={"generation": True}
+    )
+    return document["generation"] if document is not None else INITIAL_GENERATION
+
+
+async def bump_generation(project_id: str) -> str:
+    generation = uuid.uuid4().hex
+    await get_search_generation_collection().update_one(
+        {"_id": project_id},
+        {
+            "$set": {
+                "generation": generation,
+                "updated_at": datetime.datetime.utcnow(),
+            }
+        },
+        upsert=True,
+    )
+    return generation
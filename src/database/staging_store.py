@@ -0,0 +1,213 @@
+import time
+from collections import OrderedDict
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from config import settings
+from database.db import FIRST_STEP_PROJECTION, get_first_step_collection
+from utils.logger import setup_logger
+
+LOGGER = setup_logger()
+
+
+def _public(document: dict) -> dict:
+    return {k: v for k, v in document.items() if k not in FIRST_STEP_PROJECTION.keys()}
+
+
+class StagingStore:
+    # Blob metadata between create_blob and the upload of its data. get*
+    # return records without the bookkeeping fields, consume returns the
+    # full record so it can be restored.
+
+    async def insert(self, document: dict):
+        raise NotImplementedError()
+
+    async def insert_many(self, documents: list[dict]) -> dict[int, str]:
+        # returns the errors by document index
+        raise NotImplementedError()
+
+    async def get(self, blob_id: str) -> dict | None:
+        raise NotImplementedError()
+
+    async def get_many(self, blob_ids: list[str]) -> dict[str, dict]:
+        raise NotImplementedError()
+
+    async def consume(self, blob_id: str) -> dict | None:
+        raise NotImplementedError()
+
+    async def restore(self, document: dict):
+        raise NotImplementedError()
+
+    async def delete(self, blob_id: str):
+        raise NotImplementedError()
+
+    async def delete_many(self, blob_ids: list[str]):
+        raise NotImplementedError()
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MongoStagingStore(StagingStore):
+    async def insert(self, document: dict):
+        await get_first_step_collection().insert_one(dict(document))
+
+    async def insert_many(self, documents: list[dict]) -> dict[int, str]:
+        errors = {}
+        try:
+            # unordered, so one failed document doesn't stop the rest
+            await get_first_step_collection().insert_many(
+                [dict(document) for document in documents], ordered=False
+            )
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                errors[write_error["index"]] = write_error.get("errmsg", "Write error")
+        return errors
+
+    async def get(self, blob_id: str) -> dict | None:
+        return await get_first_step_collection().find_one(
+            {"id": blob_id}, projection=FIRST_STEP_PROJECTION
+        )
+
+    async def get_many(self, blob_ids: list[str]) -> dict[str, dict]:
+        blobs = {}
+        async for blob_d in get_first_step_collection().find(
+            {"id": {"$in": blob_ids}}, projection=FIRST_STEP_PROJECTION
+        ):
+            blobs[blob_d["id"]] = blob_d
+        return blobs
+
+    async def consume(self, blob_id: str) -> dict | None:
+        # reads and removes the record in one round trip, a concurrent
+        # consumer of the same blob gets None
+        return await get_first_step_collection().find_one_and_delete(
+            {"id": blob_id}, projection={"_id": False}
+        )
+
+    async def restore(self, document: dict):
+        try:
+            await get_first_step_collection().insert_one(dict(document))
+        except DuplicateKeyError:
+            pass
+
+    async def delete(self, blob_id: str):
+        await get_first_step_collection().delete_one({"id": blob_id})
+
+    async def delete_many(self, blob_ids: list[str]):
+        await get_first_step_collection().delete_many({"id": {"$in": blob_ids}})
+
+
+class _CacheEntry:
+    __slots__ = ("document", "expires_at")
+
+    def __init__(self, document: dict, expires_at: float):
+        self.document = document
+        self.expires_at = expires_at
+
+
+class CachedStagingStore(StagingStore):
+    # Write-through LRU + TTL cache in front of another store, for the reads
+    # of the records this worker created. A consume goes to the backing store,
+    # which decides which worker gets a record: the atomic read and delete
+    # there is one round trip whether the record is cached or not.
+
+    def __init__(self, store: StagingStore, max_size: int, ttl: float):
+        self.store = store
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def insert(self, document: dict):
+        await self.store.insert(document)
+        self._put(document)
+
+    async def insert_many(self, documents: list[dict]) -> dict[int, str]:
+        errors = await self.store.insert_many(documents)
+        for i, document in enumerate(documents):
+            if i not in errors:
+                self._put(document)
+        return errors
+
+    async def get(self, blob_id: str) -> dict | None:
+        document = self._get(blob_id)
+        if document is not None:
+            return _public(document)
+        return await self.store.get(blob_id)
+
+    async def get_many(self, blob_ids: list[str]) -> dict[str, dict]:
+        blobs = {}
+        missing = []
+        for blob_id in blob_ids:
+            document = self._get(blob_id)
+            if document is not None:
+                blobs[blob_id] = _public(document)
+            else:
+                missing.append(blob_id)
+        if missing:
+            blobs.update(await self.store.get_many(missing))
+        return blobs
+
+    async def consume(self, blob_id: str) -> dict | None:
+        self._entries.pop(blob_id, None)
+        return await self.store.consume(blob_id)
+
+    async def restore(self, document: dict):
+        await self.store.restore(document)
+        self._put(document)
+
+    async def delete(self, blob_id: str):
+        self._entries.pop(blob_id, None)
+        await self.store.delete(blob_id)
+
+    async def delete_many(self, blob_ids: list[str]):
+        for blob_id in blob_ids:
+            self._entries.pop(blob_id, None)
+        await self.store.delete_many(blob_ids)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _put(self, document: dict):
+        self._entries[document["id"]] = _CacheEntry(
+            _public(document) | {"created_at": document.get("created_at")},
+            time.monotonic() + self.ttl,
+        )
+        self._entries.move_to_end(document["id"])
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _get(self, blob_id: str) -> dict | None:
+        entry = self._entries.get(blob_id)
+        if entry is None or entry.expires_at <= time.monotonic():
+            self._entries.pop(blob_id, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(blob_id)
+        self.hits += 1
+        return entry.document
+
+
+def get_staging_store() -> StagingStore:
+    return STAGING_STORE
+
+
+STAGING_STORE: StagingStore = (
+    CachedStagingStore(
+        MongoStagingStore(),
+        max_size=settings.staging_cache_max_size,
+        ttl=settings.staging_cache_ttl,
+    )
+    if settings.staging_cache_max_size > 0
+    else MongoStagingStore()
+)
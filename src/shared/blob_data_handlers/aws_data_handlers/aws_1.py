@@ -1,13 +1,33 @@
+import typing
+
 from boto3 import client
 from botocore.client import Config
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy import NotFoundError, OpenSearch, RequestsHttpConnection
 from pydantic import BaseModel
 from requests_aws4auth import AWS4Auth
 
-from api.models import Blob, FullProjectStructure, Tag
+from api.models import (
+    AWSCredentials,
+    Blob,
+    FullProjectStructure,
+    ServiceProviderType,
+    SignedUrl,
+    Tag,
+    TimeRange,
+)
+from config import settings
 from shared.blob_data_handlers.base import BaseBlobHandler
+from shared.blob_data_handlers.downloads import (
+    StoredObject,
+    iter_s3_object,
+    stat_s3_object,
+)
+from shared.blob_data_handlers.signed_urls import sign_s3_url
+from shared.blob_data_handlers.uploads import delete_s3_objects, upload_stream_to_s3
 from shared.data_processors.base_data_processor import ProcessedData
+from utils.http import mount_pool_adapter
 from utils.logger import setup_logger
+from utils.streams import ByteStream
 
 LOGGER = setup_logger()
 
@@ -26,73 +46,205 @@ class AWSDeployedResources1(BaseModel):
     opensearch: OpenSearchResource
 
 
+class AWSClients1(typing.NamedTuple):
+    s3: typing.Any
+    search: OpenSearch
+
+
+def build_aws_clients_1(
+    credentials: AWSCredentials, opensearch_endpoint: str
+) -> AWSClients1:
+    s3_client = client(
+        "s3",
+        aws_access_key_id=credentials.access_key_id,
+        aws_secret_access_key=credentials.secret_access_key,
+        # TODO:
+        config=Config(
+            region_name="us-east-1",
+            max_pool_connections=settings.cloud_client_max_pool_connections,
+        ),
+    )
+    awsauth = AWS4Auth(
+        credentials.access_key_id,
+        credentials.secret_access_key,
+        "us-east-1",
+        "es",
+        session_token=None,
+    )
+    search = OpenSearch(
+        hosts=[{"host": opensearch_endpoint, "port": 443}],
+        http_auth=awsauth,
+        use_ssl=True,
+        verify_certs=True,
+        connection_class=RequestsHttpConnection,
+    )
+    for connection in search.transport.connection_pool.connections:
+        mount_pool_adapter(
+            connection.session, settings.cloud_client_max_pool_connections
+        )
+    return AWSClients1(s3=s3_client, search=search)
+
+
 class AWSBlobHandler1(BaseBlobHandler):
-    async def update_blob_data(
+    service_provider = ServiceProviderType.AWS
+
+    def lease_aws_clients(
+        self,
+        full_project_structure: FullProjectStructure,
+        deployed_resources: AWSDeployedResources1,
+    ) -> typing.AsyncContextManager[AWSClients1]:
+        endpoint = deployed_resources.opensearch.endpoint
+        return self.lease_clients(
+            full_project_structure,
+            lambda: build_aws_clients_1(full_project_structure.credentials, endpoint),
+            endpoint,
+        )
+
+    async def upload_object(
         self,
         full_project_structure: FullProjectStructure,
-        processed_data: ProcessedData,
-        blob_id: str,
+        object_name: str,
+        stream: ByteStream,
     ):
-        blob_d = await self.get_blob_from_first_step(blob_id)
         deployed_resources = AWSDeployedResources1(
             **full_project_structure.deploy.project_structure
         )
-        kwargs = {
-            "aws_access_key_id": full_project_structure.credentials.access_key_id,
-            "aws_secret_access_key": full_project_structure.credentials.secret_access_key,
-            # TODO:
-            "config": Config(region_name="us-east-1"),
-        }
-        s3_client = client("s3", **kwargs)
+        async with self.lease_aws_clients(
+            full_project_structure, deployed_resources
+        ) as clients:
+            await upload_stream_to_s3(
+                self.run_blocking,
+                clients.s3,
+                deployed_resources.s3.bucket_name,
+                object_name,
+                stream,
+            )
 
-        s3_client.put_object(
-            Body=processed_data.data,
-            Bucket=deployed_resources.s3.bucket_name,
-            Key=blob_id,
+    async def delete_objects(
+        self, full_project_structure: FullProjectStructure, object_names: list[str]
+    ):
+        deployed_resources = AWSDeployedResources1(
+            **full_project_structure.deploy.project_structure
         )
+        async with self.lease_aws_clients(
+            full_project_structure, deployed_resources
+        ) as clients:
+            await delete_s3_objects(
+                self.run_blocking,
+                clients.s3,
+                deployed_resources.s3.bucket_name,
+                object_names,
+            )
 
-        awsauth = AWS4Auth(
-            full_project_structure.credentials.access_key_id,
-            full_project_structure.credentials.secret_access_key,
-            "us-east-1",
-            "es",
-            session_token=None,
-        )
-        search = OpenSearch(
-            hosts=[{"host": deployed_resources.opensearch.endpoint, "port": 443}],
-            http_auth=awsauth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection,
-        )
-        system_tags = processed_data.dict()["system_tags"]
+    def build_document(
+        self, blob_d: dict, processed_data: ProcessedData, blob_id: str
+    ) -> dict:
+        system_tags = [tag.dict() for tag in processed_data.system_tags]
         blob_d["system_tags"] = system_tags
 
         for st in system_tags:
             if st["name"] == "content-length":
                 blob_d["size"] = st["value"]
-        search.index(index="test", doc_type="_doc", body=blob_d, id=blob_id)
-        await self.delete_blob_from_first_step(blob_id)
+        return blob_d
 
-    async def search_by_tags(
-        self, full_project_structure: FullProjectStructure, tags: list[Tag]
-    ) -> list[Blob]:
+    async def index_documents(
+        self, full_project_structure: FullProjectStructure, documents: list[dict]
+    ) -> list[str | None]:
         deployed_resources = AWSDeployedResources1(
             **full_project_structure.deploy.project_structure
         )
-        awsauth = AWS4Auth(
-            full_project_structure.credentials.access_key_id,
-            full_project_structure.credentials.secret_access_key,
-            "us-east-1",
-            "es",
-            session_token=None,
+        body = []
+        for document in documents:
+            body.append({"index": {"_index": "test", "_id": document["id"]}})
+            body.append(document)
+        async with self.lease_aws_clients(
+            full_project_structure, deployed_resources
+        ) as clients:
+            response = await self.run_blocking(clients.search.bulk, body=body)
+
+        if not response["errors"]:
+            return [None] * len(documents)
+        errors = []
+        for item in response["items"]:
+            error = item["index"].get("error")
+            errors.append(f"{error['type']}: {error.get('reason')}" if error else None)
+        return errors
+
+    async def get_blob(
+        self, full_project_structure: FullProjectStructure, blob_id: str
+    ) -> Blob | None:
+        deployed_resources = AWSDeployedResources1(
+            **full_project_structure.deploy.project_structure
         )
-        search = OpenSearch(
-            hosts=[{"host": deployed_resources.opensearch.endpoint, "port": 443}],
-            http_auth=awsauth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection,
+        async with self.lease_aws_clients(
+            full_project_structure, deployed_resources
+        ) as clients:
+            try:
+                response = await self.run_blocking(
+                    clients.search.get, index="test", id=blob_id
+                )
+            except NotFoundError:
+                return None
+        return Blob.from_document(response["_source"])
+
+    async def open_object(
+        self, full_project_structure: FullProjectStructure, object_name: str
+    ) -> StoredObject | None:
+        deployed_resources = AWSDeployedResources1(
+            **full_project_structure.deploy.project_structure
+        )
+        bucket = deployed_resources.s3.bucket_name
+        async with self.lease_aws_clients(
+            full_project_structure, deployed_resources
+        ) as clients:
+            size = await stat_s3_object(
+                self.run_blocking, clients.s3, bucket, object_name
+            )
+        if size is None:
+            return None
+
+        async def read(start: int, end: int) -> ByteStream:
+            async with self.lease_aws_clients(
+                full_project_structure, deployed_resources
+            ) as clients:
+                async for chunk in iter_s3_object(
+                    self.run_blocking, clients.s3, bucket, object_name, start, end
+                ):
+                    yield chunk
+
+        return StoredObject(size, read)
+
+    async def sign_object_url(
+        self,
+        full_project_structure: FullProjectStructure,
+        object_name: str,
+        method: str,
+        content_type: str | None = None,
+    ) -> SignedUrl:
+        deployed_resources = AWSDeployedResources1(
+            **full_project_structure.deploy.project_structure
+        )
+        async with self.lease_aws_clients(
+            full_project_structure, deployed_resources
+        ) as clients:
+            return sign_s3_url(
+                clients.s3,
+                deployed_resources.s3.bucket_name,
+                object_name,
+                method,
+                content_type,
+            )
+
+    async def search_page(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        limit: int,
+        state: dict | None,
+        time_range: TimeRange | None = None,
+    ) -> tuple[list[Blob], dict | None]:
+        deployed_resources = AWSDeployedResources1(
+            **full_project_structure.deploy.project_structure
         )
         must_query = []
         for t in tags:
@@ -120,13 +272,26 @@ class AWSBlobHandler1(BaseBlobHandler):
                     }
                 }
             )
-        response = search.search(
-            index="test",
-            doc_type="_doc",
-            body={"query": {"bool": {"must": must_query}}},
-            size=1500,
-        )
-        return [
-            Blob(**hit["_source"], blob_id=hit["_source"]["id"])
-            for hit in response["hits"]["hits"]
-        ]
+        query = {
+            "query": {"bool": {"must": must_query}},
+            # search_after needs a unique sort key
+            "sort": [{"id.keyword": "asc"}],
+            "track_total_hits": False,
+        }
+        if state is not None:
+            query["search_after"] = state["search_after"]
+        async with self.lease_aws_clients(
+            full_project_structure, deployed_resources
+        ) as clients:
+            response = await self.run_blocking(
+                clients.search.search,
+                index="test",
+                doc_type="_doc",
+                body=query,
+                size=limit,
+            )
+        hits = response["hits"]["hits"]
+        next_state = None
+        if len(hits) == limit:
+            next_state = {"search_after": hits[-1]["sort"]}
+        return [Blob.from_document(hit["_source"]) for hit in hits], next_state
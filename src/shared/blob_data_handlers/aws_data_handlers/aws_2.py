@@ -1,12 +1,36 @@
+import asyncio
+import time
+import typing
+from urllib.parse import quote
+
 from boto3 import client, resource
-from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Attr, Key
 from botocore.client import Config
 from pydantic import BaseModel
 
-from api.models import Blob, FullProjectStructure, Tag
+from api.models import (
+    AWSCredentials,
+    Blob,
+    FullProjectStructure,
+    ServiceProviderType,
+    SignedUrl,
+    Tag,
+    TimeRange,
+)
+from config import settings
 from shared.blob_data_handlers.base import BaseBlobHandler
+from shared.blob_data_handlers.client_registry import credentials_fingerprint
+from shared.blob_data_handlers.downloads import (
+    StoredObject,
+    iter_s3_object,
+    stat_s3_object,
+)
+from shared.blob_data_handlers.signed_urls import sign_s3_url
+from shared.blob_data_handlers.uploads import delete_s3_objects, upload_stream_to_s3
 from shared.data_processors.base_data_processor import ProcessedData
+from utils.cache import AsyncTTLCache
 from utils.logger import setup_logger
+from utils.streams import ByteStream
 
 LOGGER = setup_logger()
 
@@ -19,58 +43,385 @@ class DynamoDBResource(BaseModel):
     dynamodb_name: str
 
 
+class DynamoDBTagIndexResource(BaseModel):
+    # partition key "tag", sort key "blob_id"
+    table_name: str
+
+
 class AWSDeployedResources2(BaseModel):
     s3: S3DeployedResource
     dynamodb: DynamoDBResource
+    dynamodb_tag_index: DynamoDBTagIndexResource | None = None
+
+
+class AWSClients2(typing.NamedTuple):
+    s3: typing.Any
+    dynamodb: typing.Any
+
+
+def build_aws_clients_2(credentials: AWSCredentials) -> AWSClients2:
+    kwargs = {
+        "aws_access_key_id": credentials.access_key_id,
+        "aws_secret_access_key": credentials.secret_access_key,
+        # TODO:
+        "config": Config(
+            region_name="us-east-1",
+            max_pool_connections=settings.cloud_client_max_pool_connections,
+        ),
+    }
+    return AWSClients2(
+        s3=client("s3", **kwargs), dynamodb=resource("dynamodb", **kwargs)
+    )
+
+
+def put_items(dynamodb_table: typing.Any, items: list[dict]):
+    # BatchWriteItem requests of up to 25 items
+    with dynamodb_table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+
+
+def tag_key(name: str, value: str | None) -> str:
+    return f"{quote(name, safe='')}#{quote(value or '', safe='')}"
+
+
+def build_tag_items(document: dict, key_names: list[str]) -> list[dict]:
+    # one small item per tag of the blob with the key of the blob item, the
+    # blobs are then read with BatchGetItem
+    keys = {
+        tag_key(tag["name"], tag.get("value"))
+        for tag in [*document.get("user_tags", []), *document.get("system_tags", [])]
+    }
+    blob_key = {name: document[name] for name in key_names}
+    return [
+        {"tag": key, "blob_id": document["id"], "blob_key": blob_key}
+        for key in sorted(keys)
+    ]
+
+
+def has_tags(item: dict, tags: list[Tag]) -> bool:
+    # legacy items may lack either tag list
+    item_tags = [*item.get("user_tags", []), *item.get("system_tags", [])]
+    return all({"name": tag.name, "value": tag.value} in item_tags for tag in tags)
+
+
+def probe_tag_items(tag_table: typing.Any, key: str, limit: int) -> int:
+    # reads at most limit of the small tag items, enough to tell a selective
+    # tag from a common one for a few read units
+    res = tag_table.query(
+        KeyConditionExpression=Key("tag").eq(key), Select="COUNT", Limit=limit
+    )
+    return res["Count"]
+
+
+def get_items(dynamodb: typing.Any, table_name: str, keys: list[dict]) -> list[dict]:
+    # BatchGetItem requests of up to 100 keys, unprocessed keys are retried
+    items = []
+    for start in range(0, len(keys), 100):
+        request_items = {table_name: {"Keys": keys[start : start + 100]}}
+        attempt = 0
+        while request_items:
+            if attempt:
+                time.sleep(min(0.05 * 2**attempt, 1.0))
+            res = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(res["Responses"].get(table_name, []))
+            request_items = res.get("UnprocessedKeys") or {}
+            attempt += 1
+    return items
+
+
+def item_to_blob(item: dict) -> Blob:
+    return Blob.from_document(item)
+
+
+# (credentials fingerprint, table name) -> key attribute names, kept as long
+# as the clients that loaded them
+KEY_NAMES_CACHE: AsyncTTLCache[tuple[str, str], list[str]] = AsyncTTLCache(
+    max_size=settings.cloud_client_registry_max_size,
+    ttl=settings.cloud_client_registry_ttl,
+)
 
 
 class AWSBlobHandler2(BaseBlobHandler):
-    async def update_blob_data(
+    service_provider = ServiceProviderType.AWS
+
+    def lease_aws_clients(
+        self, full_project_structure: FullProjectStructure
+    ) -> typing.AsyncContextManager[AWSClients2]:
+        return self.lease_clients(
+            full_project_structure,
+            lambda: build_aws_clients_2(full_project_structure.credentials),
+        )
+
+    async def upload_object(
         self,
         full_project_structure: FullProjectStructure,
-        processed_data: ProcessedData,
-        blob_id: str,
+        object_name: str,
+        stream: ByteStream,
     ):
-        blob_d = await self.get_blob_from_first_step(blob_id)
         deployed_resources = AWSDeployedResources2(
             **full_project_structure.deploy.project_structure
         )
-        kwargs = {
-            "aws_access_key_id": full_project_structure.credentials.access_key_id,
-            "aws_secret_access_key": full_project_structure.credentials.secret_access_key,
-            # TODO:
-            "config": Config(region_name="us-east-1"),
+        async with self.lease_aws_clients(full_project_structure) as clients:
+            await upload_stream_to_s3(
+                self.run_blocking,
+                clients.s3,
+                deployed_resources.s3.bucket_name,
+                object_name,
+                stream,
+            )
+
+    async def delete_objects(
+        self, full_project_structure: FullProjectStructure, object_names: list[str]
+    ):
+        deployed_resources = AWSDeployedResources2(
+            **full_project_structure.deploy.project_structure
+        )
+        async with self.lease_aws_clients(full_project_structure) as clients:
+            await delete_s3_objects(
+                self.run_blocking,
+                clients.s3,
+                deployed_resources.s3.bucket_name,
+                object_names,
+            )
+
+    def build_document(
+        self, blob_d: dict, processed_data: ProcessedData, blob_id: str
+    ) -> dict:
+        return {
+            "system_tags": [tag.dict() for tag in processed_data.system_tags],
+            **blob_d,
         }
-        s3_client = client("s3", **kwargs)
-        dynamodb = resource("dynamodb", **kwargs)
-        dynamodb_table = dynamodb.Table(deployed_resources.dynamodb.dynamodb_name)
-
-        s3_client.put_object(
-            Body=processed_data.data,
-            Bucket=deployed_resources.s3.bucket_name,
-            Key=blob_id,
+
+    async def index_documents(
+        self, full_project_structure: FullProjectStructure, documents: list[dict]
+    ) -> list[str | None]:
+        deployed_resources = AWSDeployedResources2(
+            **full_project_structure.deploy.project_structure
+        )
+        async with self.lease_aws_clients(full_project_structure) as clients:
+            dynamodb_table = clients.dynamodb.Table(
+                deployed_resources.dynamodb.dynamodb_name
+            )
+            LOGGER.debug(f"DynamoDB items: {documents}")
+            await self.run_blocking(put_items, dynamodb_table, documents)
+            if deployed_resources.dynamodb_tag_index is not None:
+                key_names = await self.get_key_names(
+                    full_project_structure, dynamodb_table
+                )
+                tag_table = clients.dynamodb.Table(
+                    deployed_resources.dynamodb_tag_index.table_name
+                )
+                tag_items = [
+                    tag_item
+                    for document in documents
+                    for tag_item in build_tag_items(document, key_names)
+                ]
+                await self.run_blocking(put_items, tag_table, tag_items)
+        # the batch writer retries unprocessed items, so the batch either
+        # succeeds as a whole or raises
+        return [None] * len(documents)
+
+    async def get_key_names(
+        self, full_project_structure: FullProjectStructure, dynamodb_table: typing.Any
+    ) -> list[str]:
+        async def load_key_names() -> list[str]:
+            # loading the key schema is a DescribeTable call
+            return await self.run_blocking(
+                lambda: [key["AttributeName"] for key in dynamodb_table.key_schema]
+            )
+
+        return await KEY_NAMES_CACHE.get_or_load(
+            (
+                credentials_fingerprint(full_project_structure.credentials),
+                dynamodb_table.name,
+            ),
+            load_key_names,
+        )
+
+    async def get_blob(
+        self, full_project_structure: FullProjectStructure, blob_id: str
+    ) -> Blob | None:
+        deployed_resources = AWSDeployedResources2(
+            **full_project_structure.deploy.project_structure
+        )
+        async with self.lease_aws_clients(full_project_structure) as clients:
+            dynamodb_table = clients.dynamodb.Table(
+                deployed_resources.dynamodb.dynamodb_name
+            )
+            key_names = await self.get_key_names(full_project_structure, dynamodb_table)
+            if key_names[0] == "id":
+                res = await self.run_blocking(
+                    dynamodb_table.query,
+                    KeyConditionExpression=Key("id").eq(blob_id),
+                    Limit=1,
+                )
+                items = res["Items"]
+            else:
+                # the table isn't keyed by id
+                items = []
+                scan_kwargs = {"FilterExpression": Attr("id").eq(blob_id)}
+                while not items:
+                    res = await self.run_blocking(dynamodb_table.scan, **scan_kwargs)
+                    items = res["Items"]
+                    if "LastEvaluatedKey" not in res:
+                        break
+                    scan_kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+        return item_to_blob(items[0]) if items else None
+
+    async def open_object(
+        self, full_project_structure: FullProjectStructure, object_name: str
+    ) -> StoredObject | None:
+        deployed_resources = AWSDeployedResources2(
+            **full_project_structure.deploy.project_structure
         )
+        bucket = deployed_resources.s3.bucket_name
+        async with self.lease_aws_clients(full_project_structure) as clients:
+            size = await stat_s3_object(
+                self.run_blocking, clients.s3, bucket, object_name
+            )
+        if size is None:
+            return None
+
+        async def read(start: int, end: int) -> ByteStream:
+            async with self.lease_aws_clients(full_project_structure) as clients:
+                async for chunk in iter_s3_object(
+                    self.run_blocking, clients.s3, bucket, object_name, start, end
+                ):
+                    yield chunk
 
-        item = {"system_tags": processed_data.dict()["system_tags"], **blob_d}
-        LOGGER.debug(f"DynamoDB item: {item}")
-        dynamodb_table.put_item(Item=item)
-        await self.delete_blob_from_first_step(blob_id)
+        return StoredObject(size, read)
 
-    async def search_by_tags(
-        self, full_project_structure: FullProjectStructure, tags: list[Tag]
-    ) -> list[Blob]:
+    async def sign_object_url(
+        self,
+        full_project_structure: FullProjectStructure,
+        object_name: str,
+        method: str,
+        content_type: str | None = None,
+    ) -> SignedUrl:
+        deployed_resources = AWSDeployedResources2(
+            **full_project_structure.deploy.project_structure
+        )
+        async with self.lease_aws_clients(full_project_structure) as clients:
+            return sign_s3_url(
+                clients.s3,
+                deployed_resources.s3.bucket_name,
+                object_name,
+                method,
+                content_type,
+            )
+
+    async def search_page(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        limit: int,
+        state: dict | None,
+        time_range: TimeRange | None = None,
+    ) -> tuple[list[Blob], dict | None]:
         deployed_resources = AWSDeployedResources2(
             **full_project_structure.deploy.project_structure
         )
-        kwargs = {
-            "aws_access_key_id": full_project_structure.credentials.access_key_id,
-            "aws_secret_access_key": full_project_structure.credentials.secret_access_key,
-            # TODO:
-            "config": Config(region_name="us-east-1"),
+        if tags and deployed_resources.dynamodb_tag_index is not None:
+            items, next_state = await self.query_tag_index(
+                full_project_structure, deployed_resources, tags, limit, state
+            )
+        else:
+            items, next_state = await self.scan_table(
+                full_project_structure, deployed_resources, tags, limit, state
+            )
+        return [item_to_blob(item) for item in items], next_state
+
+    async def query_tag_index(
+        self,
+        full_project_structure: FullProjectStructure,
+        deployed_resources: AWSDeployedResources2,
+        tags: list[Tag],
+        limit: int,
+        state: dict | None,
+    ) -> tuple[list[dict], dict | None]:
+        async with self.lease_aws_clients(full_project_structure) as clients:
+            tag_table = clients.dynamodb.Table(
+                deployed_resources.dynamodb_tag_index.table_name
+            )
+            if state is None:
+                # query the tag with the fewest blobs, the other tags are
+                # checked on the returned items
+                keys = [tag_key(tag.name, tag.value) for tag in tags]
+                counts = await asyncio.gather(
+                    *(
+                        self.run_blocking(
+                            probe_tag_items,
+                            tag_table,
+                            key,
+                            settings.dynamodb_tag_probe_limit,
+                        )
+                        for key in keys
+                    )
+                )
+                if min(counts) == 0:
+                    return [], None
+                key = keys[counts.index(min(counts))]
+                last_key = None
+            else:
+                key = state["tag"]
+                last_key = state["last_key"]
+
+            items = []
+            while True:
+                query_kwargs = {
+                    "KeyConditionExpression": Key("tag").eq(key),
+                    "Limit": settings.search_page_size,
+                }
+                if last_key is not None:
+                    query_kwargs["ExclusiveStartKey"] = last_key
+                res = await self.run_blocking(tag_table.query, **query_kwargs)
+                blobs = await self.read_tag_items(
+                    clients, deployed_resources, res["Items"]
+                )
+                items.extend(blob for blob in blobs if has_tags(blob, tags))
+                last_key = res.get("LastEvaluatedKey")
+                if len(items) >= limit or last_key is None:
+                    break
+
+        if len(items) > limit:
+            items = items[:limit]
+            last_key = {"tag": key, "blob_id": items[-1]["id"]}
+        if last_key is None:
+            return items, None
+        return items, {"tag": key, "last_key": last_key}
+
+    async def read_tag_items(
+        self,
+        clients: AWSClients2,
+        deployed_resources: AWSDeployedResources2,
+        tag_items: list[dict],
+    ) -> list[dict]:
+        # the blob items in the order of the tag items
+        table_name = deployed_resources.dynamodb.dynamodb_name
+        blobs = {
+            item["id"]: item
+            for item in await self.run_blocking(
+                get_items,
+                clients.dynamodb,
+                table_name,
+                [tag_item["blob_key"] for tag_item in tag_items],
+            )
         }
-        dynamodb = resource("dynamodb", **kwargs)
-        dynamodb_table = dynamodb.Table(deployed_resources.dynamodb.dynamodb_name)
+        return [
+            blobs[tag_item["blob_id"]]
+            for tag_item in tag_items
+            if tag_item["blob_id"] in blobs
+        ]
 
+    async def scan_table(
+        self,
+        full_project_structure: FullProjectStructure,
+        deployed_resources: AWSDeployedResources2,
+        tags: list[Tag],
+        limit: int,
+        state: dict | None,
+    ) -> tuple[list[dict], dict | None]:
         if tags:
             query = Attr("user_tags").contains(
                 {"name": tags[0].name, "value": tags[0].value}
@@ -83,22 +434,35 @@ class AWSBlobHandler2(BaseBlobHandler):
                 ) | Attr("system_tags").contains(
                     {"name": tags[i].name, "value": tags[i].value}
                 )
-            res = dynamodb_table.scan(FilterExpression=query)
         else:
-            res = dynamodb_table.scan()
-
-        response = []
-        for item in res["Items"]:
-            response.append(
-                Blob(
-                    blob_id=item["id"],
-                    name=item["name"],
-                    content_type=item["type"],
-                    timestamp=item["timestamp"],
-                    source=item["source"],
-                    user_tags=item["user_tags"],
-                    system_tags=item["system_tags"],
-                    size=item["size"],
-                )
+            query = None
+
+        async with self.lease_aws_clients(full_project_structure) as clients:
+            dynamodb_table = clients.dynamodb.Table(
+                deployed_resources.dynamodb.dynamodb_name
             )
-        return response
+            # a scan reads at most 1 MB per call, the filter is applied after
+            # that, so keep scanning until the page is full
+            items = []
+            last_key = state["last_key"] if state else None
+            while True:
+                scan_kwargs = {"Limit": settings.search_page_size}
+                if query is not None:
+                    scan_kwargs["FilterExpression"] = query
+                if last_key is not None:
+                    scan_kwargs["ExclusiveStartKey"] = last_key
+                res = await self.run_blocking(dynamodb_table.scan, **scan_kwargs)
+                items.extend(res["Items"])
+                last_key = res.get("LastEvaluatedKey")
+                if len(items) >= limit or last_key is None:
+                    break
+
+            if len(items) > limit:
+                # continue right after the last returned item
+                items = items[:limit]
+                key_names = await self.get_key_names(
+                    full_project_structure, dynamodb_table
+                )
+                last_key = {name: items[-1][name] for name in key_names}
+
+        return items, {"last_key": last_key} if last_key is not None else None
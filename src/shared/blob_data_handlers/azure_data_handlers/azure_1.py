@@ -1,81 +1,219 @@
+import asyncio
+import typing
+
+import requests
+from azure.core.pipeline.transport import RequestsTransport
 from azure.cosmos import CosmosClient
 from azure.storage.blob import BlobServiceClient
 
-from api.models import Blob, FullProjectStructure, Tag
+from api.models import (
+    Blob,
+    FullProjectStructure,
+    ServiceProviderType,
+    SignedUrl,
+    Tag,
+    TimeRange,
+)
+from config import settings
 from shared.blob_data_handlers.base import BaseBlobHandler
+from shared.blob_data_handlers.downloads import (
+    StoredObject,
+    iter_azure_blob,
+    stat_azure_blob,
+)
+from shared.blob_data_handlers.signed_urls import sign_azure_url
+from shared.blob_data_handlers.uploads import delete_azure_blobs, upload_stream_to_azure
 from shared.data_processors.base_data_processor import ProcessedData
+from utils.http import mount_pool_adapter
 from utils.logger import setup_logger
+from utils.streams import ByteStream
 
 LOGGER = setup_logger()
 
 
+class AzureClients1(typing.NamedTuple):
+    cosmos: CosmosClient
+    blob_service: BlobServiceClient
+    session: requests.Session
+
+
+def build_azure_clients_1() -> AzureClients1:
+    session = mount_pool_adapter(
+        requests.Session(), settings.cloud_client_max_pool_connections
+    )
+    # TODO:
+    blob_connection_string = ""
+    return AzureClients1(
+        cosmos=CosmosClient(
+            "",
+            credential="",
+            transport=RequestsTransport(session=session, session_owner=False),
+        ),
+        blob_service=BlobServiceClient.from_connection_string(
+            blob_connection_string,
+            transport=RequestsTransport(session=session, session_owner=False),
+        ),
+        session=session,
+    )
+
+
+def build_search_query(tags: list[Tag]) -> tuple[str, list[dict]]:
+    # the tags are passed as query parameters, never in the query text
+    conditions = []
+    parameters = []
+    for i, tag in enumerate(tags):
+        conditions.append(
+            f"("
+            f'EXISTS(SELECT VALUE n FROM n IN c.user_tags WHERE n["name"] = @n{i} AND n["value"] = @v{i}) OR '
+            f'EXISTS(SELECT VALUE n FROM n IN c.system_tags WHERE n["name"] = @n{i} AND n["value"] = @v{i})'
+            f")"
+        )
+        parameters.extend(
+            [
+                {"name": f"@n{i}", "value": tag.name},
+                {"name": f"@v{i}", "value": tag.value},
+            ]
+        )
+    if not conditions:
+        return "SELECT * FROM c", parameters
+    return "SELECT * FROM c WHERE " + " AND ".join(conditions), parameters
+
+
 class AzureBlobHandler1(BaseBlobHandler):
-    async def update_blob_data(
+    service_provider = ServiceProviderType.AZURE
+
+    def lease_azure_clients(
+        self, full_project_structure: FullProjectStructure
+    ) -> typing.AsyncContextManager[AzureClients1]:
+        return self.lease_clients(full_project_structure, build_azure_clients_1)
+
+    async def upload_object(
         self,
         full_project_structure: FullProjectStructure,
-        processed_data: ProcessedData,
-        blob_id: str,
+        object_name: str,
+        stream: ByteStream,
     ):
-        blob_d = await self.get_blob_from_first_step(blob_id)
-        # TODO:
-        blob_connection_string = ""
-        client = CosmosClient(
-            "",
-            credential="",
-        )
-        db = client.create_database_if_not_exists("ToDoList")
-        cont = db.get_container_client("Items")
+        async with self.lease_azure_clients(full_project_structure) as clients:
+            cc = clients.blob_service.get_container_client("datalake")
+            await upload_stream_to_azure(self.run_blocking, cc, object_name, stream)
+
+    async def delete_objects(
+        self, full_project_structure: FullProjectStructure, object_names: list[str]
+    ):
+        async with self.lease_azure_clients(full_project_structure) as clients:
+            cc = clients.blob_service.get_container_client("datalake")
+            await delete_azure_blobs(self.run_blocking, cc, object_names)
+
+    def build_document(
+        self, blob_d: dict, processed_data: ProcessedData, blob_id: str
+    ) -> dict:
         blob_d["id"] = blob_id
         blob_d["_rid"] = blob_id
         blob_d["_self"] = blob_id
 
-        system_tags = processed_data.dict()["system_tags"]
+        system_tags = [tag.dict() for tag in processed_data.system_tags]
         blob_d["system_tags"] = system_tags
         for st in system_tags:
             if st["name"] == "content-length":
                 blob_d["size"] = st["value"]
+        return blob_d
 
-        cont.create_item(blob_d)
-        bsc = BlobServiceClient.from_connection_string(blob_connection_string)
-        cc = bsc.get_container_client("datalake")
-        cc.upload_blob(blob_id, processed_data.data)
-        await self.delete_blob_from_first_step(blob_id)
+    async def index_documents(
+        self, full_project_structure: FullProjectStructure, documents: list[dict]
+    ) -> list[str | None]:
+        async with self.lease_azure_clients(full_project_structure) as clients:
+            db = await self.run_blocking(
+                clients.cosmos.create_database_if_not_exists, "ToDoList"
+            )
+            cont = db.get_container_client("Items")
+            # the SDK has no batch API for items, the creates run concurrently
+            results = await asyncio.gather(
+                *(
+                    self.run_blocking(cont.create_item, document)
+                    for document in documents
+                ),
+                return_exceptions=True,
+            )
+        return [
+            repr(result) if isinstance(result, Exception) else None
+            for result in results
+        ]
 
-    async def search_by_tags(
-        self, full_project_structure: FullProjectStructure, tags: list[Tag]
-    ):
-        client = CosmosClient(
-            "",
-            credential="",
-        )
-        db = client.create_database_if_not_exists("ToDoList")
-        cont = db.get_container_client("Items")
-
-        filter_expressions = []
-        for tag in tags:
-            filter_expressions.append(
-                f"("
-                f'EXISTS(SELECT VALUE n FROM n IN c.user_tags WHERE n["name"] = "{tag.name}" AND n["value"] = "{tag.value}") OR '
-                f'EXISTS(SELECT VALUE n FROM n IN c.system_tags WHERE n["name"] = "{tag.name}" AND n["value"] = "{tag.value}")'
-                f")"
+    async def get_blob(
+        self, full_project_structure: FullProjectStructure, blob_id: str
+    ) -> Blob | None:
+        async with self.lease_azure_clients(full_project_structure) as clients:
+            db = await self.run_blocking(
+                clients.cosmos.create_database_if_not_exists, "ToDoList"
             )
-        filter_expression = " AND ".join(filter_expressions)
-        if filter_expression:
-            filter_expression = "SELECT * FROM c WHERE " + filter_expression
-        result = []
-        for res in cont.query_items(
-            filter_expression, enable_cross_partition_query=True
-        ):
-            result.append(
-                Blob(
-                    blob_id=res["id"],
-                    name=res["name"],
-                    content_type=res["type"],
-                    timestamp=res["timestamp"],
-                    source=res["source"],
-                    user_tags=res["user_tags"],
-                    system_tags=res["system_tags"],
-                    size=res["size"],
+            cont = db.get_container_client("Items")
+            items = await self.run_blocking(
+                lambda: list(
+                    cont.query_items(
+                        "SELECT * FROM c WHERE c.id = @id",
+                        parameters=[{"name": "@id", "value": blob_id}],
+                        enable_cross_partition_query=True,
+                    )
                 )
             )
-        return result
+        return Blob.from_document(items[0]) if items else None
+
+    async def open_object(
+        self, full_project_structure: FullProjectStructure, object_name: str
+    ) -> StoredObject | None:
+        async with self.lease_azure_clients(full_project_structure) as clients:
+            cc = clients.blob_service.get_container_client("datalake")
+            size = await stat_azure_blob(self.run_blocking, cc, object_name)
+        if size is None:
+            return None
+
+        async def read(start: int, end: int) -> ByteStream:
+            async with self.lease_azure_clients(full_project_structure) as clients:
+                cc = clients.blob_service.get_container_client("datalake")
+                async for chunk in iter_azure_blob(
+                    self.run_blocking, cc, object_name, start, end
+                ):
+                    yield chunk
+
+        return StoredObject(size, read)
+
+    async def sign_object_url(
+        self,
+        full_project_structure: FullProjectStructure,
+        object_name: str,
+        method: str,
+        content_type: str | None = None,
+    ) -> SignedUrl:
+        async with self.lease_azure_clients(full_project_structure) as clients:
+            cc = clients.blob_service.get_container_client("datalake")
+            return sign_azure_url(cc, object_name, method, content_type)
+
+    async def search_page(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        limit: int,
+        state: dict | None,
+        time_range: TimeRange | None = None,
+    ) -> tuple[list[Blob], dict | None]:
+        query, parameters = build_search_query(tags)
+        async with self.lease_azure_clients(full_project_structure) as clients:
+            db = await self.run_blocking(
+                clients.cosmos.create_database_if_not_exists, "ToDoList"
+            )
+            cont = db.get_container_client("Items")
+
+            def read_page():
+                pages = cont.query_items(
+                    query,
+                    parameters=parameters,
+                    enable_cross_partition_query=True,
+                    max_item_count=limit,
+                ).by_page(state["continuation"] if state else None)
+                page = list(next(pages, []))
+                return page, pages.continuation_token
+
+            items, continuation = await self.run_blocking(read_page)
+
+        result = [Blob.from_document(res) for res in items]
+        return result, {"continuation": continuation} if continuation else None
@@ -1,44 +1,277 @@
+import asyncio
+import contextlib
+import datetime
+import typing
 import uuid
 
 from fastapi import HTTPException, status
+from starlette.datastructures import Headers
 
-from api.models import BlobCreate, FullProjectStructure, Tag
-from database.db import get_first_step_collection
+from api.models import (
+    Blob,
+    BlobBatchItemResult,
+    BlobCreate,
+    FullProjectStructure,
+    SearchEstimate,
+    SearchPage,
+    ServiceProviderType,
+    SignedUrl,
+    Tag,
+    TimeRange,
+)
+from config import settings
+from database.content_index import find_object, record_object
+from database.staging_store import get_staging_store
+from shared.blob_data_handlers.client_registry import (
+    CLIENT_REGISTRY,
+    credentials_fingerprint,
+)
+from shared.blob_data_handlers.downloads import StoredObject
+from shared.compression import choose_encoding, encode_stream
 from shared.data_processors.base_data_processor import ProcessedData
+from shared.data_processors.general_processor import GeneralDataProcessor
+from shared.search_cache import SEARCH_CACHE
+from utils.cursors import InvalidCursorError, decode_cursor, encode_cursor
+from utils.executors import run_blocking
+from utils.logger import setup_logger
+from utils.streams import ByteStream, iter_bytes, read_all
+
+LOGGER = setup_logger()
+
+T = typing.TypeVar("T")
+
+
+class BlobDataItem(typing.NamedTuple):
+    blob_id: str
+    processed_data: ProcessedData
+
+
+def add_size_tag(processed_data: ProcessedData, size: int):
+    # chunked bodies and multipart parts have no content-length header
+    if not any(tag.name == "content-length" for tag in processed_data.system_tags):
+        processed_data.system_tags.append(Tag(name="content-length", value=str(size)))
 
 
 class BaseBlobHandler:
+    service_provider: ServiceProviderType
+    supports_time_range = False  # search_page filters on timestamp bounds
+
+    async def run_blocking(self, func: typing.Callable[..., T], *args, **kwargs) -> T:
+        return await run_blocking(self.service_provider, func, *args, **kwargs)
+
+    @contextlib.asynccontextmanager
+    async def lease_clients(
+        self,
+        full_project_structure: FullProjectStructure,
+        factory: typing.Callable[[], T],
+        *resource_key: str,
+    ) -> typing.AsyncIterator[T]:
+        key = (
+            full_project_structure.deploy.deploy_type,
+            credentials_fingerprint(full_project_structure.credentials),
+            *resource_key,
+        )
+        entry = CLIENT_REGISTRY.acquire_cached(key)
+        if entry is None:
+            # building SDK clients is slow and blocking
+            entry = await self.run_blocking(CLIENT_REGISTRY.acquire, key, factory)
+        try:
+            yield entry.clients
+        finally:
+            CLIENT_REGISTRY.release(entry)
+
+    def get_first_step_document(self, blob_id: str, blob_create: BlobCreate) -> dict:
+        blob_d = blob_create.dict()
+        return {
+            "id": blob_id,
+            "name": blob_d["name"],
+            "type": blob_d["content_type"],
+            "size": 0,
+            "timestamp": blob_d["timestamp"],
+            "source": blob_d["source"],
+            "user_tags": blob_d["user_tags"],
+            # for the TTL index
+            "created_at": datetime.datetime.utcnow(),
+        }
+
     async def insert_blob(
         self, full_project_structure: FullProjectStructure, blob_create: BlobCreate
     ) -> str:
-        first_step_collection = get_first_step_collection()
         blob_id = str(uuid.uuid4())
-        blob_d = blob_create.dict()
 
-        await first_step_collection.insert_one(
-            {
-                "id": blob_id,
-                "name": blob_d["name"],
-                "type": blob_d["content_type"],
-                "size": 0,
-                "timestamp": blob_d["timestamp"],
-                "source": blob_d["source"],
-                "user_tags": blob_d["user_tags"],
-            }
+        await get_staging_store().insert(
+            self.get_first_step_document(blob_id, blob_create)
         )
         return blob_id
 
+    async def insert_blobs(
+        self,
+        full_project_structure: FullProjectStructure,
+        blob_creates: list[BlobCreate],
+    ) -> list[BlobBatchItemResult]:
+        documents = [
+            self.get_first_step_document(str(uuid.uuid4()), blob_create)
+            for blob_create in blob_creates
+        ]
+        errors = await get_staging_store().insert_many(documents)
+
+        return [
+            BlobBatchItemResult(error=errors[i])
+            if i in errors
+            else BlobBatchItemResult(blob_id=document["id"])
+            for i, document in enumerate(documents)
+        ]
+
     async def get_blob_from_first_step(self, blob_id: uuid.UUID | str):
-        first_step_collection = get_first_step_collection()
-        blob_d = await first_step_collection.find_one({"id": str(blob_id)})
+        blob_d = await get_staging_store().get(str(blob_id))
+        if not blob_d:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        return blob_d
+
+    async def get_blobs_from_first_step(self, blob_ids: list[str]) -> dict[str, dict]:
+        return await get_staging_store().get_many(blob_ids)
+
+    async def consume_blob_from_first_step(self, blob_id: uuid.UUID | str) -> dict:
+        blob_d = await get_staging_store().consume(str(blob_id))
         if not blob_d:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-        del blob_d["_id"]
         return blob_d
 
+    async def restore_blob_to_first_step(self, blob_d: dict):
+        await get_staging_store().restore(blob_d)
+
     async def delete_blob_from_first_step(self, blob_id: uuid.UUID | str):
-        first_step_collection = get_first_step_collection()
-        await first_step_collection.delete_one({"id": str(blob_id)})
+        await get_staging_store().delete(str(blob_id))
+
+    async def delete_blobs_from_first_step(self, blob_ids: list[str]):
+        await get_staging_store().delete_many(blob_ids)
+
+    async def upload_object(
+        self,
+        full_project_structure: FullProjectStructure,
+        object_name: str,
+        stream: ByteStream,
+    ):
+        raise NotImplementedError()
+
+    async def delete_objects(
+        self, full_project_structure: FullProjectStructure, object_names: list[str]
+    ):
+        raise NotImplementedError()
+
+    async def discard_objects(
+        self, full_project_structure: FullProjectStructure, object_names: list[str]
+    ):
+        # a failed delete only leaves an unreferenced object behind
+        if not object_names:
+            return
+        try:
+            await self.delete_objects(full_project_structure, object_names)
+        except Exception:
+            LOGGER.exception(f"Failed to delete objects {object_names}")
+
+    def build_document(
+        self, blob_d: dict, processed_data: ProcessedData, blob_id: str
+    ) -> dict:
+        # the metadata document to index once the data is stored
+        raise NotImplementedError()
+
+    async def store_blob_data(
+        self,
+        full_project_structure: FullProjectStructure,
+        blob_d: dict,
+        processed_data: ProcessedData,
+        blob_id: str,
+    ) -> dict:
+        # uploads the data, returns the metadata document to index
+        encoding = choose_encoding(processed_data)
+        if settings.content_dedup_enabled and full_project_structure.project_id:
+            await self.store_content(
+                full_project_structure, processed_data, blob_id, encoding
+            )
+        else:
+            await self.upload_object(
+                full_project_structure,
+                blob_id,
+                encode_stream(processed_data.iter_chunks(), encoding),
+            )
+            processed_data.stored_object = blob_id
+            if encoding is not None:
+                processed_data.system_tags.append(
+                    Tag(name="content-encoding", value=encoding)
+                )
+        add_size_tag(processed_data, processed_data.size)
+        return self.build_document(blob_d, processed_data, blob_id)
+
+    async def store_content(
+        self,
+        full_project_structure: FullProjectStructure,
+        processed_data: ProcessedData,
+        blob_id: str,
+        encoding: str | None,
+    ):
+        # Content already stored in the project is referenced, not uploaded.
+        # The digest is recorded by record_content once the blob is indexed,
+        # until then the object can still be deleted or overwritten by a retry.
+        project_id = full_project_structure.project_id
+        digest = await processed_data.spool()
+        stored = await find_object(project_id, digest)
+        if stored is not None:
+            object_name, encoding = stored
+            await processed_data.discard()
+        else:
+            object_name = blob_id
+            await self.upload_object(
+                full_project_structure,
+                object_name,
+                encode_stream(processed_data.iter_chunks(), encoding),
+            )
+            processed_data.stored_object = object_name
+        processed_data.system_tags.extend(
+            [
+                Tag(name="content-sha256", value=digest),
+                Tag(name="content-ref", value=object_name),
+            ]
+        )
+        if encoding is not None:
+            # the encoding of the referenced object
+            processed_data.system_tags.append(
+                Tag(name="content-encoding", value=encoding)
+            )
+
+    async def record_content(
+        self,
+        full_project_structure: FullProjectStructure,
+        processed_data: ProcessedData,
+    ):
+        # makes the object of an indexed blob available to later uploads
+        if processed_data.digest is None or processed_data.stored_object is None:
+            return
+        encoding = next(
+            (
+                tag.value
+                for tag in processed_data.system_tags
+                if tag.name == "content-encoding"
+            ),
+            None,
+        )
+        try:
+            await record_object(
+                full_project_structure.project_id,
+                processed_data.digest,
+                processed_data.stored_object,
+                encoding,
+            )
+        except Exception:
+            # the blob is stored, only its content isn't deduplicated
+            LOGGER.exception(f"Failed to record object {processed_data.stored_object}")
+
+    async def index_documents(
+        self, full_project_structure: FullProjectStructure, documents: list[dict]
+    ) -> list[str | None]:
+        # writes the metadata documents with one batch call where the backend
+        # has one, returns an error or None per document
+        raise NotImplementedError()
 
     async def update_blob_data(
         self,
@@ -46,9 +279,381 @@ class BaseBlobHandler:
         processed_data: ProcessedData,
         blob_id: str,
     ):
+        staged_d = await self.consume_blob_from_first_step(blob_id)
+        blob_d = {k: v for k, v in staged_d.items() if k != "created_at"}
+        try:
+            document = await self.store_blob_data(
+                full_project_structure, blob_d, processed_data, blob_id
+            )
+            [error] = await self.index_documents(full_project_structure, [document])
+            if error is not None:
+                LOGGER.error(f"Index error for blob {blob_id}: {error}")
+                raise HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY, detail=error
+                )
+        except BaseException:
+            # the upload can be retried
+            await asyncio.shield(self.restore_blob_to_first_step(staged_d))
+            raise
+        await self.record_content(full_project_structure, processed_data)
+        await SEARCH_CACHE.invalidate_project(full_project_structure.project_id)
+
+    async def update_blobs_data(
+        self,
+        full_project_structure: FullProjectStructure,
+        items: list[BlobDataItem],
+    ) -> list[BlobBatchItemResult]:
+        staged = await self.get_blobs_from_first_step(
+            list({item.blob_id for item in items})
+        )
+        errors: dict[int, str] = {}
+        seen = set()
+        for i, item in enumerate(items):
+            if item.blob_id not in staged:
+                errors[i] = "Blob not found"
+            elif item.blob_id in seen:
+                errors[i] = "Duplicate blob id in batch"
+            seen.add(item.blob_id)
+
+        # the objects are uploaded concurrently, their metadata is then
+        # written with a single batch call
+        uploads = asyncio.Semaphore(settings.blob_data_batch_upload_concurrency)
+
+        async def store(i: int, item: BlobDataItem) -> dict | None:
+            if i in errors:
+                return None
+            async with uploads:
+                try:
+                    return await self.store_blob_data(
+                        full_project_structure,
+                        staged[item.blob_id],
+                        item.processed_data,
+                        item.blob_id,
+                    )
+                except Exception as e:
+                    LOGGER.exception(f"Upload failed for blob {item.blob_id}")
+                    errors[i] = f"Upload failed: {e!r}"
+                    return None
+
+        documents = await asyncio.gather(
+            *(store(i, item) for i, item in enumerate(items))
+        )
+        stored = [i for i, document in enumerate(documents) if document is not None]
+        if stored:
+            try:
+                index_errors = await self.index_documents(
+                    full_project_structure, [documents[i] for i in stored]
+                )
+            except Exception as e:
+                LOGGER.exception("Batch index failed")
+                index_errors = [f"Index failed: {e!r}"] * len(stored)
+            for i, error in zip(stored, index_errors):
+                if error is not None:
+                    errors[i] = error
+
+        indexed = [item.blob_id for i, item in enumerate(items) if i not in errors]
+        await asyncio.gather(
+            *(
+                self.record_content(full_project_structure, item.processed_data)
+                for i, item in enumerate(items)
+                if i not in errors
+            )
+        )
+        if indexed:
+            await SEARCH_CACHE.invalidate_project(full_project_structure.project_id)
+            await self.delete_blobs_from_first_step(indexed)
+        return [
+            BlobBatchItemResult(blob_id=item.blob_id, error=errors.get(i))
+            for i, item in enumerate(items)
+        ]
+
+    async def update_blob_parts(
+        self,
+        full_project_structure: FullProjectStructure,
+        parts: typing.AsyncIterator[Tag | ProcessedData],
+        blob_id: str,
+    ) -> list[BlobBatchItemResult]:
+        # Each file part of a form upload is stored as its own blob as it is
+        # received, the first one as blob_id, the others with the staged
+        # metadata of blob_id. The form fields are added to the user tags of
+        # all of them and the documents are written with one batch call.
+        # Until that call, a failure deletes the stored parts and blob_id can
+        # be uploaded again. The parts it indexed are kept and the objects of
+        # the others deleted, blob_id only stays uploadable if none was.
+        staged_d = await self.consume_blob_from_first_step(blob_id)
+        blob_d = {k: v for k, v in staged_d.items() if k != "created_at"}
+        field_tags = []
+        part_ids = []
+        documents = []
+        stored_parts = []
+        owned_objects = []
+        try:
+            async for part in parts:
+                if isinstance(part, Tag):
+                    field_tags.append(part.dict())
+                    continue
+                part_id = str(uuid.uuid4()) if part_ids else blob_id
+                part_d = dict(blob_d, id=part_id)
+                for tag in part.system_tags:
+                    if tag.name == "filename":
+                        part_d["name"] = tag.value
+                    elif tag.name == "content-type":
+                        part_d["type"] = tag.value
+                part.system_tags.append(Tag(name="form-upload", value=blob_id))
+                documents.append(
+                    await self.store_blob_data(
+                        full_project_structure, part_d, part, part_id
+                    )
+                )
+                part_ids.append(part_id)
+                stored_parts.append(part)
+                if part.stored_object is not None:
+                    # not content another blob already references
+                    owned_objects.append(part.stored_object)
+            if not documents:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="No file in the form",
+                )
+            for document in documents:
+                document["user_tags"] = [*document["user_tags"], *field_tags]
+            errors = await self.index_documents(full_project_structure, documents)
+        except BaseException:
+            await asyncio.shield(
+                self.rollback_blob_parts(
+                    full_project_structure, staged_d, owned_objects
+                )
+            )
+            raise
+
+        failed = {
+            part_id for part_id, error in zip(part_ids, errors) if error is not None
+        }
+        for part_id, error in zip(part_ids, errors):
+            if error is not None:
+                LOGGER.error(f"Index error for blob {part_id}: {error}")
+        if len(failed) == len(part_ids):
+            await asyncio.shield(
+                self.rollback_blob_parts(
+                    full_project_structure, staged_d, owned_objects
+                )
+            )
+        else:
+            if failed:
+                await asyncio.shield(
+                    self.discard_objects(
+                        full_project_structure,
+                        [
+                            part.stored_object
+                            for part_id, part in zip(part_ids, stored_parts)
+                            if part_id in failed and part.stored_object is not None
+                        ],
+                    )
+                )
+            for part_id, part in zip(part_ids, stored_parts):
+                if part_id not in failed:
+                    await self.record_content(full_project_structure, part)
+            await SEARCH_CACHE.invalidate_project(full_project_structure.project_id)
+        return [
+            BlobBatchItemResult(blob_id=part_id, error=error)
+            for part_id, error in zip(part_ids, errors)
+        ]
+
+    async def rollback_blob_parts(
+        self,
+        full_project_structure: FullProjectStructure,
+        staged_d: dict,
+        object_names: list[str],
+    ):
+        await self.discard_objects(full_project_structure, object_names)
+        await self.restore_blob_to_first_step(staged_d)
+
+    async def get_blob(
+        self, full_project_structure: FullProjectStructure, blob_id: str
+    ) -> Blob | None:
+        # the metadata of a stored blob
         raise NotImplementedError()
 
-    async def search_by_tags(
-        self, full_project_structure: FullProjectStructure, tags: list[Tag]
+    async def open_object(
+        self, full_project_structure: FullProjectStructure, object_name: str
+    ) -> StoredObject | None:
+        # the stored data, None when the object doesn't exist
+        raise NotImplementedError()
+
+    async def sign_object_url(
+        self,
+        full_project_structure: FullProjectStructure,
+        object_name: str,
+        method: str,
+        content_type: str | None = None,
+    ) -> SignedUrl:
+        # a URL to PUT the object to or GET it from, signed locally
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Signed URLs are not supported for this deploy type",
+        )
+
+    async def create_upload_url(
+        self,
+        full_project_structure: FullProjectStructure,
+        blob_id: str,
+        content_type: str,
+    ) -> SignedUrl:
+        # the data is uploaded as is, without deduplication or compression
+        return await self.sign_object_url(
+            full_project_structure, blob_id, "PUT", content_type
+        )
+
+    async def finalize_upload(
+        self, full_project_structure: FullProjectStructure, blob_id: str
     ):
+        # indexes a blob whose data was uploaded to its signed URL, the tags
+        # are extracted from a ranged read of the first bytes
+        staged_d = await self.consume_blob_from_first_step(blob_id)
+        blob_d = {k: v for k, v in staged_d.items() if k != "created_at"}
+        try:
+            stored_object = await self.open_object(full_project_structure, blob_id)
+            if stored_object is None:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="No data was uploaded for the blob",
+                )
+            head_size = min(stored_object.size, settings.direct_upload_head_size)
+            head = (
+                await read_all(stored_object.read(0, head_size - 1))
+                if head_size
+                else b""
+            )
+            headers = Headers(
+                headers={
+                    "content-length": str(stored_object.size),
+                    "content-type": blob_d["type"],
+                }
+            )
+            system_tags = await GeneralDataProcessor().process_head(
+                head, headers, complete=head_size == stored_object.size
+            )
+            processed_data = ProcessedData(
+                stream=iter_bytes(b"", 1),
+                system_tags=system_tags,
+                size=stored_object.size,
+            )
+            document = self.build_document(blob_d, processed_data, blob_id)
+            [error] = await self.index_documents(full_project_structure, [document])
+            if error is not None:
+                LOGGER.error(f"Index error for blob {blob_id}: {error}")
+                raise HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY, detail=error
+                )
+        except BaseException:
+            # the upload can be finalized again
+            await asyncio.shield(self.restore_blob_to_first_step(staged_d))
+            raise
+        await SEARCH_CACHE.invalidate_project(full_project_structure.project_id)
+
+    async def create_download_url(
+        self, full_project_structure: FullProjectStructure, blob_id: str
+    ) -> SignedUrl:
+        blob = await self.get_blob(full_project_structure, blob_id)
+        if blob is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        system_tags = {tag.name: tag.value for tag in blob.system_tags}
+        signed_url = await self.sign_object_url(
+            full_project_structure, system_tags.get("content-ref") or blob_id, "GET"
+        )
+        # the data is read as stored, compressed or not
+        signed_url.content_encoding = system_tags.get("content-encoding")
+        return signed_url
+
+    async def search_page(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        limit: int,
+        state: dict | None,
+        time_range: TimeRange | None = None,
+    ) -> tuple[list[Blob], dict | None]:
+        # returns up to limit blobs and the backend state for the next page,
+        # None when there are no more results
         raise NotImplementedError()
+
+    async def search_by_tags_page(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        limit: int,
+        cursor: str | None = None,
+        time_range: TimeRange | None = None,
+    ) -> SearchPage:
+        if time_range is not None and not self.supports_time_range:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Timestamp bounds are not supported for this deploy type",
+            )
+        try:
+            state = decode_cursor(cursor) if cursor else None
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+        async def search() -> SearchPage:
+            blobs, next_state = await self.search_page(
+                full_project_structure, tags, limit, state, time_range
+            )
+            return SearchPage(
+                blobs=blobs,
+                next_cursor=encode_cursor(next_state) if next_state else None,
+            )
+
+        return await SEARCH_CACHE.get_or_search(
+            full_project_structure.project_id,
+            SEARCH_CACHE.search_key(tags, limit, cursor, time_range),
+            search,
+        )
+
+    async def iter_search_results(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        cursor: str | None = None,
+        limit: int | None = None,
+        time_range: TimeRange | None = None,
+    ) -> typing.AsyncIterator[Blob]:
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_size = settings.search_page_size
+            if remaining is not None:
+                page_size = min(page_size, remaining)
+            page = await self.search_by_tags_page(
+                full_project_structure, tags, page_size, cursor, time_range
+            )
+            for blob in page.blobs:
+                yield blob
+            if remaining is not None:
+                remaining -= len(page.blobs)
+            if page.next_cursor is None:
+                return
+            cursor = page.next_cursor
+
+    async def search_by_tags(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        time_range: TimeRange | None = None,
+    ) -> list[Blob]:
+        return [
+            blob
+            async for blob in self.iter_search_results(
+                full_project_structure, tags, time_range=time_range
+            )
+        ]
+
+    async def estimate_search(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        time_range: TimeRange | None = None,
+    ) -> SearchEstimate:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Search estimates are not supported for this deploy type",
+        )
@@ -0,0 +1,172 @@
+import contextlib
+import hashlib
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+from pydantic import BaseModel
+
+from config import settings
+from utils.logger import setup_logger
+
+LOGGER = setup_logger()
+
+T = typing.TypeVar("T")
+
+
+def credentials_fingerprint(credentials: BaseModel) -> str:
+    return hashlib.sha256(credentials.json(sort_keys=True).encode()).hexdigest()
+
+
+def close_client(client: typing.Any):
+    # SDK clients disagree on how they are closed, boto3 resources keep
+    # their connections on the low-level client
+    close = getattr(client, "close", None)
+    if close is None and hasattr(client, "meta"):
+        close = getattr(getattr(client.meta, "client", None), "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception as e:
+        LOGGER.warning(f"Failed to close client {client!r}: {e!r}")
+
+
+class _RegistryEntry:
+    __slots__ = ("clients", "created_at", "leases", "retired")
+
+    def __init__(self, clients: typing.Any):
+        self.clients = clients
+        self.created_at = time.monotonic()
+        self.leases = 0
+        self.retired = False
+
+
+class ClientRegistry:
+    # Keeps cloud SDK clients per deploy type and credential fingerprint.
+    # Entries are leased while a request uses them, so an entry evicted by
+    # LRU/TTL is closed only after its last lease is released.
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple, _RegistryEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: dict[tuple, threading.Lock] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextlib.contextmanager
+    def lease(self, key: tuple, factory: typing.Callable[[], T]) -> typing.Iterator[T]:
+        entry = self.acquire(key, factory)
+        try:
+            yield entry.clients
+        finally:
+            self.release(entry)
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._retire(entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "leased": sum(1 for e in self._entries.values() if e.leases),
+            }
+
+    def acquire_cached(self, key: tuple) -> _RegistryEntry | None:
+        with self._lock:
+            entry = self._get_live_entry(key)
+            if entry is not None:
+                self.hits += 1
+            return entry
+
+    def acquire(
+        self, key: tuple, factory: typing.Callable[[], typing.Any]
+    ) -> _RegistryEntry:
+        with self._lock:
+            entry = self._get_live_entry(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        # only one thread builds clients for a key, the others wait for it
+        with build_lock:
+            with self._lock:
+                entry = self._get_live_entry(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry
+                self.misses += 1
+
+            entry = _RegistryEntry(factory())
+
+            with self._lock:
+                entry.leases += 1
+                self._entries[key] = entry
+                evicted = []
+                while len(self._entries) > self.max_size:
+                    evicted.append(self._entries.popitem(last=False)[1])
+                    self.evictions += 1
+                self._build_locks.pop(key, None)
+
+        for evicted_entry in evicted:
+            self._retire(evicted_entry)
+        return entry
+
+    def _get_live_entry(self, key: tuple) -> _RegistryEntry | None:
+        # caller holds self._lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created_at >= self.ttl:
+            del self._entries[key]
+            self.evictions += 1
+            entry.retired = True
+            if entry.leases == 0:
+                self._close_entry(entry)
+            return None
+        self._entries.move_to_end(key)
+        entry.leases += 1
+        return entry
+
+    def release(self, entry: _RegistryEntry):
+        with self._lock:
+            entry.leases -= 1
+            should_close = entry.retired and entry.leases == 0
+        if should_close:
+            self._close_entry(entry)
+
+    def _retire(self, entry: _RegistryEntry):
+        with self._lock:
+            entry.retired = True
+            should_close = entry.leases == 0
+        if should_close:
+            self._close_entry(entry)
+
+    @staticmethod
+    def _close_entry(entry: _RegistryEntry):
+        clients = entry.clients
+        if isinstance(clients, tuple):
+            for client in clients:
+                close_client(client)
+        else:
+            close_client(clients)
+
+
+CLIENT_REGISTRY = ClientRegistry(
+    max_size=settings.cloud_client_registry_max_size,
+    ttl=settings.cloud_client_registry_ttl,
+)
@@ -0,0 +1,99 @@
+import typing
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import ContainerClient
+from botocore.exceptions import ClientError
+from google.cloud import storage
+
+from config import settings
+from shared.blob_data_handlers.uploads import RunBlocking
+from utils.streams import ByteStream
+
+# Objects are read in ranged requests of download_chunk_size bytes, so a
+# download holds at most one chunk in memory. Ranges are inclusive.
+
+
+class StoredObject(typing.NamedTuple):
+    size: int
+    # reads the inclusive byte range [start, end] of the object
+    read: typing.Callable[[int, int], ByteStream]
+
+
+def iter_ranges(start: int, end: int) -> typing.Iterator[tuple[int, int]]:
+    for offset in range(start, end + 1, settings.download_chunk_size):
+        yield offset, min(offset + settings.download_chunk_size - 1, end)
+
+
+async def stat_s3_object(
+    run_blocking: RunBlocking, s3_client: typing.Any, bucket: str, key: str
+) -> int | None:
+    try:
+        response = await run_blocking(s3_client.head_object, Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    return response["ContentLength"]
+
+
+async def iter_s3_object(
+    run_blocking: RunBlocking,
+    s3_client: typing.Any,
+    bucket: str,
+    key: str,
+    start: int,
+    end: int,
+) -> ByteStream:
+    response = await run_blocking(
+        s3_client.get_object, Bucket=bucket, Key=key, Range=f"bytes={start}-{end}"
+    )
+    body = response["Body"]
+    try:
+        while chunk := await run_blocking(body.read, settings.download_chunk_size):
+            yield chunk
+    finally:
+        body.close()
+
+
+async def stat_gcs_blob(
+    run_blocking: RunBlocking, bucket: storage.Bucket, name: str
+) -> int | None:
+    blob = await run_blocking(bucket.get_blob, name)
+    return blob.size if blob is not None else None
+
+
+async def iter_gcs_blob(
+    run_blocking: RunBlocking, blob: storage.Blob, start: int, end: int
+) -> ByteStream:
+    for chunk_start, chunk_end in iter_ranges(start, end):
+        yield await run_blocking(
+            blob.download_as_bytes, start=chunk_start, end=chunk_end
+        )
+
+
+async def stat_azure_blob(
+    run_blocking: RunBlocking, container_client: ContainerClient, blob_name: str
+) -> int | None:
+    blob_client = container_client.get_blob_client(blob_name)
+    try:
+        properties = await run_blocking(blob_client.get_blob_properties)
+    except ResourceNotFoundError:
+        return None
+    return properties.size
+
+
+async def iter_azure_blob(
+    run_blocking: RunBlocking,
+    container_client: ContainerClient,
+    blob_name: str,
+    start: int,
+    end: int,
+) -> ByteStream:
+    for chunk_start, chunk_end in iter_ranges(start, end):
+        downloader = await run_blocking(
+            container_client.download_blob,
+            blob_name,
+            offset=chunk_start,
+            length=chunk_end - chunk_start + 1,
+        )
+        yield await run_blocking(downloader.readall)
@@ -0,0 +1,95 @@
+import json
+
+from google.cloud import bigquery
+from google.cloud.bigquery.table import Row, RowIterator
+
+from shared.blob_data_handlers.uploads import RunBlocking
+
+# streaming inserts are limited to 10 MB per request, leave room for the
+# request envelope
+MAX_INSERT_REQUEST_BYTES = 9 * 1024 * 1024
+MAX_INSERT_REQUEST_ROWS = 500
+
+
+def split_rows(rows: list[dict]) -> list[tuple[int, int]]:
+    ranges = []
+    start = 0
+    request_bytes = 0
+    for i, row in enumerate(rows):
+        row_bytes = len(json.dumps(row, default=str))
+        if i > start and (
+            request_bytes + row_bytes > MAX_INSERT_REQUEST_BYTES
+            or i - start >= MAX_INSERT_REQUEST_ROWS
+        ):
+            ranges.append((start, i))
+            start = i
+            request_bytes = 0
+        request_bytes += row_bytes
+    if start < len(rows):
+        ranges.append((start, len(rows)))
+    return ranges
+
+
+async def insert_rows(
+    run_blocking: RunBlocking,
+    client: bigquery.Client,
+    table_id: str,
+    rows: list[dict],
+) -> list[str | None]:
+    # multi-row streaming insert, returns an error or None per row
+    errors: list[str | None] = [None] * len(rows)
+    for start, end in split_rows(rows):
+        insert_errors = await run_blocking(
+            client.insert_rows_json,
+            table_id,
+            rows[start:end],
+            # lets BigQuery drop rows duplicated by a retried request
+            row_ids=[row["id"] for row in rows[start:end]],
+        )
+        for error in insert_errors:
+            errors[start + error["index"]] = json.dumps(error["errors"])
+    return errors
+
+
+def _read_page(rows: RowIterator) -> tuple[list[Row], str | None]:
+    page = next(rows.pages, None)
+    return (list(page) if page is not None else []), rows.next_page_token
+
+
+async def query_page(
+    run_blocking: RunBlocking,
+    client: bigquery.Client,
+    sql: str,
+    job_config: bigquery.QueryJobConfig,
+    limit: int,
+    state: dict | None,
+) -> tuple[list[Row], dict | None]:
+    # the first page runs the query, the next ones page through the job's
+    # result table, so the query isn't run again per page
+    if state is None:
+
+        def run_query():
+            job = client.query(sql, job_config=job_config)
+            rows, page_token = _read_page(job.result(page_size=limit))
+            destination = job.destination
+            return (
+                rows,
+                page_token,
+                f"{destination.project}.{destination.dataset_id}."
+                f"{destination.table_id}",
+            )
+
+        rows, page_token, destination = await run_blocking(run_query)
+    else:
+        destination = state["destination"]
+        rows, page_token = await run_blocking(
+            lambda: _read_page(
+                client.list_rows(
+                    destination, page_size=limit, page_token=state["page_token"]
+                )
+            )
+        )
+
+    if page_token is None:
+        return rows, None
+    return rows, {"destination": destination, "page_token": page_token}
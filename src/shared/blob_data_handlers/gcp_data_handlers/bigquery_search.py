@@ -0,0 +1,160 @@
+import contextlib
+import typing
+
+import orjson
+from fastapi import HTTPException, status
+from google.api_core.exceptions import BadRequest
+from google.cloud import bigquery
+from google.cloud.bigquery.table import Row
+
+from api.models import Blob, Tag, TimeRange
+from config import settings
+from shared.blob_data_handlers.uploads import RunBlocking
+
+# only the listed columns are read, never the inline ``file`` column
+SEARCH_COLUMNS = """
+                id,
+                name,
+                type,
+                size,
+                timestamp,
+                source,
+                TO_JSON_STRING(user_tags) AS user_tags,
+                TO_JSON_STRING(system_tags) AS system_tags
+"""
+
+
+def row_to_blob(row: Row) -> Blob:
+    return Blob.from_document(
+        {
+            "id": row.id,
+            "name": row.name,
+            "type": row.type,
+            "timestamp": row.timestamp.isoformat(),
+            "source": row.source,
+            "user_tags": orjson.loads(row.user_tags),
+            "system_tags": orjson.loads(row.system_tags),
+            "size": row.size,
+        }
+    )
+
+
+def plan_get(
+    table_id: str, blob_id: str, columns: str = SEARCH_COLUMNS
+) -> tuple[str, list[bigquery.ScalarQueryParameter]]:
+    sql = f"""
+            SELECT
+                {columns}
+            FROM
+              `{table_id}`
+            WHERE
+                id = @id
+            LIMIT 1
+        """
+    return sql, [bigquery.ScalarQueryParameter("id", "STRING", blob_id)]
+
+
+def plan_search(
+    table_id: str,
+    tags: list[Tag],
+    time_range: TimeRange | None = None,
+) -> tuple[str, list[bigquery.ScalarQueryParameter]]:
+    # The SQL only depends on the number of tags and on which time bounds are
+    # set, and the tags are sorted, so repeated searches are identical
+    # queries BigQuery can answer from its query cache. The time bounds only
+    # apply to the timestamp column, they prune partitions when the table is
+    # partitioned on it. A blob's ingestion day can differ from its
+    # timestamp, so bounds on another partition column would drop rows.
+    sql = f"""
+            SELECT DISTINCT
+                {SEARCH_COLUMNS}
+            FROM
+              `{table_id}`
+        """
+    conditions = []
+    query_parameters = []
+
+    if time_range is not None:
+        for bound, operator in (("timestamp_from", ">="), ("timestamp_to", "<=")):
+            value = getattr(time_range, bound)
+            if value is None:
+                continue
+            conditions.append(f"timestamp {operator} @{bound}")
+            query_parameters.append(
+                bigquery.ScalarQueryParameter(bound, "TIMESTAMP", value)
+            )
+
+    for i, tag in enumerate(sorted(tags, key=lambda t: (t.name, t.value or ""))):
+        conditions.append(
+            f"""
+            (
+                STRUCT(@tag_name_{i} AS name, @tag_value_{i} AS value) IN UNNEST(user_tags)
+                OR
+                STRUCT(@tag_name_{i} AS name, @tag_value_{i} AS value) IN UNNEST(system_tags)
+            )
+            """
+        )
+        query_parameters.extend(
+            (
+                bigquery.ScalarQueryParameter(f"tag_name_{i}", "STRING", tag.name),
+                bigquery.ScalarQueryParameter(f"tag_value_{i}", "STRING", tag.value),
+            )
+        )
+
+    if conditions:
+        sql += "\nWHERE\n" + "\nAND\n".join(conditions)
+    return sql, query_parameters
+
+
+def search_job_config(
+    query_parameters: list[bigquery.ScalarQueryParameter], dry_run: bool = False
+) -> bigquery.QueryJobConfig:
+    return bigquery.QueryJobConfig(
+        query_parameters=query_parameters,
+        use_query_cache=True,
+        maximum_bytes_billed=settings.bigquery_maximum_bytes_billed,
+        dry_run=dry_run,
+    )
+
+
+async def estimate_search(
+    run_blocking: RunBlocking,
+    client: bigquery.Client,
+    sql: str,
+    query_parameters: list[bigquery.ScalarQueryParameter],
+) -> int:
+    # a dry run is free and returns the bytes the query would process
+    job = await run_blocking(
+        client.query, sql, job_config=search_job_config(query_parameters, dry_run=True)
+    )
+    return job.total_bytes_processed
+
+
+async def query_one(
+    run_blocking: RunBlocking,
+    client: bigquery.Client,
+    sql: str,
+    query_parameters: list[bigquery.ScalarQueryParameter],
+) -> Row | None:
+    job_config = search_job_config(query_parameters)
+    rows = await run_blocking(
+        lambda: list(client.query(sql, job_config=job_config).result())
+    )
+    return rows[0] if rows else None
+
+
+@contextlib.contextmanager
+def bytes_billed_guard() -> typing.Iterator[None]:
+    try:
+        yield
+    except BadRequest as e:
+        if any(error.get("reason") == "bytesBilledLimitExceeded" for error in e.errors):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=(
+                    "The search would bill more than "
+                    f"{settings.bigquery_maximum_bytes_billed} bytes, "
+                    "narrow it down with timestamp_from/timestamp_to"
+                ),
+            )
+        raise
@@ -1,15 +1,42 @@
-import json
+import typing
 
 from google.cloud import bigquery
 from google.cloud.bigquery._helpers import _bytes_to_json
-from google.oauth2 import service_account
+from google.cloud.bigquery.table import Row
 from pydantic import BaseModel
 
-from api.models import Blob, FullProjectStructure, Tag
-from shared.blob_data_handlers.base import BaseBlobHandler
+from api.models import (
+    Blob,
+    FullProjectStructure,
+    GCPCredentials,
+    SearchEstimate,
+    ServiceProviderType,
+    Tag,
+    TimeRange,
+)
+from config import settings
+from shared.blob_data_handlers.base import BaseBlobHandler, add_size_tag
+from shared.blob_data_handlers.downloads import StoredObject
+from shared.blob_data_handlers.gcp_data_handlers.bigquery_rows import (
+    insert_rows,
+    query_page,
+)
+from shared.blob_data_handlers.gcp_data_handlers.bigquery_search import (
+    SEARCH_COLUMNS,
+    bytes_billed_guard,
+    estimate_search,
+    plan_get,
+    plan_search,
+    query_one,
+    row_to_blob,
+    search_job_config,
+)
+from shared.compression import choose_encoding, encode_bytes
 from shared.data_processors.base_data_processor import ProcessedData
-from utils.gcp import get_credentials_tmp_path
+from utils.cache import AsyncTTLCache
+from utils.gcp import get_authorized_session, get_credentials
 from utils.logger import setup_logger
+from utils.streams import ByteStream, iter_bytes
 
 LOGGER = setup_logger()
 
@@ -24,117 +51,191 @@ class GCPDeployedResources1(BaseModel):
     bigquery: BigQueryResource
 
 
+# (table id, blob id) -> the blob and its data. Rows aren't changed once
+# inserted, the caches save a query of the table per Range request of a
+# download. Rows that weren't found aren't cached, they may not be visible yet.
+BLOB_CACHE: AsyncTTLCache[tuple[str, str], Blob | None] = AsyncTTLCache(
+    max_size=settings.gcp_1_blob_cache_max_size, ttl=settings.gcp_1_row_cache_ttl
+)
+DATA_CACHE: AsyncTTLCache[tuple[str, str], bytes | None] = AsyncTTLCache(
+    max_size=settings.gcp_1_data_cache_max_size, ttl=settings.gcp_1_row_cache_ttl
+)
+
+
+def build_gcp_clients_1(credentials: GCPCredentials) -> bigquery.Client:
+    gcp_credentials = get_credentials(credentials)
+    return bigquery.Client(
+        credentials=gcp_credentials, _http=get_authorized_session(gcp_credentials)
+    )
+
+
 class GCPBlobHandler1(BaseBlobHandler):
-    async def update_blob_data(
+    service_provider = ServiceProviderType.GCP
+    supports_time_range = True
+
+    def lease_bigquery_client(
+        self, full_project_structure: FullProjectStructure
+    ) -> typing.AsyncContextManager[bigquery.Client]:
+        return self.lease_clients(
+            full_project_structure,
+            lambda: build_gcp_clients_1(full_project_structure.credentials),
+        )
+
+    async def store_blob_data(
         self,
         full_project_structure: FullProjectStructure,
+        blob_d: dict,
         processed_data: ProcessedData,
         blob_id: str,
+    ) -> dict:
+        # the data is stored inline in the row, so it can't be streamed nor
+        # shared with another blob
+        data = await processed_data.read()
+        blob_d["size"] = len(data)
+        add_size_tag(processed_data, len(data))
+        encoding = choose_encoding(processed_data)
+        if encoding is not None:
+            data = encode_bytes(data, encoding)
+            processed_data.system_tags.append(
+                Tag(name="content-encoding", value=encoding)
+            )
+        blob_d["file"] = _bytes_to_json(data)
+        blob_d["system_tags"] = [tag.dict() for tag in processed_data.system_tags]
+        return blob_d
+
+    async def delete_objects(
+        self, full_project_structure: FullProjectStructure, object_names: list[str]
     ):
+        # the data is only stored with the row
+        pass
 
-        blob_d = await self.get_blob_from_first_step(blob_id)
+    async def index_documents(
+        self, full_project_structure: FullProjectStructure, documents: list[dict]
+    ) -> list[str | None]:
         deployed_resources = GCPDeployedResources1(
             **full_project_structure.deploy.project_structure
         )
-        gcp_credentials_path = get_credentials_tmp_path(
-            full_project_structure.credentials
+        table_id = (
+            f"{deployed_resources.bigquery.project}."
+            f"{deployed_resources.bigquery.dataset}."
+            f"{deployed_resources.bigquery.table}"
         )
-        credentials = service_account.Credentials.from_service_account_file(
-            filename=gcp_credentials_path,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+        async with self.lease_bigquery_client(full_project_structure) as client:
+            return await insert_rows(self.run_blocking, client, table_id, documents)
+
+    async def estimate_search(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        time_range: TimeRange | None = None,
+    ) -> SearchEstimate:
+        deployed_resources = GCPDeployedResources1(
+            **full_project_structure.deploy.project_structure
         )
-        client = bigquery.Client(credentials=credentials)
         table_id = (
             f"{deployed_resources.bigquery.project}."
             f"{deployed_resources.bigquery.dataset}."
             f"{deployed_resources.bigquery.table}"
         )
+        sql, query_parameters = plan_search(table_id, tags, time_range)
+        async with self.lease_bigquery_client(full_project_structure) as client:
+            total_bytes_processed = await estimate_search(
+                self.run_blocking, client, sql, query_parameters
+            )
+        return SearchEstimate(
+            total_bytes_processed=total_bytes_processed,
+            maximum_bytes_billed=settings.bigquery_maximum_bytes_billed,
+        )
 
-        blob_d["file"] = _bytes_to_json(processed_data.data)
-        blob_d["size"] = len(processed_data.data)
-        blob_d["system_tags"] = [tag.dict() for tag in processed_data.system_tags]
-        errors = client.insert_rows_json(table_id, [blob_d])
-        if len(errors) == 0:
-            await self.delete_blob_from_first_step(blob_id)
-
-        for error in errors:
-            LOGGER.error(f"Insert error: {error}")
-
-    async def search_by_tags(
-        self, full_project_structure: FullProjectStructure, tags: list[Tag]
-    ):
+    async def get_blob(
+        self, full_project_structure: FullProjectStructure, blob_id: str
+    ) -> Blob | None:
         deployed_resources = GCPDeployedResources1(
             **full_project_structure.deploy.project_structure
         )
-        gcp_credentials_path = get_credentials_tmp_path(
-            full_project_structure.credentials
+        table_id = (
+            f"{deployed_resources.bigquery.project}."
+            f"{deployed_resources.bigquery.dataset}."
+            f"{deployed_resources.bigquery.table}"
         )
-        credentials = service_account.Credentials.from_service_account_file(
-            filename=gcp_credentials_path,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+
+        async def load() -> Blob | None:
+            row = await self.query_row(full_project_structure, table_id, blob_id)
+            return row_to_blob(row) if row is not None else None
+
+        blob = await BLOB_CACHE.get_or_load((table_id, blob_id), load)
+        if blob is None:
+            BLOB_CACHE.invalidate((table_id, blob_id))
+        return blob
+
+    async def open_object(
+        self, full_project_structure: FullProjectStructure, object_name: str
+    ) -> StoredObject | None:
+        # the data is inline in the row, at most a few MB
+        deployed_resources = GCPDeployedResources1(
+            **full_project_structure.deploy.project_structure
         )
-        client = bigquery.Client(credentials=credentials)
         table_id = (
             f"{deployed_resources.bigquery.project}."
             f"{deployed_resources.bigquery.dataset}."
             f"{deployed_resources.bigquery.table}"
         )
 
-        sql = f"""
-            SELECT DISTINCT
-                id,
-                name,
-                type,
-                size,
-                timestamp,
-                source,
-                TO_JSON_STRING(user_tags) AS user_tags,
-                TO_JSON_STRING(system_tags) AS system_tags
-            FROM
-              `{table_id}`
-        """
-        query_parameters = []
-
-        for i, tag in enumerate(tags):
-            if i == 0:
-                sql += "\nWHERE\n"
-            else:
-                sql += "\nAND\n"
-
-            sql += f"""
-            (
-                STRUCT(@tag_name_{i} AS name, @tag_value_{i} AS value) IN UNNEST(user_tags)
-                OR
-                STRUCT(@tag_name_{i} AS name, @tag_value_{i} AS value) IN UNNEST(system_tags)
-            )
-            """
-            query_parameters.extend(
-                (
-                    bigquery.ScalarQueryParameter(f"tag_name_{i}", "STRING", tag.name),
-                    bigquery.ScalarQueryParameter(
-                        f"tag_value_{i}", "STRING", tag.value
-                    ),
-                )
+        async def load() -> bytes | None:
+            row = await self.query_row(
+                full_project_structure, table_id, object_name, columns="file"
             )
+            return (row.file or b"") if row is not None else None
+
+        data = await DATA_CACHE.get_or_load((table_id, object_name), load)
+        if data is None:
+            DATA_CACHE.invalidate((table_id, object_name))
+            return None
+
+        def read(start: int, end: int) -> ByteStream:
+            return iter_bytes(data[start : end + 1], settings.download_chunk_size)
+
+        return StoredObject(len(data), read)
+
+    async def query_row(
+        self,
+        full_project_structure: FullProjectStructure,
+        table_id: str,
+        blob_id: str,
+        columns: str = SEARCH_COLUMNS,
+    ) -> Row | None:
+        sql, query_parameters = plan_get(table_id, blob_id, columns=columns)
+        async with self.lease_bigquery_client(full_project_structure) as client:
+            with bytes_billed_guard():
+                return await query_one(self.run_blocking, client, sql, query_parameters)
+
+    async def search_page(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        limit: int,
+        state: dict | None,
+        time_range: TimeRange | None = None,
+    ) -> tuple[list[Blob], dict | None]:
+        deployed_resources = GCPDeployedResources1(
+            **full_project_structure.deploy.project_structure
+        )
+        table_id = (
+            f"{deployed_resources.bigquery.project}."
+            f"{deployed_resources.bigquery.dataset}."
+            f"{deployed_resources.bigquery.table}"
+        )
 
-        job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
-        res = client.query(sql, job_config=job_config)
-
-        response = []
-        for row in res:
-            response.append(
-                Blob(
-                    blob_id=row.id,
-                    name=row.name,
-                    content_type=row.type,
-                    timestamp=row.timestamp.isoformat(),
-                    source=row.source,
-                    user_tags=json.loads(row.user_tags),
-                    system_tags=json.loads(row.system_tags),
-                    size=row.size,
+        sql, query_parameters = plan_search(table_id, tags, time_range)
+        LOGGER.debug(f"SQL: {sql}")
+        LOGGER.debug(f"Query parameters: {query_parameters}")
+        job_config = search_job_config(query_parameters)
+        async with self.lease_bigquery_client(full_project_structure) as client:
+            with bytes_billed_guard():
+                res, next_state = await query_page(
+                    self.run_blocking, client, sql, job_config, limit, state
                 )
-            )
 
-        print(len(response))
+        response = [row_to_blob(row) for row in res]
 
-        return response
+        return response, next_state
@@ -1,12 +1,35 @@
+import typing
+from urllib.parse import quote
+
 from google.cloud import bigtable, storage
 from google.cloud.bigtable import row_filters
-from google.oauth2 import service_account
+from google.cloud.bigtable.row import DirectRow, PartialRowData
+from google.cloud.bigtable.row_data import PartialRowsData
+from google.cloud.bigtable.row_set import RowSet
+from google.cloud.bigtable.table import Table
 from pydantic import BaseModel
 
-from api.models import Blob, FullProjectStructure, Tag
+from api.models import (
+    Blob,
+    FullProjectStructure,
+    GCPCredentials,
+    ServiceProviderType,
+    SignedUrl,
+    Tag,
+    TimeRange,
+)
+from config import settings
 from shared.blob_data_handlers.base import BaseBlobHandler
+from shared.blob_data_handlers.downloads import (
+    StoredObject,
+    iter_gcs_blob,
+    stat_gcs_blob,
+)
+from shared.blob_data_handlers.signed_urls import sign_gcs_url
+from shared.blob_data_handlers.uploads import delete_gcs_blobs, upload_stream_to_gcs
 from shared.data_processors.base_data_processor import ProcessedData
-from utils.gcp import get_credentials_tmp_path
+from utils.gcp import get_authorized_session, get_credentials
+from utils.streams import ByteStream
 
 
 class BigTableResource(BaseModel):
@@ -24,123 +47,297 @@ class GCPDeployedResources2(BaseModel):
     cloud_storage: CloudStorage
 
 
+class GCPClients2(typing.NamedTuple):
+    bigtable: bigtable.Client
+    storage: storage.Client
+
+
+def build_gcp_clients_2(credentials: GCPCredentials) -> GCPClients2:
+    gcp_credentials = get_credentials(credentials)
+    return GCPClients2(
+        bigtable=bigtable.Client(credentials=gcp_credentials, admin=True),
+        storage=storage.Client(
+            credentials=gcp_credentials,
+            _http=get_authorized_session(gcp_credentials),
+        ),
+    )
+
+
+CF_NAME = "ColumnFamily"
+
+# Index rows are keyed "idx#<tag name>#<tag value>#<blob id>", with name and
+# value URL-quoted, so the blobs with a tag are one row range. Blob rows are
+# keyed by their UUID and all sort before "idx#".
+INDEX_PREFIX = "idx#"
+
+# index reads only need the row keys
+KEYS_ONLY_FILTER = row_filters.RowFilterChain(
+    filters=[
+        row_filters.CellsRowLimitFilter(1),
+        row_filters.StripValueTransformerFilter(True),
+    ]
+)
+
+
+def tag_prefix(name: str, value: str | None) -> str:
+    return f"{INDEX_PREFIX}{quote(name, safe='')}#{quote(value or '', safe='')}#"
+
+
+def build_row(table: Table, document: dict) -> DirectRow:
+    row = table.direct_row(document["id"])
+    row.set_cell(CF_NAME, "id", document["id"])
+    row.set_cell(CF_NAME, "name", document["name"])
+    row.set_cell(CF_NAME, "type", document["type"])
+    row.set_cell(CF_NAME, "size", "0")
+    row.set_cell(CF_NAME, "timestamp", document["timestamp"])
+    row.set_cell(CF_NAME, "source", document["source"])
+
+    for user_tag in document["user_tags"]:
+        row.set_cell(CF_NAME, f"user_tag{user_tag['name']}", user_tag["value"])
+
+    for tag in document["system_tags"]:
+        row.set_cell(CF_NAME, f"system_tag{tag['name']}", tag["value"])
+    return row
+
+
+def build_index_rows(table: Table, blob_id: str, tags: list[dict]) -> list[DirectRow]:
+    prefixes = {tag_prefix(tag["name"], tag["value"]) for tag in tags}
+    rows = []
+    for prefix in sorted(prefixes):
+        row = table.direct_row(f"{prefix}{blob_id}")
+        row.set_cell(CF_NAME, "id", blob_id)
+        rows.append(row)
+    return rows
+
+
+def row_to_blob(row: PartialRowData) -> Blob:
+    rr = {}
+    user_tags = []
+    system_tags = []
+    for k, v in row.to_dict().items():
+        key: str = k.decode().removeprefix(f"{CF_NAME}:")
+        v = v[0].value.decode()
+        if key.startswith("user_tag"):
+            key = key.removeprefix("user_tag")
+            user_tags.append({"name": key, "value": v})
+        elif key.startswith("system_tag"):
+            key = key.removeprefix("system_tag")
+            system_tags.append({"name": key, "value": v})
+        else:
+            rr[key] = v
+    rr["user_tags"] = user_tags
+    rr["system_tags"] = system_tags
+    return Blob.from_document(rr, blob_id=row.row_key.decode())
+
+
+def iter_tag_blob_ids(rows: PartialRowsData, prefix: str) -> typing.Iterator[str]:
+    for row in rows:
+        yield row.row_key.decode().removeprefix(prefix)
+
+
+def read_tag_blob_ids(
+    table: Table, tags: list[Tag], after: str | None, limit: int
+) -> list[str]:
+    # The ids of the blobs with all the tags, after `after` and in order. The
+    # index ranges of the tags are sorted by blob id, they are intersected
+    # while they are read and the reads stop at `limit` ids.
+    streams = []
+    for tag in tags:
+        prefix = tag_prefix(tag.name, tag.value)
+        # the prefix ends with "#", "$" is the next character
+        rows = table.read_rows(
+            start_key=prefix + after + "\x00" if after else prefix,
+            end_key=prefix[:-1] + "$",
+            filter_=KEYS_ONLY_FILTER,
+        )
+        streams.append((rows, iter_tag_blob_ids(rows, prefix)))
+    blob_ids = []
+    try:
+        current = [next(ids, None) for _, ids in streams]
+        while len(blob_ids) < limit and None not in current:
+            target = max(current)
+            if all(blob_id == target for blob_id in current):
+                blob_ids.append(target)
+                current = [next(ids, None) for _, ids in streams]
+                continue
+            for i, (_, ids) in enumerate(streams):
+                while current[i] is not None and current[i] < target:
+                    current[i] = next(ids, None)
+    finally:
+        for rows, _ in streams:
+            rows.cancel()
+    return blob_ids
+
+
 class GCPBlobHandler2(BaseBlobHandler):
-    async def update_blob_data(
+    service_provider = ServiceProviderType.GCP
+
+    def lease_gcp_clients(
+        self, full_project_structure: FullProjectStructure
+    ) -> typing.AsyncContextManager[GCPClients2]:
+        return self.lease_clients(
+            full_project_structure,
+            lambda: build_gcp_clients_2(full_project_structure.credentials),
+        )
+
+    async def upload_object(
         self,
         full_project_structure: FullProjectStructure,
-        processed_data: ProcessedData,
-        blob_id: str,
+        object_name: str,
+        stream: ByteStream,
+    ):
+        deployed_resources = GCPDeployedResources2(
+            **full_project_structure.deploy.project_structure
+        )
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            bucket = clients.storage.bucket(deployed_resources.cloud_storage.bucket)
+            blob = bucket.blob(object_name)
+            await upload_stream_to_gcs(self.run_blocking, blob, stream)
+
+    async def delete_objects(
+        self, full_project_structure: FullProjectStructure, object_names: list[str]
     ):
-        blob_d = await self.get_blob_from_first_step(blob_id)
         deployed_resources = GCPDeployedResources2(
             **full_project_structure.deploy.project_structure
         )
-        gcp_credentials_path = get_credentials_tmp_path(
-            full_project_structure.credentials
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            bucket = clients.storage.bucket(deployed_resources.cloud_storage.bucket)
+            await delete_gcs_blobs(self.run_blocking, bucket, object_names)
+
+    def build_document(
+        self, blob_d: dict, processed_data: ProcessedData, blob_id: str
+    ) -> dict:
+        blob_d["system_tags"] = [tag.dict() for tag in processed_data.system_tags]
+        return blob_d
+
+    async def index_documents(
+        self, full_project_structure: FullProjectStructure, documents: list[dict]
+    ) -> list[str | None]:
+        deployed_resources = GCPDeployedResources2(
+            **full_project_structure.deploy.project_structure
         )
-        credentials = service_account.Credentials.from_service_account_file(
-            filename=gcp_credentials_path,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            instance = clients.bigtable.instance(deployed_resources.bigtable.instance)
+            table = instance.table(deployed_resources.bigtable.table)
+            rows = []
+            row_documents = []
+            for i, document in enumerate(documents):
+                document_rows = [
+                    build_row(table, document),
+                    *build_index_rows(
+                        table,
+                        document["id"],
+                        [*document["user_tags"], *document["system_tags"]],
+                    ),
+                ]
+                rows.extend(document_rows)
+                row_documents.extend([i] * len(document_rows))
+            statuses = await self.run_blocking(table.mutate_rows, rows)
+
+        errors = [None] * len(documents)
+        for i, status in zip(row_documents, statuses):
+            if status.code and errors[i] is None:
+                errors[i] = status.message
+        return errors
+
+    async def get_blob(
+        self, full_project_structure: FullProjectStructure, blob_id: str
+    ) -> Blob | None:
+        deployed_resources = GCPDeployedResources2(
+            **full_project_structure.deploy.project_structure
         )
-        bigtable_client = bigtable.Client(credentials=credentials, admin=True)
-        storage_client = storage.Client(credentials=credentials)
-        bucket = storage_client.bucket(deployed_resources.cloud_storage.bucket)
-        blob = bucket.blob(blob_id)
-        blob.upload_from_string(processed_data.data)
-
-        instance = bigtable_client.instance(deployed_resources.bigtable.instance)
-        table = instance.table(deployed_resources.bigtable.table)
-
-        cf_name = "ColumnFamily"
-
-        append_row = table.append_row(blob_id)
-        print(blob_d)
-
-        append_row.append_cell_value(cf_name, "id", blob_id)
-        append_row.append_cell_value(cf_name, "name", blob_d["name"])
-        append_row.append_cell_value(cf_name, "type", blob_d["type"])
-        append_row.append_cell_value(cf_name, "size", "0")
-        append_row.append_cell_value(cf_name, "timestamp", blob_d["timestamp"])
-        append_row.append_cell_value(cf_name, "source", blob_d["source"])
-
-        for user_tag in blob_d["user_tags"]:
-            append_row.append_cell_value(
-                cf_name, f"user_tag{user_tag['name']}", user_tag["value"]
-            )
-
-        for tag in processed_data.system_tags:
-            append_row.append_cell_value(cf_name, f"system_tag{tag.name}", tag.value)
-        append_row.commit()
-        await self.delete_blob_from_first_step(blob_id)
-
-    async def search_by_tags(
-        self, full_project_structure: FullProjectStructure, tags: list[Tag]
-    ):
+        if blob_id.startswith(INDEX_PREFIX):
+            return None
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            instance = clients.bigtable.instance(deployed_resources.bigtable.instance)
+            table = instance.table(deployed_resources.bigtable.table)
+            row = await self.run_blocking(table.read_row, blob_id)
+        return row_to_blob(row) if row is not None else None
+
+    async def open_object(
+        self, full_project_structure: FullProjectStructure, object_name: str
+    ) -> StoredObject | None:
         deployed_resources = GCPDeployedResources2(
             **full_project_structure.deploy.project_structure
         )
-        gcp_credentials_path = get_credentials_tmp_path(
-            full_project_structure.credentials
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            bucket = clients.storage.bucket(deployed_resources.cloud_storage.bucket)
+            size = await stat_gcs_blob(self.run_blocking, bucket, object_name)
+        if size is None:
+            return None
+
+        async def read(start: int, end: int) -> ByteStream:
+            async with self.lease_gcp_clients(full_project_structure) as clients:
+                bucket = clients.storage.bucket(deployed_resources.cloud_storage.bucket)
+                async for chunk in iter_gcs_blob(
+                    self.run_blocking, bucket.blob(object_name), start, end
+                ):
+                    yield chunk
+
+        return StoredObject(size, read)
+
+    async def sign_object_url(
+        self,
+        full_project_structure: FullProjectStructure,
+        object_name: str,
+        method: str,
+        content_type: str | None = None,
+    ) -> SignedUrl:
+        deployed_resources = GCPDeployedResources2(
+            **full_project_structure.deploy.project_structure
         )
-        credentials = service_account.Credentials.from_service_account_file(
-            filename=gcp_credentials_path,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            bucket = clients.storage.bucket(deployed_resources.cloud_storage.bucket)
+            return sign_gcs_url(bucket, object_name, method, content_type)
+
+    async def search_page(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        limit: int,
+        state: dict | None,
+        time_range: TimeRange | None = None,
+    ) -> tuple[list[Blob], dict | None]:
+        deployed_resources = GCPDeployedResources2(
+            **full_project_structure.deploy.project_structure
         )
-        bigtable_client = bigtable.Client(credentials=credentials, admin=True)
-        instance = bigtable_client.instance(deployed_resources.bigtable.instance)
-        table = instance.table(deployed_resources.bigtable.table)
-        row_filters_to_chain = []
-        for tag in tags:
-            row_filters_to_chain.append(
-                row_filters.RowFilterUnion(
-                    filters=[
-                        row_filters.RowFilterChain(
-                            filters=[
-                                row_filters.ColumnQualifierRegexFilter(
-                                    f"user_tag{tag.name}"
-                                ),
-                                row_filters.ValueRegexFilter(tag.value),
-                            ]
-                        ),
-                        row_filters.RowFilterChain(
-                            filters=[
-                                row_filters.ColumnQualifierRegexFilter(
-                                    f"system_tag{tag.name}"
-                                ),
-                                row_filters.ValueRegexFilter(tag.value),
-                            ]
-                        ),
-                    ]
+        # blob ids are returned in order, the next page starts after the last
+        after = state["after"] if state else None
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            instance = clients.bigtable.instance(deployed_resources.bigtable.instance)
+            table = instance.table(deployed_resources.bigtable.table)
+            if not tags:
+                res = await self.run_blocking(
+                    lambda: list(
+                        table.read_rows(
+                            start_key=after + "\x00" if after else None,
+                            end_key=INDEX_PREFIX,
+                            limit=limit,
+                        )
+                    )
                 )
-            )
-        # TODO: fix multiple tags filter
-        if not row_filters_to_chain:
-            res = table.read_rows()
-        elif len(row_filters_to_chain) == 1:
-            res = table.read_rows(filter_=row_filters_to_chain[0])
-        else:
-            res = table.read_rows(
-                filter_=row_filters.RowFilterChain(filters=row_filters_to_chain)
-            )
-        response = []
-        for r in res:
-            rr = {}
-            user_tags = []
-            system_tags = []
-            for k, v in r.to_dict().items():
-                key: str = k.decode().removeprefix("ColumnFamily:")
-                v = v[0].value.decode()
-                if key.startswith("user_tag"):
-                    key = key.removeprefix("user_tag")
-                    user_tags.append(Tag(name=key, value=v))
-                elif key.startswith("system_tag"):
-                    key = key.removeprefix("system_tag")
-                    system_tags.append(Tag(name=key, value=v))
-                else:
-                    rr[key] = v
-            rr["user_tags"] = user_tags
-            rr["system_tags"] = system_tags
-            rr["blob_id"] = r.row_key.decode()
-            response.append(Blob(**rr))
-        print(len(response))
-        return response
+                blobs = [row_to_blob(row) for row in res]
+                has_more = len(res) == limit
+                blob_ids = [blob.blob_id for blob in blobs]
+            else:
+                # one more id tells whether there is a next page
+                blob_ids = await self.run_blocking(
+                    read_tag_blob_ids, table, tags, after, limit + 1
+                )
+                has_more = len(blob_ids) > limit
+                blob_ids = blob_ids[:limit]
+                blobs = []
+                for start in range(0, len(blob_ids), settings.bigtable_read_batch_size):
+                    row_set = RowSet()
+                    for blob_id in blob_ids[
+                        start : start + settings.bigtable_read_batch_size
+                    ]:
+                        row_set.add_row_key(blob_id)
+                    res = await self.run_blocking(
+                        lambda: list(table.read_rows(row_set=row_set))
+                    )
+                    blobs.extend(row_to_blob(row) for row in res)
+
+        if not has_more:
+            return blobs, None
+        return blobs, {"after": blob_ids[-1]}
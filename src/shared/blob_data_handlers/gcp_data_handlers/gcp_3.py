@@ -1,14 +1,44 @@
-import json
+import typing
 
 from google.cloud import bigquery, storage
-from google.oauth2 import service_account
 from pydantic import BaseModel
 
-from api.models import Blob, FullProjectStructure, Tag
+from api.models import (
+    Blob,
+    FullProjectStructure,
+    GCPCredentials,
+    SearchEstimate,
+    ServiceProviderType,
+    SignedUrl,
+    Tag,
+    TimeRange,
+)
+from config import settings
 from shared.blob_data_handlers.base import BaseBlobHandler
+from shared.blob_data_handlers.downloads import (
+    StoredObject,
+    iter_gcs_blob,
+    stat_gcs_blob,
+)
+from shared.blob_data_handlers.gcp_data_handlers.bigquery_rows import (
+    insert_rows,
+    query_page,
+)
+from shared.blob_data_handlers.gcp_data_handlers.bigquery_search import (
+    bytes_billed_guard,
+    estimate_search,
+    plan_get,
+    plan_search,
+    query_one,
+    row_to_blob,
+    search_job_config,
+)
+from shared.blob_data_handlers.signed_urls import sign_gcs_url
+from shared.blob_data_handlers.uploads import delete_gcs_blobs, upload_stream_to_gcs
 from shared.data_processors.base_data_processor import ProcessedData
-from utils.gcp import get_credentials_tmp_path
+from utils.gcp import get_authorized_session, get_credentials
 from utils.logger import setup_logger
+from utils.streams import ByteStream
 
 LOGGER = setup_logger()
 
@@ -28,122 +58,190 @@ class GCPDeployedResources3(BaseModel):
     cloud_storage: CloudStorage
 
 
+class GCPClients3(typing.NamedTuple):
+    storage: storage.Client
+    bigquery: bigquery.Client
+
+
+def build_gcp_clients_3(credentials: GCPCredentials) -> GCPClients3:
+    gcp_credentials = get_credentials(credentials)
+    return GCPClients3(
+        storage=storage.Client(
+            credentials=gcp_credentials,
+            _http=get_authorized_session(gcp_credentials),
+        ),
+        bigquery=bigquery.Client(
+            credentials=gcp_credentials,
+            _http=get_authorized_session(gcp_credentials),
+        ),
+    )
+
+
 class GCPBlobHandler3(BaseBlobHandler):
-    async def update_blob_data(
+    service_provider = ServiceProviderType.GCP
+    supports_time_range = True
+
+    def lease_gcp_clients(
+        self, full_project_structure: FullProjectStructure
+    ) -> typing.AsyncContextManager[GCPClients3]:
+        return self.lease_clients(
+            full_project_structure,
+            lambda: build_gcp_clients_3(full_project_structure.credentials),
+        )
+
+    async def upload_object(
         self,
         full_project_structure: FullProjectStructure,
-        processed_data: ProcessedData,
-        blob_id: str,
+        object_name: str,
+        stream: ByteStream,
     ):
+        deployed_resources = GCPDeployedResources3(
+            **full_project_structure.deploy.project_structure
+        )
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            bucket = clients.storage.bucket(deployed_resources.cloud_storage.bucket)
+            blob = bucket.blob(object_name)
+            await upload_stream_to_gcs(self.run_blocking, blob, stream)
 
-        blob_d = await self.get_blob_from_first_step(blob_id)
+    async def delete_objects(
+        self, full_project_structure: FullProjectStructure, object_names: list[str]
+    ):
         deployed_resources = GCPDeployedResources3(
             **full_project_structure.deploy.project_structure
         )
-        gcp_credentials_path = get_credentials_tmp_path(
-            full_project_structure.credentials
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            bucket = clients.storage.bucket(deployed_resources.cloud_storage.bucket)
+            await delete_gcs_blobs(self.run_blocking, bucket, object_names)
+
+    def build_document(
+        self, blob_d: dict, processed_data: ProcessedData, blob_id: str
+    ) -> dict:
+        blob_d["size"] = processed_data.size
+        blob_d["system_tags"] = [tag.dict() for tag in processed_data.system_tags]
+        return blob_d
+
+    async def index_documents(
+        self, full_project_structure: FullProjectStructure, documents: list[dict]
+    ) -> list[str | None]:
+        deployed_resources = GCPDeployedResources3(
+            **full_project_structure.deploy.project_structure
         )
-        credentials = service_account.Credentials.from_service_account_file(
-            filename=gcp_credentials_path,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+        table_id = (
+            f"{deployed_resources.bigquery.project}."
+            f"{deployed_resources.bigquery.dataset}."
+            f"{deployed_resources.bigquery.table}"
         )
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            return await insert_rows(
+                self.run_blocking, clients.bigquery, table_id, documents
+            )
 
-        storage_client = storage.Client(credentials=credentials)
-        bucket = storage_client.bucket(deployed_resources.cloud_storage.bucket)
-        blob = bucket.blob(blob_id)
-        blob.upload_from_string(processed_data.data)
-
-        client = bigquery.Client(credentials=credentials)
+    async def estimate_search(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        time_range: TimeRange | None = None,
+    ) -> SearchEstimate:
+        deployed_resources = GCPDeployedResources3(
+            **full_project_structure.deploy.project_structure
+        )
         table_id = (
             f"{deployed_resources.bigquery.project}."
             f"{deployed_resources.bigquery.dataset}."
             f"{deployed_resources.bigquery.table}"
         )
+        sql, query_parameters = plan_search(table_id, tags, time_range)
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            total_bytes_processed = await estimate_search(
+                self.run_blocking, clients.bigquery, sql, query_parameters
+            )
+        return SearchEstimate(
+            total_bytes_processed=total_bytes_processed,
+            maximum_bytes_billed=settings.bigquery_maximum_bytes_billed,
+        )
 
-        blob_d["size"] = len(processed_data.data)
-        blob_d["system_tags"] = [tag.dict() for tag in processed_data.system_tags]
-        errors = client.insert_rows_json(table_id, [blob_d])
-        if len(errors) == 0:
-            await self.delete_blob_from_first_step(blob_id)
-
-        for error in errors:
-            LOGGER.error(f"Insert error: {error}")
-
-    async def search_by_tags(
-        self, full_project_structure: FullProjectStructure, tags: list[Tag]
-    ):
+    async def open_object(
+        self, full_project_structure: FullProjectStructure, object_name: str
+    ) -> StoredObject | None:
         deployed_resources = GCPDeployedResources3(
             **full_project_structure.deploy.project_structure
         )
-        gcp_credentials_path = get_credentials_tmp_path(
-            full_project_structure.credentials
-        )
-        credentials = service_account.Credentials.from_service_account_file(
-            filename=gcp_credentials_path,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            bucket = clients.storage.bucket(deployed_resources.cloud_storage.bucket)
+            size = await stat_gcs_blob(self.run_blocking, bucket, object_name)
+        if size is None:
+            return None
+
+        async def read(start: int, end: int) -> ByteStream:
+            async with self.lease_gcp_clients(full_project_structure) as clients:
+                bucket = clients.storage.bucket(deployed_resources.cloud_storage.bucket)
+                async for chunk in iter_gcs_blob(
+                    self.run_blocking, bucket.blob(object_name), start, end
+                ):
+                    yield chunk
+
+        return StoredObject(size, read)
+
+    async def get_blob(
+        self, full_project_structure: FullProjectStructure, blob_id: str
+    ) -> Blob | None:
+        deployed_resources = GCPDeployedResources3(
+            **full_project_structure.deploy.project_structure
         )
-        client = bigquery.Client(credentials=credentials)
         table_id = (
             f"{deployed_resources.bigquery.project}."
             f"{deployed_resources.bigquery.dataset}."
             f"{deployed_resources.bigquery.table}"
         )
-
-        sql = f"""
-            SELECT DISTINCT
-                id,
-                name,
-                type,
-                size,
-                timestamp,
-                source,
-                TO_JSON_STRING(user_tags) AS user_tags,
-                TO_JSON_STRING(system_tags) AS system_tags
-            FROM
-              `{table_id}`
-        """
-        query_parameters = []
-
-        for i, tag in enumerate(tags):
-            if i == 0:
-                sql += "\nWHERE\n"
-            else:
-                sql += "\nAND\n"
-
-            sql += f"""
-            (
-                STRUCT(@tag_name_{i} AS name, @tag_value_{i} AS value) IN UNNEST(user_tags)
-                OR
-                STRUCT(@tag_name_{i} AS name, @tag_value_{i} AS value) IN UNNEST(system_tags)
-            )
-            """
-            query_parameters.extend(
-                (
-                    bigquery.ScalarQueryParameter(f"tag_name_{i}", "STRING", tag.name),
-                    bigquery.ScalarQueryParameter(
-                        f"tag_value_{i}", "STRING", tag.value
-                    ),
+        sql, query_parameters = plan_get(table_id, blob_id)
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            with bytes_billed_guard():
+                row = await query_one(
+                    self.run_blocking, clients.bigquery, sql, query_parameters
                 )
-            )
+        return row_to_blob(row) if row is not None else None
+
+    async def sign_object_url(
+        self,
+        full_project_structure: FullProjectStructure,
+        object_name: str,
+        method: str,
+        content_type: str | None = None,
+    ) -> SignedUrl:
+        deployed_resources = GCPDeployedResources3(
+            **full_project_structure.deploy.project_structure
+        )
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            bucket = clients.storage.bucket(deployed_resources.cloud_storage.bucket)
+            return sign_gcs_url(bucket, object_name, method, content_type)
+
+    async def search_page(
+        self,
+        full_project_structure: FullProjectStructure,
+        tags: list[Tag],
+        limit: int,
+        state: dict | None,
+        time_range: TimeRange | None = None,
+    ) -> tuple[list[Blob], dict | None]:
+        deployed_resources = GCPDeployedResources3(
+            **full_project_structure.deploy.project_structure
+        )
+        table_id = (
+            f"{deployed_resources.bigquery.project}."
+            f"{deployed_resources.bigquery.dataset}."
+            f"{deployed_resources.bigquery.table}"
+        )
 
+        sql, query_parameters = plan_search(table_id, tags, time_range)
         LOGGER.debug(f"SQL: {sql}")
         LOGGER.debug(f"Query parameters: {query_parameters}")
-        job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
-        res = client.query(sql, job_config=job_config)
-
-        response = []
-        for row in res:
-            response.append(
-                Blob(
-                    blob_id=row.id,
-                    name=row.name,
-                    content_type=row.type,
-                    timestamp=row.timestamp.isoformat(),
-                    source=row.source,
-                    user_tags=json.loads(row.user_tags),
-                    system_tags=json.loads(row.system_tags),
-                    size=row.size,
+        job_config = search_job_config(query_parameters)
+        async with self.lease_gcp_clients(full_project_structure) as clients:
+            with bytes_billed_guard():
+                res, next_state = await query_page(
+                    self.run_blocking, clients.bigquery, sql, job_config, limit, state
                 )
-            )
 
-        return response
+        response = [row_to_blob(row) for row in res]
+
+        return response, next_state
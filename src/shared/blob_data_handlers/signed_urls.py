@@ -0,0 +1,97 @@
+import datetime
+import typing
+
+from azure.storage.blob import BlobSasPermissions, ContainerClient, generate_blob_sas
+from fastapi import HTTPException, status
+from google.cloud import storage
+
+from api.models import SignedUrl
+from config import settings
+
+# The URLs are signed locally with the client credentials, no request is made.
+# Uploads are a single PUT of the whole object with the headers returned.
+
+S3_OPERATIONS = {"PUT": "put_object", "GET": "get_object"}
+
+
+def get_expiration() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        seconds=settings.signed_url_expiration
+    )
+
+
+def get_headers(method: str, content_type: str | None) -> dict[str, str]:
+    # the content type is part of the signature of an upload
+    return {"Content-Type": content_type} if method == "PUT" and content_type else {}
+
+
+def sign_s3_url(
+    s3_client: typing.Any,
+    bucket: str,
+    key: str,
+    method: str,
+    content_type: str | None = None,
+) -> SignedUrl:
+    expires_at = get_expiration()
+    params = {"Bucket": bucket, "Key": key}
+    headers = get_headers(method, content_type)
+    if headers:
+        params["ContentType"] = content_type
+    url = s3_client.generate_presigned_url(
+        S3_OPERATIONS[method],
+        Params=params,
+        ExpiresIn=settings.signed_url_expiration,
+        HttpMethod=method,
+    )
+    return SignedUrl(url=url, method=method, headers=headers, expires_at=expires_at)
+
+
+def sign_gcs_url(
+    bucket: storage.Bucket,
+    name: str,
+    method: str,
+    content_type: str | None = None,
+) -> SignedUrl:
+    expires_at = get_expiration()
+    headers = get_headers(method, content_type)
+    url = bucket.blob(name).generate_signed_url(
+        version="v4",
+        expiration=expires_at,
+        method=method,
+        content_type=headers.get("Content-Type"),
+    )
+    return SignedUrl(url=url, method=method, headers=headers, expires_at=expires_at)
+
+
+def sign_azure_url(
+    container_client: ContainerClient,
+    blob_name: str,
+    method: str,
+    content_type: str | None = None,
+) -> SignedUrl:
+    # a SAS is signed with the storage account key
+    account_key = getattr(container_client.credential, "account_key", None)
+    if not account_key:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Signed URLs need a storage account key",
+        )
+    expires_at = get_expiration()
+    permission = (
+        BlobSasPermissions(create=True, write=True)
+        if method == "PUT"
+        else BlobSasPermissions(read=True)
+    )
+    sas = generate_blob_sas(
+        container_client.account_name,
+        container_client.container_name,
+        blob_name,
+        account_key=account_key,
+        permission=permission,
+        expiry=expires_at,
+    )
+    headers = get_headers(method, content_type)
+    if method == "PUT":
+        headers["x-ms-blob-type"] = "BlockBlob"
+    url = f"{container_client.get_blob_client(blob_name).url}?{sas}"
+    return SignedUrl(url=url, method=method, headers=headers, expires_at=expires_at)
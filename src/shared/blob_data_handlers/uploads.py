@@ -0,0 +1,154 @@
+import asyncio
+import base64
+import typing
+
+from azure.storage.blob import BlobBlock, ContainerClient
+from google.cloud import storage
+
+from config import settings
+from utils.logger import setup_logger
+from utils.streams import ByteStream, rechunk
+
+LOGGER = setup_logger()
+
+RunBlocking = typing.Callable[..., typing.Awaitable[typing.Any]]
+
+
+async def _chain(first: bytes, second: bytes, rest: ByteStream) -> ByteStream:
+    yield first
+    yield second
+    async for part in rest:
+        yield part
+
+
+async def split_parts(
+    stream: ByteStream,
+) -> tuple[bytes | None, ByteStream | None]:
+    # objects that fit into one part are uploaded with a single request,
+    # larger ones as a multipart/resumable/block upload of all the parts
+    parts = rechunk(stream, settings.upload_chunk_size)
+    first = await anext(parts, b"")
+    second = await anext(parts, None)
+    if second is None:
+        return first, None
+    return None, _chain(first, second, parts)
+
+
+async def upload_stream_to_s3(
+    run_blocking: RunBlocking,
+    s3_client: typing.Any,
+    bucket: str,
+    key: str,
+    stream: ByteStream,
+):
+    single_part, parts = await split_parts(stream)
+    if parts is None:
+        await run_blocking(
+            s3_client.put_object, Body=single_part, Bucket=bucket, Key=key
+        )
+        return
+
+    upload = await run_blocking(
+        s3_client.create_multipart_upload, Bucket=bucket, Key=key
+    )
+    try:
+        uploaded_parts = []
+        part_number = 0
+        async for part in parts:
+            part_number += 1
+            response = await run_blocking(
+                s3_client.upload_part,
+                Body=part,
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload["UploadId"],
+                PartNumber=part_number,
+            )
+            uploaded_parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        await run_blocking(
+            s3_client.complete_multipart_upload,
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload["UploadId"],
+            MultipartUpload={"Parts": uploaded_parts},
+        )
+    except BaseException:
+        # uploaded parts are billed until the upload is aborted
+        await asyncio.shield(
+            run_blocking(
+                s3_client.abort_multipart_upload,
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload["UploadId"],
+            )
+        )
+        raise
+
+
+async def upload_stream_to_gcs(
+    run_blocking: RunBlocking, blob: storage.Blob, stream: ByteStream
+):
+    single_part, parts = await split_parts(stream)
+    if parts is None:
+        await run_blocking(blob.upload_from_string, single_part)
+        return
+
+    # resumable upload, the writer sends every chunk_size bytes it gets
+    writer = await run_blocking(
+        blob.open, "wb", chunk_size=settings.upload_chunk_size, ignore_flush=True
+    )
+    async for part in parts:
+        await run_blocking(writer.write, part)
+    await run_blocking(writer.close)
+
+
+async def upload_stream_to_azure(
+    run_blocking: RunBlocking,
+    container_client: ContainerClient,
+    blob_name: str,
+    stream: ByteStream,
+):
+    single_part, parts = await split_parts(stream)
+    if parts is None:
+        await run_blocking(container_client.upload_blob, blob_name, single_part)
+        return
+
+    blob_client = container_client.get_blob_client(blob_name)
+    block_list = []
+    async for part in parts:
+        block_id = base64.b64encode(f"{len(block_list):08d}".encode()).decode()
+        await run_blocking(blob_client.stage_block, block_id, part)
+        block_list.append(BlobBlock(block_id=block_id))
+    await run_blocking(blob_client.commit_block_list, block_list)
+
+
+async def delete_s3_objects(
+    run_blocking: RunBlocking, s3_client: typing.Any, bucket: str, keys: list[str]
+):
+    # one request deletes up to 1000 keys
+    for start in range(0, len(keys), 1000):
+        response = await run_blocking(
+            s3_client.delete_objects,
+            Bucket=bucket,
+            Delete={
+                "Objects": [{"Key": key} for key in keys[start : start + 1000]],
+                "Quiet": True,
+            },
+        )
+        for error in response.get("Errors", []):
+            LOGGER.error(f"Failed to delete object {error['Key']}: {error['Message']}")
+
+
+async def delete_gcs_blobs(
+    run_blocking: RunBlocking, bucket: storage.Bucket, names: list[str]
+):
+    # blobs that are already gone are ignored
+    await run_blocking(bucket.delete_blobs, names, on_error=lambda blob: None)
+
+
+async def delete_azure_blobs(
+    run_blocking: RunBlocking, container_client: ContainerClient, names: list[str]
+):
+    await run_blocking(
+        container_client.delete_blobs, *names, raise_on_any_failure=False
+    )
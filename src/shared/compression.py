@@ -0,0 +1,84 @@
+import zlib
+
+from config import settings
+from shared.data_processors.base_data_processor import ProcessedData
+from utils.streams import ByteStream
+
+try:
+    import zstandard
+except ImportError:  # gzip is used instead
+    zstandard = None
+
+ZSTD = "zstd"
+GZIP = "gzip"
+
+
+def available_encoding(encoding: str | None) -> str | None:
+    if encoding == ZSTD and zstandard is None:
+        return GZIP
+    if encoding in (ZSTD, GZIP):
+        return encoding
+    return None
+
+
+def choose_encoding(processed_data: ProcessedData) -> str | None:
+    # Only formats that compress well are compressed, images and archives
+    # are stored as they are.
+    content_type = ""
+    for tag in processed_data.system_tags:
+        if tag.name == "content-type" and tag.value:
+            content_type = tag.value.split(";", 1)[0].strip().lower()
+    if not any(
+        content_type.startswith(prefix) for prefix in settings.compression_content_types
+    ):
+        return None
+    return available_encoding(settings.compression_encoding)
+
+
+def _compressor(encoding: str):
+    if encoding == ZSTD:
+        return zstandard.ZstdCompressor(level=settings.zstd_level).compressobj()
+    # wbits 31 writes the gzip container
+    return zlib.compressobj(settings.gzip_level, zlib.DEFLATED, 31)
+
+
+def _decompressor(encoding: str):
+    if encoding == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is needed to read zstd compressed data")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if encoding == GZIP:
+        return zlib.decompressobj(31)
+    raise ValueError(f"Unknown content encoding {encoding!r}")
+
+
+async def encode_stream(stream: ByteStream, encoding: str | None) -> ByteStream:
+    if encoding is None:
+        async for chunk in stream:
+            yield chunk
+        return
+    compressor = _compressor(encoding)
+    async for chunk in stream:
+        if compressed := compressor.compress(chunk):
+            yield compressed
+    yield compressor.flush()
+
+
+async def decode_stream(stream: ByteStream, encoding: str | None) -> ByteStream:
+    if encoding is None:
+        async for chunk in stream:
+            yield chunk
+        return
+    decompressor = _decompressor(encoding)
+    async for chunk in stream:
+        if data := decompressor.decompress(chunk):
+            yield data
+    if encoding == GZIP and (data := decompressor.flush()):
+        yield data
+
+
+def encode_bytes(data: bytes, encoding: str | None) -> bytes:
+    if encoding is None:
+        return data
+    compressor = _compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
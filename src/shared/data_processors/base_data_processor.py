@@ -1,14 +1,72 @@
+import hashlib
+import tempfile
+
 from fastapi import Request
 from pydantic import BaseModel
+from starlette.datastructures import Headers
 
 from api.models import Tag
+from config import settings
+from utils.executors import run_blocking
+from utils.streams import ByteStream, iter_file, read_all
 
 
 class ProcessedData(BaseModel):
-    data: bytes
+    stream: ByteStream
     system_tags: list[Tag]
+    size: int = 0  # bytes consumed from the stream so far
+    digest: str | None = None  # sha256, set by spool()
+    spooled_size: int | None = None
+    # the object the data was uploaded to, None when it wasn't uploaded
+    stored_object: str | None = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    async def iter_chunks(self) -> ByteStream:
+        async for chunk in self.stream:
+            if chunk:
+                self.size += len(chunk)
+                yield chunk
+
+    async def spool(self) -> str:
+        # Reads the stream into a spooled temporary file while hashing it, the
+        # stream then reads back from the file. Returns the sha256.
+        digest = hashlib.sha256()
+        size = 0
+        file = tempfile.SpooledTemporaryFile(max_size=settings.content_spool_max_memory)
+        try:
+            async for chunk in self.stream:
+                digest.update(chunk)
+                await run_blocking("FILES", file.write, chunk)
+                size += len(chunk)
+        except BaseException:
+            file.close()
+            raise
+        self.stream = iter_file(file, settings.upload_chunk_size)
+        self.digest = digest.hexdigest()
+        self.spooled_size = size
+        return self.digest
+
+    async def discard(self):
+        # drops the data without storing it
+        await self.stream.aclose()
+        if self.spooled_size is not None:
+            self.size = self.spooled_size
+
+    async def read(self) -> bytes:
+        # only for backends that can't take the data as a stream
+        return await read_all(self.iter_chunks())
 
 
 class BaseDataProcessor:
+    # the tags can't be extracted from the first bytes of the data alone
+    needs_all_data = False
+
     async def process_request(self, request: Request) -> ProcessedData:
+        return await self.process_stream(request.stream(), request.headers)
+
+    async def process_stream(
+        self, stream: ByteStream, headers: Headers
+    ) -> ProcessedData:
         raise NotImplementedError()
@@ -1,13 +1,16 @@
-from fastapi import Request
+from starlette.datastructures import Headers
 
 from shared.data_processors.base_data_processor import BaseDataProcessor, ProcessedData
 from utils.logger import setup_logger
+from utils.streams import ByteStream
 
 LOGGER = setup_logger()
 
 
 class DefaultDataProcessor(BaseDataProcessor):
-    async def process_request(self, request: Request) -> ProcessedData:
-        LOGGER.info(request)
+    async def process_stream(
+        self, stream: ByteStream, headers: Headers
+    ) -> ProcessedData:
+        LOGGER.info(headers)
 
         raise NotImplementedError()
@@ -5,6 +5,7 @@ from fastapi import Request
 from starlette.datastructures import Headers
 
 from api.models import Tag
+from config import settings
 from shared.data_processors.base_data_processor import ProcessedData
 from shared.data_processors.default_data_processor import DefaultDataProcessor
 from shared.data_processors.images_jpeg_processor import ImagesJpegProcessor
@@ -12,6 +13,7 @@ from shared.data_processors.json_data_processor import JsonDataProcessor
 from shared.data_processors.multipart_data_processor import MultipartDataProcessor
 from shared.data_processors.text_processor import TextProcessor
 from utils.logger import setup_logger
+from utils.streams import ByteStream, iter_bytes
 
 LOGGER = setup_logger()
 
@@ -38,21 +40,79 @@ class GeneralDataProcessor:
         return headers.get("content-type")
 
     async def process_request(self, request: Request) -> ProcessedData:
+        return await self.process_stream(request.stream(), request.headers)
+
+    async def process_stream(
+        self, stream: ByteStream, headers: Headers
+    ) -> ProcessedData:
         content_type = self.content_type_to_internal_content_type(
-            self.get_content_type_from_headers(request.headers)
+            self.get_content_type_from_headers(headers)
         )
-        LOGGER.info(f"Headers: {request.headers}")
+        LOGGER.info(f"Headers: {headers}")
         LOGGER.info(f"Content-type: {content_type}")
         content_type_handler = CONTENT_TYPE_HANDLERS.get(
             content_type, DefaultDataProcessor
         )
         LOGGER.debug(content_type_handler)
-        processed_data = await content_type_handler().process_request(request)
+        processed_data = await content_type_handler().process_stream(stream, headers)
 
-        tags = self.extract_system_tags_from_headers(request.headers)
+        tags = self.extract_system_tags_from_headers(headers)
         processed_data.system_tags.extend(tags)
         return processed_data
 
+    async def iter_form_parts(
+        self, stream: ByteStream, headers: Headers
+    ) -> typing.AsyncIterator[Tag | ProcessedData]:
+        # A multipart/form-data body: the form fields as tags and the file
+        # parts processed by their content type. The data of a file part has
+        # to be consumed before the next part is read.
+        async for part in MultipartDataProcessor().iter_parts(stream, headers):
+            if isinstance(part, Tag):
+                yield part
+                continue
+            content_type = self.content_type_to_internal_content_type(
+                self.get_content_type_from_headers(part.headers)
+            )
+            if content_type in CONTENT_TYPE_HANDLERS:
+                processed_data = await self.process_stream(part.stream, part.headers)
+            else:
+                # stored as is, like the whole body of a form
+                processed_data = ProcessedData(
+                    stream=part.stream,
+                    system_tags=self.extract_system_tags_from_headers(part.headers),
+                )
+            processed_data.system_tags.append(Tag(name="form-field", value=part.name))
+            if part.filename:
+                processed_data.system_tags.append(
+                    Tag(name="filename", value=part.filename)
+                )
+            yield processed_data
+
+    async def process_head(
+        self, head: bytes, headers: Headers, complete: bool
+    ) -> list[Tag]:
+        # system tags of data that was stored directly, from its first bytes,
+        # complete when head is all of the data
+        content_type = self.content_type_to_internal_content_type(
+            self.get_content_type_from_headers(headers)
+        )
+        content_type_handler = CONTENT_TYPE_HANDLERS.get(content_type)
+        tags = []
+        if content_type_handler is None:
+            # stored as is, like data of a type no processor knows
+            LOGGER.info(f"No tags to extract from {headers.get('content-type')} data")
+        elif complete or not content_type_handler.needs_all_data:
+            processed_data = await content_type_handler().process_stream(
+                iter_bytes(head, settings.upload_chunk_size), headers
+            )
+            await processed_data.discard()
+            tags = processed_data.system_tags
+        else:
+            LOGGER.info(f"Data too large to extract the {headers['content-type']} tags")
+
+        tags.extend(self.extract_system_tags_from_headers(headers))
+        return tags
+
     def extract_system_tags_from_headers(self, headers: Headers) -> list[Tag]:
         tags = []
         for expected_header in ["content-length", "host", "user-agent", "content-type"]:
@@ -1,10 +1,24 @@
 import tempfile
 
-import exiftool
-from fastapi import Request
+from starlette.datastructures import Headers
 
 from api.models import Tag
+from config import settings
 from shared.data_processors.base_data_processor import BaseDataProcessor, ProcessedData
+from shared.data_processors.jpeg_header import (
+    NATIVE_TAGS,
+    JpegHeaderError,
+    parse_jpeg_header,
+)
+from shared.exiftool_pool import EXIFTOOL_POOL, get_tmp_dir
+from utils.logger import setup_logger
+from utils.streams import ByteStream, iter_file, prepend
+
+LOGGER = setup_logger()
+
+
+def filter_metadata(metadata: dict, tags: list[str]) -> dict:
+    return {tag: metadata[tag] for tag in tags if tag in metadata}
 
 
 def convert_metadata_to_tags_list(metadata: dict) -> list[Tag]:
@@ -16,15 +30,61 @@ def convert_metadata_to_tags_list(metadata: dict) -> list[Tag]:
 
 
 class ImagesJpegProcessor(BaseDataProcessor):
-    async def process_request(self, request: Request) -> ProcessedData:
-        image_data = await request.body()
+    async def process_stream(
+        self, stream: ByteStream, headers: Headers
+    ) -> ProcessedData:
+        tags = settings.jpeg_metadata_tags
+        if tags and NATIVE_TAGS.issuperset(tags):
+            chunks, metadata = await self.read_header(stream)
+            stream = prepend(chunks, stream)
+            if metadata is not None:
+                # the data goes to the storage as it comes in
+                return ProcessedData(
+                    stream=stream,
+                    system_tags=convert_metadata_to_tags_list(
+                        filter_metadata(metadata, tags)
+                    ),
+                )
+        return await self.process_with_exiftool(stream, tags)
 
-        # exiftool necessarily needs the path to the file to work
-        with tempfile.NamedTemporaryFile() as tf, exiftool.ExifToolHelper() as et:
-            tf.write(image_data)
-            tf.seek(0)
-            metadata = et.get_metadata(tf.name)[0]
+    async def read_header(self, stream: ByteStream) -> tuple[list[bytes], dict | None]:
+        # returns the chunks read and the metadata, None when the header
+        # couldn't be parsed from the first jpeg_header_max_size bytes
+        chunks = []
+        header = b""
+        async for chunk in stream:
+            chunks.append(chunk)
+            header += chunk
+            try:
+                metadata = parse_jpeg_header(header)
+            except JpegHeaderError as e:
+                LOGGER.info(f"JPEG header not parsed, falling back to exiftool: {e}")
+                return chunks, None
+            if metadata is not None:
+                return chunks, metadata
+            if len(header) >= settings.jpeg_header_max_size:
+                break
+        return chunks, None
 
-        tags = convert_metadata_to_tags_list(metadata)
+    async def process_with_exiftool(
+        self, stream: ByteStream, tags: list[str]
+    ) -> ProcessedData:
+        # exiftool necessarily needs the path to the file to work (its stdin
+        # carries the -stay_open commands), the same file is then streamed to
+        # the storage
+        tf = tempfile.NamedTemporaryFile(dir=get_tmp_dir())
+        try:
+            async for chunk in stream:
+                tf.write(chunk)
+            tf.flush()
+            metadata = await EXIFTOOL_POOL.get_metadata(tf.name, tags or None)
+        except BaseException:
+            tf.close()
+            raise
+        if tags:
+            metadata = filter_metadata(metadata, tags)
 
-        return ProcessedData(data=image_data, system_tags=tags)
+        return ProcessedData(
+            stream=iter_file(tf, settings.upload_chunk_size),
+            system_tags=convert_metadata_to_tags_list(metadata),
+        )
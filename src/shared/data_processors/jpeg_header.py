@@ -0,0 +1,275 @@
+import re
+import struct
+
+# Reads the metadata exiftool would report (with -G -n) for the most common
+# tags straight from the JPEG header: the SOF segment and the EXIF and XMP
+# APP1 segments, which all come before the image data.
+
+
+class JpegHeaderError(ValueError):
+    pass
+
+
+EXIF_HEADER = b"Exif\x00\x00"
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF,
+}  # fmt: skip
+# markers without a length field
+STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+SOS_MARKER = 0xDA
+EOI_MARKER = 0xD9
+
+IFD0_TAGS = {
+    0x010F: "Make",
+    0x0110: "Model",
+    0x0112: "Orientation",
+    0x011A: "XResolution",
+    0x011B: "YResolution",
+    0x0128: "ResolutionUnit",
+    0x0131: "Software",
+    0x0132: "ModifyDate",
+    0x013B: "Artist",
+    0x8298: "Copyright",
+}
+EXIF_IFD_TAGS = {
+    0x829A: "ExposureTime",
+    0x829D: "FNumber",
+    0x8827: "ISO",
+    0x9003: "DateTimeOriginal",
+    0x9004: "CreateDate",
+    0x9010: "OffsetTime",
+    0x9011: "OffsetTimeOriginal",
+    0x920A: "FocalLength",
+    0xA002: "ExifImageWidth",
+    0xA003: "ExifImageHeight",
+    0xA433: "LensMake",
+    0xA434: "LensModel",
+}
+GPS_IFD_TAGS = {
+    0x0001: "GPSLatitudeRef",
+    0x0002: "GPSLatitude",
+    0x0003: "GPSLongitudeRef",
+    0x0004: "GPSLongitude",
+    0x0005: "GPSAltitudeRef",
+    0x0006: "GPSAltitude",
+    0x0007: "GPSTimeStamp",
+    0x001D: "GPSDateStamp",
+}
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+
+# TIFF field type: (struct format, size)
+FIELD_TYPES = {
+    1: ("B", 1),  # BYTE
+    2: ("s", 1),  # ASCII
+    3: ("H", 2),  # SHORT
+    4: ("L", 4),  # LONG
+    5: ("LL", 8),  # RATIONAL
+    6: ("b", 1),  # SBYTE
+    7: ("B", 1),  # UNDEFINED
+    8: ("h", 2),  # SSHORT
+    9: ("l", 4),  # SLONG
+    10: ("ll", 8),  # SRATIONAL
+}
+
+XMP_TAGS = {
+    "Rating",
+    "Label",
+    "CreatorTool",
+    "CreateDate",
+    "ModifyDate",
+    "Title",
+    "Description",
+    "Creator",
+}
+XMP_ATTRIBUTE_RE = re.compile(rb'\b\w+:(\w+)="([^"]*)"')
+XMP_ELEMENT_RE = re.compile(rb"<\w+:(\w+)>([^<]+)</\w+:\1>")
+XMP_LIST_ITEM_RE = re.compile(
+    rb"<\w+:(\w+)>\s*<rdf:(?:Alt|Bag|Seq)>\s*<rdf:li[^>]*>([^<]+)"
+)
+
+NATIVE_TAGS = {
+    "File:ImageWidth",
+    "File:ImageHeight",
+    "File:BitsPerSample",
+    "File:ColorComponents",
+    *(f"EXIF:{name}" for name in IFD0_TAGS.values()),
+    *(f"EXIF:{name}" for name in EXIF_IFD_TAGS.values()),
+    *(f"EXIF:{name}" for name in GPS_IFD_TAGS.values()),
+    "Composite:GPSLatitude",
+    "Composite:GPSLongitude",
+    *(f"XMP:{name}" for name in XMP_TAGS),
+}
+
+
+def parse_jpeg_header(data: bytes) -> dict | None:
+    # Returns the metadata once the header up to the start of frame is in
+    # data, None when more bytes are needed.
+    if len(data) < 2:
+        return None
+    if data[:2] != b"\xff\xd8":
+        raise JpegHeaderError("Not a JPEG file")
+
+    metadata = {}
+    offset = 2
+    while True:
+        if offset + 2 > len(data):
+            return None
+        if data[offset] != 0xFF:
+            raise JpegHeaderError(f"Expected a marker at offset {offset}")
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # fill byte
+            offset += 1
+            continue
+        if marker in STANDALONE_MARKERS:
+            offset += 2
+            continue
+        if marker in (SOS_MARKER, EOI_MARKER):
+            raise JpegHeaderError("No start of frame before the image data")
+
+        if offset + 4 > len(data):
+            return None
+        (length,) = struct.unpack_from(">H", data, offset + 2)
+        if length < 2:
+            raise JpegHeaderError(f"Invalid segment length at offset {offset}")
+        end = offset + 2 + length
+        if end > len(data):
+            return None
+        segment = data[offset + 4 : end]
+
+        if marker in SOF_MARKERS:
+            if len(segment) < 6:
+                raise JpegHeaderError("Truncated start of frame")
+            bits, height, width, components = struct.unpack_from(">BHHB", segment)
+            metadata["File:ImageWidth"] = width
+            metadata["File:ImageHeight"] = height
+            metadata["File:BitsPerSample"] = bits
+            metadata["File:ColorComponents"] = components
+            return metadata
+        if marker == 0xE1 and segment.startswith(EXIF_HEADER):
+            try:
+                metadata.update(parse_exif(segment[len(EXIF_HEADER) :]))
+            except struct.error as e:
+                raise JpegHeaderError(f"Invalid EXIF segment: {e}")
+        elif marker == 0xE1 and segment.startswith(XMP_HEADER):
+            metadata.update(parse_xmp(segment[len(XMP_HEADER) :]))
+        offset = end
+
+
+def parse_exif(tiff: bytes) -> dict:
+    if tiff[:4] == b"II*\x00":
+        byte_order = "<"
+    elif tiff[:4] == b"MM\x00*":
+        byte_order = ">"
+    else:
+        raise JpegHeaderError("Invalid EXIF byte order")
+
+    metadata = {}
+    (ifd0_offset,) = struct.unpack_from(byte_order + "L", tiff, 4)
+    ifd0 = read_ifd(tiff, byte_order, ifd0_offset)
+    for tag_id, name in IFD0_TAGS.items():
+        if tag_id in ifd0:
+            metadata[f"EXIF:{name}"] = ifd0[tag_id]
+
+    if isinstance(ifd0.get(EXIF_IFD_POINTER), int):
+        exif_ifd = read_ifd(tiff, byte_order, ifd0[EXIF_IFD_POINTER])
+        for tag_id, name in EXIF_IFD_TAGS.items():
+            if tag_id in exif_ifd:
+                metadata[f"EXIF:{name}"] = exif_ifd[tag_id]
+
+    if isinstance(ifd0.get(GPS_IFD_POINTER), int):
+        gps_ifd = read_ifd(tiff, byte_order, ifd0[GPS_IFD_POINTER])
+        for tag_id, name in GPS_IFD_TAGS.items():
+            if tag_id not in gps_ifd:
+                continue
+            value = gps_ifd[tag_id]
+            if name in ("GPSLatitude", "GPSLongitude"):
+                value = to_degrees(value)
+            elif name == "GPSTimeStamp" and isinstance(value, list):
+                value = ":".join(f"{part:g}" for part in value)
+            if value is not None:
+                metadata[f"EXIF:{name}"] = value
+
+        for axis, negative in (("Latitude", "S"), ("Longitude", "W")):
+            value = metadata.get(f"EXIF:GPS{axis}")
+            if value is not None:
+                ref = metadata.get(f"EXIF:GPS{axis}Ref")
+                metadata[f"Composite:GPS{axis}"] = -value if ref == negative else value
+
+    # exiftool lists multiple values separated by spaces
+    return {
+        name: " ".join(str(v) for v in value) if isinstance(value, list) else value
+        for name, value in metadata.items()
+    }
+
+
+def read_ifd(tiff: bytes, byte_order: str, offset: int) -> dict:
+    if offset + 2 > len(tiff):
+        raise JpegHeaderError("IFD offset out of range")
+    (count,) = struct.unpack_from(byte_order + "H", tiff, offset)
+    if offset + 2 + count * 12 > len(tiff):
+        raise JpegHeaderError("Truncated IFD")
+
+    entries = {}
+    for i in range(count):
+        entry_offset = offset + 2 + i * 12
+        tag_id, field_type, value_count = struct.unpack_from(
+            byte_order + "HHL", tiff, entry_offset
+        )
+        if field_type not in FIELD_TYPES:
+            continue
+        value_format, size = FIELD_TYPES[field_type]
+        value_size = size * value_count
+        if value_size <= 4:
+            value_offset = entry_offset + 8
+        else:
+            (value_offset,) = struct.unpack_from(
+                byte_order + "L", tiff, entry_offset + 8
+            )
+        if value_offset + value_size > len(tiff):
+            # a broken entry doesn't invalidate the others
+            continue
+        raw = tiff[value_offset : value_offset + value_size]
+
+        if field_type == 2:
+            entries[tag_id] = (
+                raw.split(b"\x00", 1)[0].decode("utf-8", "replace").strip()
+            )
+            continue
+        values = list(
+            struct.unpack(byte_order + value_format * value_count, raw)
+            if value_count
+            else ()
+        )
+        if field_type in (5, 10):
+            values = [
+                numerator / denominator if denominator else 0.0
+                for numerator, denominator in zip(values[::2], values[1::2])
+            ]
+        if field_type == 7 and value_count > 4:
+            # binary blobs, e.g. the maker notes
+            continue
+        entries[tag_id] = values[0] if len(values) == 1 else values
+    return entries
+
+
+def to_degrees(value) -> float | None:
+    if not isinstance(value, list) or len(value) != 3:
+        return None
+    degrees, minutes, seconds = value
+    return degrees + minutes / 60 + seconds / 3600
+
+
+def parse_xmp(xmp: bytes) -> dict:
+    metadata = {}
+    for pattern in (XMP_LIST_ITEM_RE, XMP_ELEMENT_RE, XMP_ATTRIBUTE_RE):
+        for name, value in pattern.findall(xmp):
+            # exiftool capitalizes the property names, dc:title is XMP:Title
+            name = name.decode()
+            name = name[:1].upper() + name[1:]
+            if name in XMP_TAGS and f"XMP:{name}" not in metadata:
+                metadata[f"XMP:{name}"] = value.decode("utf-8", "replace").strip()
+    return metadata
@@ -1,13 +1,87 @@
+import enum
 import json
+import re
 
-from fastapi import Request
+import orjson
+from fastapi import HTTPException, status
+from starlette.datastructures import Headers
 
+from api.models import Tag
+from config import settings
 from shared.data_processors.base_data_processor import BaseDataProcessor, ProcessedData
+from utils.streams import ByteStream, iter_bytes, read_all
+
+
+class JsonIngestMode(str, enum.Enum):
+    PASSTHROUGH = "passthrough"  # the received bytes are stored
+    CANONICALIZE = "canonicalize"  # compact, with sorted keys
+
+
+JSON_SCALAR_TYPES = {
+    str: "string",
+    int: "number",
+    float: "number",
+    bool: "boolean",
+    type(None): "null",
+}
+
+
+# orjson reads integers outside of the 64 bit range as floats, a run of 19
+# digits or more is a cheap hint that the document may have one
+LONG_NUMBER_RE = re.compile(rb"\d{19,}")
+
+
+def canonicalize(data: bytes, document) -> bytes:
+    if LONG_NUMBER_RE.search(data) is None:
+        return orjson.dumps(document, option=orjson.OPT_SORT_KEYS)
+    # the stdlib keeps integers of any size
+    try:
+        document = json.loads(data)
+    except ValueError as e:
+        # integers beyond the int conversion limit
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid JSON: {e}"
+        )
+    return json.dumps(
+        document, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    ).encode()
+
+
+def get_structural_tags(document) -> list[Tag]:
+    if isinstance(document, dict):
+        keys = list(document)[: settings.json_structural_tags_max_keys]
+        return [Tag(name="json-type", value="object")] + [
+            Tag(name="json-key", value=key) for key in keys
+        ]
+    if isinstance(document, list):
+        return [
+            Tag(name="json-type", value="array"),
+            Tag(name="json-records", value=str(len(document))),
+        ]
+    return [Tag(name="json-type", value=JSON_SCALAR_TYPES[type(document)])]
 
 
 class JsonDataProcessor(BaseDataProcessor):
-    async def process_request(self, request: Request) -> ProcessedData:
-        processed_data = ProcessedData(
-            data=json.dumps(await request.json()).encode(), system_tags=[]
+    needs_all_data = True
+
+    async def process_stream(
+        self, stream: ByteStream, headers: Headers
+    ) -> ProcessedData:
+        # the whole document is needed to validate it
+        data = await read_all(stream)
+        try:
+            document = orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid JSON: {e}"
+            )
+
+        if settings.json_ingest_mode == JsonIngestMode.CANONICALIZE:
+            data = canonicalize(data, document)
+        system_tags = (
+            get_structural_tags(document) if settings.json_structural_tags else []
+        )
+        return ProcessedData(
+            stream=iter_bytes(data, settings.upload_chunk_size),
+            system_tags=system_tags,
         )
-        return processed_data
@@ -1,8 +1,73 @@
-from fastapi import Request
+import typing
 
+from fastapi import HTTPException, status
+from starlette.datastructures import Headers
+
+from api.models import Tag
+from config import settings
 from shared.data_processors.base_data_processor import BaseDataProcessor, ProcessedData
+from shared.data_processors.multipart_parser import (
+    FormPart,
+    MultipartError,
+    MultipartParser,
+    get_boundary,
+)
+from utils.streams import ByteStream
+
+
+def bad_request(e: MultipartError) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+async def check_body(stream: ByteStream) -> ByteStream:
+    # the part body is parsed while it is stored
+    try:
+        async for chunk in stream:
+            yield chunk
+    except MultipartError as e:
+        raise bad_request(e)
+
+
+async def read_field(stream: ByteStream) -> str:
+    value = b""
+    async for chunk in stream:
+        value += chunk
+        if len(value) > settings.multipart_field_max_size:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Form field value too large",
+            )
+    return value.decode("utf-8", "replace")
 
 
 class MultipartDataProcessor(BaseDataProcessor):
-    async def process_request(self, request: Request) -> ProcessedData:
-        return ProcessedData(data=await request.body(), system_tags=[])
+    async def process_stream(
+        self, stream: ByteStream, headers: Headers
+    ) -> ProcessedData:
+        # the whole body as one blob, see iter_parts for one blob per file
+        return ProcessedData(stream=stream, system_tags=[])
+
+    async def iter_parts(
+        self, stream: ByteStream, headers: Headers
+    ) -> typing.AsyncIterator[Tag | FormPart]:
+        # the form fields as tags and the file parts as they are received
+        try:
+            parser = MultipartParser(
+                stream,
+                get_boundary(headers.get("content-type")),
+                settings.multipart_max_header_size,
+            )
+            files = 0
+            async for part in parser.iter_parts():
+                if part.filename is None:
+                    yield Tag(name=part.name, value=await read_field(part.stream))
+                    continue
+                files += 1
+                if files > settings.multipart_max_parts:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"At most {settings.multipart_max_parts} files per form",
+                    )
+                yield part._replace(stream=check_body(part.stream))
+        except MultipartError as e:
+            raise bad_request(e)
@@ -0,0 +1,131 @@
+import re
+import typing
+
+from starlette.datastructures import Headers
+
+from utils.streams import ByteStream
+
+# Parses a multipart/form-data body as it is received. The buffer holds at
+# most one chunk of the body plus the length of the boundary.
+
+
+class MultipartError(ValueError):
+    pass
+
+
+BOUNDARY_RE = re.compile(r';\s*boundary=(?:"([^"]+)"|([^;\s]+))', re.IGNORECASE)
+PARAM_RE = re.compile(r';\s*([\w*-]+)\s*=\s*(?:"((?:[^"\\]|\\.)*)"|([^;]*))')
+
+
+class FormPart(typing.NamedTuple):
+    name: str
+    filename: str | None
+    headers: Headers
+    # has to be consumed before the next part is read, what is left of it is
+    # skipped otherwise
+    stream: ByteStream
+
+
+def get_boundary(content_type: str | None) -> bytes:
+    match = BOUNDARY_RE.search(content_type or "")
+    if match is None:
+        raise MultipartError("Missing multipart boundary")
+    return (match.group(1) or match.group(2)).encode("latin-1")
+
+
+def parse_content_disposition(value: str) -> dict[str, str]:
+    return {
+        name.lower(): quoted.replace('\\"', '"') if quoted is not None else plain
+        for name, quoted, plain in PARAM_RE.findall(value)
+    }
+
+
+class MultipartParser:
+    def __init__(self, stream: ByteStream, boundary: bytes, max_header_size: int):
+        self.chunks = stream.__aiter__()
+        self.buffer = b""
+        self.delimiter = b"--" + boundary
+        # the delimiter of a part body includes the line break before it
+        self.body_delimiter = b"\r\n" + self.delimiter
+        self.max_header_size = max_header_size
+        self.body_done = True
+
+    async def read_more(self) -> bool:
+        try:
+            self.buffer += await self.chunks.__anext__()
+        except StopAsyncIteration:
+            return False
+        return True
+
+    async def iter_parts(self) -> typing.AsyncIterator[FormPart]:
+        # the preamble before the first delimiter is ignored
+        while (index := self.buffer.find(self.delimiter)) < 0:
+            self.buffer = self.buffer[-len(self.delimiter) :]
+            if not await self.read_more():
+                raise MultipartError("Multipart boundary not found")
+        self.buffer = self.buffer[index + len(self.delimiter) :]
+
+        while True:
+            while len(self.buffer) < 2:
+                if not await self.read_more():
+                    raise MultipartError("Truncated multipart body")
+            if self.buffer.startswith(b"--"):
+                # the close delimiter, the epilogue is ignored
+                return
+            headers = await self.read_headers()
+            disposition = parse_content_disposition(
+                headers.get("content-disposition", "")
+            )
+            if "name" not in disposition:
+                raise MultipartError("Part without a form field name")
+            self.body_done = False
+            yield FormPart(
+                disposition["name"],
+                disposition.get("filename"),
+                headers,
+                self.iter_body(),
+            )
+            while await self.read_body_chunk() is not None:
+                pass
+
+    async def read_headers(self) -> Headers:
+        # the line break after the delimiter is part of the header block
+        while (end := self.buffer.find(b"\r\n\r\n")) < 0:
+            if len(self.buffer) > self.max_header_size:
+                raise MultipartError("Multipart part headers too large")
+            if not await self.read_more():
+                raise MultipartError("Truncated multipart body")
+        block, self.buffer = self.buffer[:end], self.buffer[end + 4 :]
+        raw = []
+        for line in block.split(b"\r\n"):
+            if not line.strip():
+                continue
+            name, sep, value = line.partition(b":")
+            if not sep:
+                raise MultipartError("Invalid multipart part header")
+            raw.append((name.strip().lower(), value.strip()))
+        return Headers(raw=raw)
+
+    async def read_body_chunk(self) -> bytes | None:
+        # the next bytes of the current part body, None at its end
+        if self.body_done:
+            return None
+        keep = len(self.body_delimiter) - 1
+        while True:
+            index = self.buffer.find(self.body_delimiter)
+            if index >= 0:
+                chunk = self.buffer[:index]
+                self.buffer = self.buffer[index + len(self.body_delimiter) :]
+                self.body_done = True
+                return chunk
+            if len(self.buffer) > keep:
+                # the end of the buffer could be the start of the delimiter
+                chunk, self.buffer = self.buffer[:-keep], self.buffer[-keep:]
+                return chunk
+            if not await self.read_more():
+                raise MultipartError("Truncated multipart body")
+
+    async def iter_body(self) -> ByteStream:
+        while (chunk := await self.read_body_chunk()) is not None:
+            if chunk:
+                yield chunk
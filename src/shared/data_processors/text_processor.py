@@ -1,8 +1,11 @@
-from fastapi import Request
+from starlette.datastructures import Headers
 
 from shared.data_processors.base_data_processor import BaseDataProcessor, ProcessedData
+from utils.streams import ByteStream
 
 
 class TextProcessor(BaseDataProcessor):
-    async def process_request(self, request: Request) -> ProcessedData:
-        return ProcessedData(data=await request.body(), system_tags=[])
+    async def process_stream(
+        self, stream: ByteStream, headers: Headers
+    ) -> ProcessedData:
+        return ProcessedData(stream=stream, system_tags=[])
@@ -0,0 +1,44 @@
+import httpx
+
+from config import settings
+from utils.logger import setup_logger
+
+LOGGER = setup_logger()
+
+
+class DeployServiceClient:
+    client: httpx.AsyncClient | None = None
+
+    @classmethod
+    def initialize(cls):
+        if cls.client is not None:
+            return
+        cls.client = httpx.AsyncClient(
+            base_url=settings.deploy_service_base_url,
+            http2=settings.deploy_service_http2,
+            limits=httpx.Limits(
+                max_connections=settings.deploy_service_max_connections,
+                max_keepalive_connections=settings.deploy_service_max_keepalive_connections,
+                keepalive_expiry=settings.deploy_service_keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                settings.deploy_service_timeout,
+                connect=settings.deploy_service_connect_timeout,
+            ),
+        )
+        LOGGER.debug(
+            f"Deploy service client created for {settings.deploy_service_base_url}"
+        )
+
+    @classmethod
+    async def close(cls):
+        if cls.client is not None:
+            await cls.client.aclose()
+            cls.client = None
+
+    @classmethod
+    def get_client(cls) -> httpx.AsyncClient:
+        # used outside of the app lifespan (scripts, tests)
+        if cls.client is None:
+            cls.initialize()
+        return cls.client
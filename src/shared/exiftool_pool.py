@@ -0,0 +1,221 @@
+import asyncio
+import os
+import threading
+
+import exiftool
+from fastapi import HTTPException, status
+
+from config import settings
+from utils.executors import run_blocking
+from utils.logger import setup_logger
+
+LOGGER = setup_logger()
+
+
+def get_tmp_dir() -> str | None:
+    # exiftool reads the image from a path, a tmpfs keeps it off the disk
+    if settings.exiftool_tmp_dir:
+        return settings.exiftool_tmp_dir
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+
+class _ExifToolWorker:
+    # One exiftool process in -stay_open mode, used by one call at a time.
+    # Runs on the EXIFTOOL executor threads.
+
+    def __init__(self, index: int):
+        self.index = index
+        self.helper: exiftool.ExifToolHelper | None = None
+        self.started = 0
+        self._lock = threading.Lock()
+
+    def ensure_running(self) -> exiftool.ExifToolHelper:
+        with self._lock:
+            if self.helper is not None and self.helper.running:
+                return self.helper
+            if self.helper is not None:
+                LOGGER.warning(f"exiftool worker {self.index} died, restarting it")
+            helper = exiftool.ExifToolHelper(auto_start=False)
+            helper.run()
+            self.helper = helper
+            self.started += 1
+            return helper
+
+    def get_metadata(self, path: str, tags: list[str] | None = None) -> dict:
+        helper = self.ensure_running()
+        if tags:
+            return helper.get_tags(path, tags)[0]
+        return helper.get_metadata(path)[0]
+
+    def check(self):
+        self.ensure_running().execute("-ver")
+
+    def kill(self):
+        # the helper blocks forever reading from a process that died in the
+        # middle of a command, closing the pipes makes that read fail
+        with self._lock:
+            helper, self.helper = self.helper, None
+        process = getattr(helper, "_process", None)
+        if process is None:
+            return
+        try:
+            process.kill()
+        except OSError:
+            pass
+        for pipe in (process.stdin, process.stdout, process.stderr):
+            try:
+                pipe.close()
+            except (OSError, ValueError):
+                pass
+
+    def terminate(self):
+        with self._lock:
+            helper, self.helper = self.helper, None
+        if helper is not None:
+            helper.terminate(timeout=5)
+
+
+class ExifToolPool:
+    # Long lived exiftool processes shared by the JPEG uploads. Uploads wait
+    # for an idle process on the event loop, beyond max_queue waiting uploads
+    # they are rejected. A process that fails or times out is killed and
+    # restarted on its next use, idle processes are checked periodically.
+
+    def __init__(self, size: int, max_queue: int):
+        self.size = size
+        self.max_queue = max_queue
+        self.workers = [_ExifToolWorker(i) for i in range(size)]
+        self._idle: asyncio.Queue[_ExifToolWorker] | None = None
+        self._health_checker: asyncio.Task | None = None
+
+        self.waiting = 0
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    async def start(self):
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        for worker in self.workers:
+            self._idle.put_nowait(worker)
+        # warm up, a process that can't start now is retried on its first use
+        results = await asyncio.gather(
+            *(
+                run_blocking("EXIFTOOL", worker.ensure_running)
+                for worker in self.workers
+            ),
+            return_exceptions=True,
+        )
+        for worker, result in zip(self.workers, results):
+            if isinstance(result, Exception):
+                LOGGER.error(
+                    f"exiftool worker {worker.index} failed to start: {result!r}"
+                )
+        self._health_checker = asyncio.create_task(self.check_periodically())
+
+    async def shutdown(self):
+        if self._health_checker is not None:
+            self._health_checker.cancel()
+            await asyncio.gather(self._health_checker, return_exceptions=True)
+            self._health_checker = None
+        await asyncio.gather(
+            *(run_blocking("EXIFTOOL", worker.terminate) for worker in self.workers),
+            return_exceptions=True,
+        )
+        self._idle = None
+
+    async def get_metadata(self, path: str, tags: list[str] | None = None) -> dict:
+        if self._idle is None:
+            await self.start()
+        if self._idle.empty() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many images are being processed, retry later",
+            )
+
+        self.waiting += 1
+        try:
+            worker = await self._idle.get()
+        finally:
+            self.waiting -= 1
+        try:
+            self.calls += 1
+            return await run_blocking(
+                "EXIFTOOL",
+                worker.get_metadata,
+                path,
+                tags,
+                call_timeout=settings.exiftool_call_timeout,
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            worker.kill()
+            raise
+        except (
+            exiftool.exceptions.ExifToolProcessStateError,
+            exiftool.exceptions.ExifToolJSONInvalidError,
+            exiftool.exceptions.ExifToolVersionError,
+            OSError,
+            ValueError,
+        ):
+            # the process is gone or out of sync with the pipes
+            self.failures += 1
+            worker.kill()
+            raise
+        finally:
+            self._idle.put_nowait(worker)
+
+    async def check_periodically(self):
+        while True:
+            await asyncio.sleep(settings.exiftool_health_check_interval)
+            await self.check_idle_workers()
+
+    async def check_idle_workers(self):
+        # busy workers are left alone, a failing call restarts them anyway
+        workers = []
+        while not self._idle.empty():
+            workers.append(self._idle.get_nowait())
+        try:
+            results = await asyncio.gather(
+                *(
+                    run_blocking(
+                        "EXIFTOOL",
+                        worker.check,
+                        call_timeout=settings.exiftool_call_timeout,
+                    )
+                    for worker in workers
+                ),
+                return_exceptions=True,
+            )
+            for worker, result in zip(workers, results):
+                if isinstance(result, Exception):
+                    self.failures += 1
+                    LOGGER.error(
+                        f"exiftool worker {worker.index} failed its health check: "
+                        f"{result!r}"
+                    )
+                    worker.kill()
+        finally:
+            for worker in workers:
+                self._idle.put_nowait(worker)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "waiting": self.waiting,
+            "max_queue": self.max_queue,
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "restarts": sum(max(worker.started - 1, 0) for worker in self.workers),
+        }
+
+
+EXIFTOOL_POOL = ExifToolPool(settings.exiftool_pool_size, settings.exiftool_max_queue)
@@ -1,7 +1,12 @@
+import asyncio
+import random
+import uuid
+
 from google.cloud import bigquery
 from google.oauth2 import service_account
 
 from config import settings
+from utils.executors import run_blocking
 from utils.logger import setup_logger
 
 LOGGER = setup_logger()
@@ -14,6 +19,18 @@ class TimeTrackingBigQuery:
     dataset_name: str | None = None
     table_name: str | None = None
 
+    # rows are buffered and inserted in batches by a background task,
+    # each row is an (insert id, row) pair so a retried batch is deduplicated
+    queue: asyncio.Queue | None = None
+    flusher: asyncio.Task | None = None
+    batch: list[tuple[str, dict]] = []
+
+    queued = 0
+    dropped = 0
+    sampled_out = 0
+    inserted = 0
+    failed = 0
+
     @classmethod
     def initialize(cls):
         if (
@@ -35,6 +52,26 @@ class TimeTrackingBigQuery:
             cls.client = client
             cls.project = cls.client.project
 
+    @classmethod
+    async def start(cls):
+        if cls.client and cls.flusher is None:
+            cls.queue = asyncio.Queue(maxsize=settings.time_tracking_queue_size)
+            cls.flusher = asyncio.create_task(cls.flush_periodically())
+
+    @classmethod
+    async def shutdown(cls):
+        if cls.flusher is None:
+            return
+        cls.flusher.cancel()
+        await asyncio.gather(cls.flusher, return_exceptions=True)
+        cls.flusher = None
+
+        rows, cls.batch = cls.batch, []
+        while not cls.queue.empty():
+            rows.append(cls.queue.get_nowait())
+        for i in range(0, len(rows), settings.time_tracking_batch_size):
+            await cls.insert_rows(rows[i : i + settings.time_tracking_batch_size])
+
     @classmethod
     async def track_time(
         cls,
@@ -47,24 +84,83 @@ class TimeTrackingBigQuery:
         content_size: int | None = None,
         content_type: str | None = None,
     ):
-        if cls.client:
-            errors = cls.client.insert_rows_json(
+        if cls.queue is None:
+            return
+        if random.random() >= settings.time_tracking_sample_rate:
+            cls.sampled_out += 1
+            return
+
+        row = {
+            "created_at": created_at,
+            "request_type": request_type,
+            "deploy_type": deploy_type,
+            "request_time": request_time,
+            # search fields
+            "number_of_tags": number_of_tags,
+            "number_of_blobs": number_of_blobs,
+            # blob_create fields
+            "size": content_size,
+            "content_type": content_type,
+        }
+        if settings.time_tracking_block_when_full:
+            await cls.queue.put((uuid.uuid4().hex, row))
+        else:
+            try:
+                cls.queue.put_nowait((uuid.uuid4().hex, row))
+            except asyncio.QueueFull:
+                cls.dropped += 1
+                return
+        cls.queued += 1
+
+    @classmethod
+    async def flush_periodically(cls):
+        loop = asyncio.get_running_loop()
+        while True:
+            cls.batch.append(await cls.queue.get())
+            deadline = loop.time() + settings.time_tracking_flush_interval
+            while len(cls.batch) < settings.time_tracking_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    cls.batch.append(await asyncio.wait_for(cls.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # on cancellation the batch stays in cls.batch for shutdown()
+            await cls.insert_rows(cls.batch)
+            cls.batch = []
+
+    @classmethod
+    async def insert_rows(cls, rows: list[tuple[str, dict]]):
+        if not rows:
+            return
+        try:
+            errors = await run_blocking(
+                "TELEMETRY",
+                cls.client.insert_rows_json,
                 f"{cls.project}.{cls.dataset_name}.{cls.table_name}",
-                [
-                    {
-                        "created_at": created_at,
-                        "request_type": request_type,
-                        "deploy_type": deploy_type,
-                        "request_time": request_time,
-                        # search fields
-                        "number_of_tags": number_of_tags,
-                        "number_of_blobs": number_of_blobs,
-                        # blob_create fields
-                        "size": content_size,
-                        "content_type": content_type,
-                    }
-                ],
+                [row for _, row in rows],
+                row_ids=[row_id for row_id, _ in rows],
             )
-            if errors:
-                for error in errors:
-                    LOGGER.error(error)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            cls.failed += len(rows)
+            LOGGER.error(f"Time tracking insert failed: {e!r}")
+            return
+        cls.failed += len(errors)
+        cls.inserted += len(rows) - len(errors)
+        for error in errors:
+            LOGGER.error(error)
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            "enabled": cls.flusher is not None,
+            "queue_size": cls.queue.qsize() if cls.queue else 0,
+            "queued": cls.queued,
+            "dropped": cls.dropped,
+            "sampled_out": cls.sampled_out,
+            "inserted": cls.inserted,
+            "failed": cls.failed,
+        }
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import time
+import typing
+from collections import OrderedDict
+
+from api.models import SearchPage, Tag, TimeRange
+from api.responses import dumps
+from config import settings
+from database.search_generations import bump_generation, get_generation
+from utils.cache import AsyncTTLCache
+
+
+class SearchCacheBackend:
+    # Storage for cached search pages. The project generation, kept in the
+    # database so a write on any worker is seen by all of them, is part of
+    # every key, so bumping it on a write makes all cached pages of the
+    # project unreachable.
+
+    async def get(self, key: str) -> SearchPage | None:
+        raise NotImplementedError()
+
+    async def set(self, key: str, page: SearchPage, size: int, ttl: float):
+        raise NotImplementedError()
+
+    def stats(self) -> dict:
+        return {}
+
+
+class _MemoryEntry:
+    __slots__ = ("page", "size", "expires_at")
+
+    def __init__(self, page: SearchPage, size: int, expires_at: float):
+        self.page = page
+        self.size = size
+        self.expires_at = expires_at
+
+
+class InMemorySearchCacheBackend(SearchCacheBackend):
+    # LRU bounded by the total serialized size of the cached pages
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, _MemoryEntry] = OrderedDict()
+        self.size = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> SearchPage | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.page
+
+    async def set(self, key: str, page: SearchPage, size: int, ttl: float):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _MemoryEntry(page, size, time.monotonic() + ttl)
+        self.size += size
+        while self.size > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key: str):
+        self.size -= self._entries.pop(key).size
+
+
+class SearchCache:
+    def __init__(
+        self,
+        backend: SearchCacheBackend | None,
+        ttl: float,
+        generation_ttl: float = settings.search_cache_local_generation_ttl,
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        # the generations last read from the database, a write on another
+        # worker is seen once they expire
+        self.generations: AsyncTTLCache[str, str] = AsyncTTLCache(
+            max_size=settings.search_cache_local_generation_max_size,
+            ttl=generation_ttl,
+        )
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def search_key(
+        tags: list[Tag],
+        limit: int,
+        cursor: str | None,
+        time_range: TimeRange | None,
+    ) -> str:
+        # the same tags in any order are the same search
+        params = {
+            "tags": sorted([tag.name, tag.value or ""] for tag in tags),
+            "limit": limit,
+            "cursor": cursor,
+            "time_range": time_range.json() if time_range else None,
+        }
+        return hashlib.sha256(
+            json.dumps(params, separators=(",", ":")).encode()
+        ).hexdigest()
+
+    async def get_or_search(
+        self,
+        project_id: str | None,
+        search_key: str,
+        search: typing.Callable[[], typing.Awaitable[SearchPage]],
+    ) -> SearchPage:
+        if self.backend is None or project_id is None:
+            return await search()
+
+        # read the generation before searching, so a page that raced with a
+        # write is stored under the old generation and never served
+        generation = await self.generations.get_or_load(
+            project_id, lambda: get_generation(project_id)
+        )
+        key = f"{project_id}:{generation}:{search_key}"
+        page = await self.backend.get(key)
+        if page is not None:
+            self.hits += 1
+            return page
+
+        self.misses += 1
+        page = await search()
+        size = len(dumps(page))
+        if size <= settings.search_cache_max_entry_bytes:
+            await self.backend.set(key, page, size, self.ttl)
+        return page
+
+    async def invalidate_project(self, project_id: str | None):
+        if self.backend is None or project_id is None:
+            return
+        generation = await bump_generation(project_id)
+        # a read started before the bump must not bring back the old one
+        self.generations.invalidate(project_id)
+        self.generations.set(project_id, generation)
+
+    def stats(self) -> dict:
+        return {
+            "backend": settings.search_cache_backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "generations": self.generations.stats(),
+            **(self.backend.stats() if self.backend is not None else {}),
+        }
+
+
+SEARCH_CACHE_BACKENDS: dict[str, typing.Callable[[], SearchCacheBackend]] = {
+    "memory": lambda: InMemorySearchCacheBackend(settings.search_cache_max_bytes),
+}
+
+SEARCH_CACHE = SearchCache(
+    backend=(
+        SEARCH_CACHE_BACKENDS[settings.search_cache_backend]()
+        if settings.search_cache_backend in SEARCH_CACHE_BACKENDS
+        else None
+    ),
+    ttl=settings.search_cache_ttl,
+)
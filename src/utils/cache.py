@@ -0,0 +1,133 @@
+import asyncio
+import time
+import typing
+from collections import OrderedDict
+
+from utils.logger import setup_logger
+
+LOGGER = setup_logger()
+
+K = typing.TypeVar("K")
+V = typing.TypeVar("V")
+
+
+class _CacheEntry(typing.Generic[V]):
+    __slots__ = ("value", "created_at")
+
+    def __init__(self, value: V, created_at: float):
+        self.value = value
+        self.created_at = created_at
+
+
+class AsyncTTLCache(typing.Generic[K, V]):
+    # LRU + TTL cache for values produced by async loaders. Concurrent misses
+    # for one key share a single loader call; entries older than ``ttl`` but
+    # younger than ``ttl + stale_ttl`` are served while being refreshed.
+
+    def __init__(self, max_size: int, ttl: float, stale_ttl: float = 0.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: OrderedDict[K, _CacheEntry[V]] = OrderedDict()
+        self._inflight: dict[K, asyncio.Task] = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self.load_errors = 0
+
+    async def get_or_load(
+        self, key: K, loader: typing.Callable[[], typing.Awaitable[V]]
+    ) -> V:
+        if self.max_size <= 0 or self.ttl <= 0:
+            self.misses += 1
+            return await loader()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.created_at
+            if age < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry.value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                if key not in self._inflight:
+                    self.refreshes += 1
+                    self._start_load(key, loader)
+                return entry.value
+            del self._entries[key]
+
+        self.misses += 1
+        task = self._inflight.get(key) or self._start_load(key, loader)
+        # one cancelled caller must not cancel the load the others wait for
+        return await asyncio.shield(task)
+
+    def set(self, key: K, value: V):
+        self._entries[key] = _CacheEntry(value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: K):
+        self._entries.pop(key, None)
+        # a load started before the invalidation must not repopulate the entry
+        self._inflight.pop(key, None)
+
+    def invalidate_where(self, predicate: typing.Callable[[K], bool]):
+        for key in [k for k in self._entries if predicate(k)]:
+            del self._entries[key]
+        for key in [k for k in self._inflight if predicate(k)]:
+            del self._inflight[key]
+
+    def clear(self):
+        self._entries.clear()
+        self._inflight.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "evictions": self.evictions,
+            "load_errors": self.load_errors,
+            "inflight": len(self._inflight),
+        }
+
+    def _start_load(
+        self, key: K, loader: typing.Callable[[], typing.Awaitable[V]]
+    ) -> asyncio.Task:
+        task = asyncio.ensure_future(self._load(key, loader))
+        task.add_done_callback(self._consume_task_result)
+        self._inflight[key] = task
+        return task
+
+    async def _load(
+        self, key: K, loader: typing.Callable[[], typing.Awaitable[V]]
+    ) -> V:
+        task = asyncio.current_task()
+        try:
+            value = await loader()
+        except Exception:
+            self.load_errors += 1
+            raise
+        finally:
+            is_current = self._inflight.get(key) is task
+            if is_current:
+                del self._inflight[key]
+        if is_current:
+            self.set(key, value)
+        return value
+
+    @staticmethod
+    def _consume_task_result(task: asyncio.Task):
+        # background refreshes have no awaiter, log their failures here
+        if not task.cancelled() and task.exception() is not None:
+            LOGGER.warning(f"Cache load failed: {task.exception()!r}")
@@ -0,0 +1,39 @@
+import base64
+import hashlib
+import hmac
+import json
+
+from config import settings
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def _sign(payload: bytes) -> str:
+    # cursors carry backend state (e.g. a BigQuery result table), they are
+    # signed so clients can't point them at anything else
+    digest = hmac.new(settings.jwt_secret.encode(), payload, hashlib.sha256)
+    return base64.urlsafe_b64encode(digest.digest()[:16]).decode().rstrip("=")
+
+
+def encode_cursor(state: dict) -> str:
+    payload = base64.urlsafe_b64encode(
+        json.dumps(state, separators=(",", ":")).encode()
+    )
+    return f"{payload.decode().rstrip('=')}.{_sign(payload.rstrip(b'='))}"
+
+
+def decode_cursor(cursor: str) -> dict:
+    payload, _, signature = cursor.partition(".")
+    if not hmac.compare_digest(_sign(payload.encode()), signature):
+        raise InvalidCursorError("Invalid cursor")
+    try:
+        state = json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        )
+    except ValueError:
+        raise InvalidCursorError("Invalid cursor")
+    if not isinstance(state, dict):
+        raise InvalidCursorError("Invalid cursor")
+    return state
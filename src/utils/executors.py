@@ -0,0 +1,174 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import settings
+from utils.logger import setup_logger
+
+LOGGER = setup_logger()
+
+T = typing.TypeVar("T")
+
+
+class BlockingExecutor:
+    # Runs blocking SDK calls on a bounded thread pool. Callers beyond
+    # max_workers + max_queue wait on the event loop instead of piling up in
+    # the executor queue; a slot is released only when the thread is done,
+    # so timed out calls still count against the pool until they return.
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"{name.lower()}-blocking"
+        )
+        self._slots: asyncio.Semaphore | None = None
+        self._lock = threading.Lock()
+
+        self.waiting = 0
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.saturated = 0
+
+    async def run(
+        self,
+        func: typing.Callable[..., T],
+        *args,
+        call_timeout: float | None = settings.blocking_call_timeout,
+        **kwargs,
+    ) -> T:
+        loop = asyncio.get_running_loop()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers + self.max_queue)
+
+        if self._slots.locked():
+            self.saturated += 1
+            LOGGER.warning(f"{self.name} executor is saturated: {self.stats()}")
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        call = functools.partial(
+            contextvars.copy_context().run, self._call, func, *args, **kwargs
+        )
+        with self._lock:
+            self.queued += 1
+        try:
+            concurrent_future = self._executor.submit(call)
+        except BaseException:
+            with self._lock:
+                self.queued -= 1
+            self._slots.release()
+            raise
+        concurrent_future.add_done_callback(
+            functools.partial(self._on_done, loop, self._slots)
+        )
+
+        try:
+            # cancelling the awaiting task cancels the call if it has not
+            # started yet, a running call is left to finish in its thread
+            return await asyncio.wait_for(
+                asyncio.wrap_future(concurrent_future, loop=loop),
+                timeout=call_timeout,
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            LOGGER.error(f"{self.name} blocking call {func!r} timed out")
+            raise
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self.running,
+                "queued": self.queued,
+                "waiting": self.waiting,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "saturated": self.saturated,
+            }
+
+    def _call(self, func: typing.Callable[..., T], *args, **kwargs) -> T:
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    def _on_done(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        slots: asyncio.Semaphore,
+        concurrent_future: Future,
+    ):
+        if concurrent_future.cancelled():
+            with self._lock:
+                self.queued -= 1
+        try:
+            loop.call_soon_threadsafe(slots.release)
+        except RuntimeError:
+            # the loop is already closed on shutdown
+            pass
+
+
+BLOCKING_EXECUTORS = {
+    "AWS": BlockingExecutor(
+        "AWS", settings.aws_executor_max_workers, settings.executor_max_queue
+    ),
+    "GCP": BlockingExecutor(
+        "GCP", settings.gcp_executor_max_workers, settings.executor_max_queue
+    ),
+    "AZURE": BlockingExecutor(
+        "AZURE", settings.azure_executor_max_workers, settings.executor_max_queue
+    ),
+    # one thread per exiftool process
+    "EXIFTOOL": BlockingExecutor(
+        "EXIFTOOL", settings.exiftool_pool_size, settings.exiftool_max_queue
+    ),
+    # reads and writes of temporary files
+    "FILES": BlockingExecutor(
+        "FILES", settings.file_executor_max_workers, settings.executor_max_queue
+    ),
+    "TELEMETRY": BlockingExecutor(
+        "TELEMETRY",
+        settings.telemetry_executor_max_workers,
+        settings.executor_max_queue,
+    ),
+}
+
+
+async def run_blocking(
+    executor_name: str,
+    func: typing.Callable[..., T],
+    *args,
+    call_timeout: float | None = settings.blocking_call_timeout,
+    **kwargs,
+) -> T:
+    return await BLOCKING_EXECUTORS[executor_name].run(
+        func, *args, call_timeout=call_timeout, **kwargs
+    )
+
+
+def shutdown_executors():
+    for executor in BLOCKING_EXECUTORS.values():
+        executor.shutdown()
+
+
+def executors_stats() -> dict:
+    return {name: executor.stats() for name, executor in BLOCKING_EXECUTORS.items()}
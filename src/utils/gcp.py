@@ -1,11 +1,49 @@
-import json
-import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2 import service_account
 
 from api.models import GCPCredentials
+from config import settings
+from utils.http import mount_pool_adapter
+
+GCP_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+# private_key_id -> (private key fingerprint, parsed credentials)
+_credentials_cache: OrderedDict[
+    str, tuple[str, service_account.Credentials]
+] = OrderedDict()
+_credentials_cache_lock = threading.Lock()
+
+
+def get_credentials(credentials: GCPCredentials) -> service_account.Credentials:
+    # parsed credentials keep their access token, sharing them between
+    # clients means the token is refreshed once per key, not once per client
+    fingerprint = hashlib.sha256(
+        f"{credentials.client_email}:{credentials.private_key}".encode()
+    ).hexdigest()
+    with _credentials_cache_lock:
+        cached = _credentials_cache.get(credentials.private_key_id)
+        if cached is not None and cached[0] == fingerprint:
+            _credentials_cache.move_to_end(credentials.private_key_id)
+            return cached[1]
+
+    gcp_credentials = service_account.Credentials.from_service_account_info(
+        credentials.dict(), scopes=GCP_SCOPES
+    )
+    with _credentials_cache_lock:
+        _credentials_cache[credentials.private_key_id] = (fingerprint, gcp_credentials)
+        _credentials_cache.move_to_end(credentials.private_key_id)
+        while len(_credentials_cache) > settings.gcp_credentials_cache_max_size:
+            _credentials_cache.popitem(last=False)
+    return gcp_credentials
 
 
-def get_credentials_tmp_path(credentials: GCPCredentials) -> str:
-    gcp_credentials_path = f"/tmp/{str(uuid.uuid4()).replace('-', '')}_gcp_credentials"
-    with open(gcp_credentials_path, "w") as f:
-        json.dump(credentials.dict(), f)
-    return gcp_credentials_path
+def get_authorized_session(
+    credentials: service_account.Credentials,
+) -> AuthorizedSession:
+    session = AuthorizedSession(credentials)
+    mount_pool_adapter(session, settings.cloud_client_max_pool_connections)
+    return session
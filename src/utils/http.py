@@ -0,0 +1,11 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def mount_pool_adapter(
+    session: requests.Session, max_connections: int
+) -> requests.Session:
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
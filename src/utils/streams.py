@@ -0,0 +1,64 @@
+import typing
+
+from utils.executors import run_blocking
+
+ByteStream = typing.AsyncIterator[bytes]
+
+
+async def iter_bytes(data: bytes, chunk_size: int) -> ByteStream:
+    for offset in range(0, len(data), chunk_size):
+        yield data[offset : offset + chunk_size]
+
+
+async def iter_file(file: typing.BinaryIO, chunk_size: int) -> ByteStream:
+    # the file is closed once the stream is consumed or discarded
+    try:
+        file.seek(0)
+        while chunk := await run_blocking("FILES", file.read, chunk_size):
+            yield chunk
+    finally:
+        file.close()
+
+
+async def prepend(chunks: list[bytes], stream: ByteStream) -> ByteStream:
+    # puts back chunks already read from the stream
+    for chunk in chunks:
+        yield chunk
+    async for chunk in stream:
+        yield chunk
+
+
+async def rechunk(stream: ByteStream, chunk_size: int) -> ByteStream:
+    # yields chunks of exactly chunk_size bytes, except the last one
+    buffer = bytearray()
+    async for chunk in stream:
+        buffer += chunk
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+async def read_all(stream: ByteStream) -> bytes:
+    return b"".join([chunk async for chunk in stream])
+
+
+class LineTooLongError(ValueError):
+    pass
+
+
+async def iter_lines(stream: ByteStream, max_line_size: int) -> ByteStream:
+    # splits the stream on newlines
+    buffer = bytearray()
+    async for chunk in stream:
+        buffer += chunk
+        while (end := buffer.find(b"\n")) != -1:
+            if end > max_line_size:
+                raise LineTooLongError(f"Line longer than {max_line_size} bytes")
+            yield bytes(buffer[:end])
+            del buffer[: end + 1]
+        if len(buffer) > max_line_size:
+            raise LineTooLongError(f"Line longer than {max_line_size} bytes")
+    if buffer:
+        yield bytes(buffer)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the application modules are imported from src, as in the container
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("DATABASE_URL", "mongodb://localhost:27017")
@@ -0,0 +1,120 @@
+import asyncio
+import contextlib
+from types import SimpleNamespace
+
+from api.models import Tag
+from shared.blob_data_handlers.aws_data_handlers.aws_2 import (
+    AWSBlobHandler2,
+    AWSDeployedResources2,
+    build_tag_items,
+    tag_key,
+)
+
+
+class FakeTagTable:
+    def __init__(self, items: list[dict]):
+        self.items = sorted(items, key=lambda item: (item["tag"], item["blob_id"]))
+        self.read_items = 0
+
+    def query(self, KeyConditionExpression, Limit, Select=None, ExclusiveStartKey=None):
+        key = KeyConditionExpression.get_expression()["values"][1]
+        items = [item for item in self.items if item["tag"] == key]
+        if ExclusiveStartKey is not None:
+            items = [i for i in items if i["blob_id"] > ExclusiveStartKey["blob_id"]]
+        page = items[:Limit]
+        self.read_items += len(page)
+        res = {"Items": page, "Count": len(page)}
+        if len(items) > Limit:
+            res["LastEvaluatedKey"] = {"tag": key, "blob_id": page[-1]["blob_id"]}
+        return res
+
+
+class FakeDynamoDB:
+    def __init__(self, blobs: list[dict], tag_table: FakeTagTable):
+        self.blobs = {blob["id"]: blob for blob in blobs}
+        self.tag_table = tag_table
+        self.batch_gets = 0
+
+    def Table(self, name):
+        return self.tag_table
+
+    def batch_get_item(self, RequestItems):
+        self.batch_gets += 1
+        [(table_name, request)] = RequestItems.items()
+        keys = request["Keys"]
+        # the last key is left unprocessed once, as under throttling
+        unprocessed = keys[-1:] if self.batch_gets == 1 else []
+        responses = [self.blobs[key["id"]] for key in keys if key not in unprocessed]
+        res = {"Responses": {table_name: list(reversed(responses))}}
+        if unprocessed:
+            res["UnprocessedKeys"] = {table_name: {"Keys": unprocessed}}
+        return res
+
+
+def make_blob(i: int, tags: list[tuple[str, str]]) -> dict:
+    return {
+        "id": f"blob-{i:03}",
+        "name": f"b{i}",
+        "user_tags": [{"name": n, "value": v} for n, v in tags],
+        "system_tags": [],
+    }
+
+
+def run_query(blobs, tags, limit, state=None):
+    tag_table = FakeTagTable(
+        [item for blob in blobs for item in build_tag_items(blob, ["id"])]
+    )
+    dynamodb = FakeDynamoDB(blobs, tag_table)
+    handler = AWSBlobHandler2()
+
+    @contextlib.asynccontextmanager
+    async def lease(full_project_structure):
+        yield SimpleNamespace(dynamodb=dynamodb)
+
+    handler.lease_aws_clients = lease
+    deployed_resources = AWSDeployedResources2(
+        s3={"bucket_name": "b"},
+        dynamodb={"dynamodb_name": "blobs"},
+        dynamodb_tag_index={"table_name": "tags"},
+    )
+    items, next_state = asyncio.run(
+        handler.query_tag_index(None, deployed_resources, tags, limit, state)
+    )
+    return items, next_state, tag_table
+
+
+def test_tag_items_hold_only_the_blob_key():
+    blob = make_blob(1, [("a", "1")])
+    del blob["system_tags"]  # legacy item
+
+    [item] = build_tag_items(blob, ["id"])
+
+    assert item == {
+        "tag": tag_key("a", "1"),
+        "blob_id": "blob-001",
+        "blob_key": {"id": "blob-001"},
+    }
+
+
+def test_query_probes_and_reads_the_most_selective_tag():
+    blobs = [make_blob(i, [("common", "x")]) for i in range(300)]
+    blobs += [make_blob(300 + i, [("common", "x"), ("rare", "y")]) for i in range(3)]
+
+    items, next_state, tag_table = run_query(
+        blobs, [Tag(name="common", value="x"), Tag(name="rare", value="y")], 10
+    )
+
+    assert [item["id"] for item in items] == ["blob-300", "blob-301", "blob-302"]
+    assert next_state is None
+    # the common tag was only probed, up to the probe limit
+    assert tag_table.read_items <= 100 + 3 + 3
+
+
+def test_query_pages_follow_the_tag_order():
+    blobs = [make_blob(i, [("t", "1")]) for i in range(5)]
+
+    items, next_state, _ = run_query(blobs, [Tag(name="t", value="1")], 2)
+    assert [item["id"] for item in items] == ["blob-000", "blob-001"]
+
+    items, next_state, _ = run_query(blobs, [Tag(name="t", value="1")], 2, next_state)
+    assert [item["id"] for item in items] == ["blob-002", "blob-003"]
@@ -0,0 +1,21 @@
+from api.models import Tag
+from shared.blob_data_handlers.azure_data_handlers.azure_1 import build_search_query
+
+
+def test_tags_are_passed_as_query_parameters():
+    query, parameters = build_search_query(
+        [Tag(name="title", value='a" OR 1=1 --'), Tag(name="kind", value="x")]
+    )
+    assert '"a' not in query and "1=1" not in query
+    assert '= @n0 AND n["value"] = @v0' in query
+    assert '= @n1 AND n["value"] = @v1' in query
+    assert parameters == [
+        {"name": "@n0", "value": "title"},
+        {"name": "@v0", "value": 'a" OR 1=1 --'},
+        {"name": "@n1", "value": "kind"},
+        {"name": "@v1", "value": "x"},
+    ]
+
+
+def test_a_search_without_tags_reads_every_item():
+    assert build_search_query([]) == ("SELECT * FROM c", [])
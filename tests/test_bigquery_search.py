@@ -0,0 +1,50 @@
+import datetime
+import operator
+import re
+
+from api.models import Tag, TimeRange
+from shared.blob_data_handlers.gcp_data_handlers.bigquery_search import plan_search
+
+OPERATORS = {">=": operator.ge, "<=": operator.le}
+TIME_CONDITION_RE = re.compile(r"(\w+) (>=|<=) (.+)")
+
+
+def matches_time_range(sql: str, query_parameters, row: dict) -> bool:
+    # evaluates the time conditions of the WHERE clause against a row
+    values = {p.name: p.value for p in query_parameters}
+    where = sql.split("WHERE", 1)[1]
+    for condition in where.split("\nAND\n"):
+        match = TIME_CONDITION_RE.fullmatch(condition.strip())
+        if match is None:
+            continue
+        column, op, value = match.groups()
+        assert value.startswith("@"), condition
+        if not OPERATORS[op](row[column], values[value[1:]]):
+            return False
+    return True
+
+
+def test_time_range_bounds_only_the_timestamp_column():
+    time_range = TimeRange(
+        timestamp_from=datetime.datetime(2022, 5, 1, tzinfo=datetime.timezone.utc),
+        timestamp_to=datetime.datetime(2022, 5, 2, tzinfo=datetime.timezone.utc),
+    )
+    sql, query_parameters = plan_search("p.d.t", [], time_range)
+
+    assert "_PARTITION" not in sql
+    # backfilled: ingested a month after its timestamp
+    row = {
+        "timestamp": datetime.datetime(2022, 5, 1, 12, tzinfo=datetime.timezone.utc),
+        "_PARTITIONTIME": datetime.datetime(2022, 6, 1, tzinfo=datetime.timezone.utc),
+    }
+    assert matches_time_range(sql, query_parameters, row)
+    row["timestamp"] = datetime.datetime(2022, 5, 3, tzinfo=datetime.timezone.utc)
+    assert not matches_time_range(sql, query_parameters, row)
+
+
+def test_tags_are_sorted_so_the_sql_is_stable():
+    tags = [Tag(name="b", value="2"), Tag(name="a", value="1")]
+    sql, query_parameters = plan_search("p.d.t", tags)
+
+    assert plan_search("p.d.t", list(reversed(tags)))[0] == sql
+    assert [p.value for p in query_parameters] == ["a", "1", "b", "2"]
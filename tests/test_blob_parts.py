@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import shared.blob_data_handlers.base as base
+from api.models import Tag
+from shared.blob_data_handlers.base import BaseBlobHandler
+from shared.data_processors.base_data_processor import ProcessedData
+
+PROJECT = SimpleNamespace(project_id="project")
+
+
+class FakeStagingStore:
+    def __init__(self):
+        self.documents = {"blob": {"id": "blob", "name": "form", "user_tags": []}}
+
+    async def consume(self, blob_id: str) -> dict | None:
+        return self.documents.pop(blob_id, None)
+
+    async def restore(self, document: dict):
+        self.documents[document["id"]] = document
+
+
+class FakeHandler(BaseBlobHandler):
+    def __init__(self, index_errors: dict[str, str] | None = None):
+        self.index_errors = index_errors or {}
+        self.objects = {}
+        self.indexed = []
+
+    async def upload_object(self, full_project_structure, object_name, stream):
+        self.objects[object_name] = b"".join([chunk async for chunk in stream])
+
+    async def delete_objects(self, full_project_structure, object_names):
+        for name in object_names:
+            del self.objects[name]
+
+    def build_document(self, blob_d, processed_data, blob_id):
+        return dict(blob_d)
+
+    async def index_documents(self, full_project_structure, documents):
+        errors = [self.index_errors.get(document["id"]) for document in documents]
+        self.indexed += [
+            document["id"]
+            for document, error in zip(documents, errors)
+            if error is None
+        ]
+        return errors
+
+
+async def iter_bytes(data: bytes):
+    yield data
+
+
+def file_part(name: str) -> ProcessedData:
+    return ProcessedData(
+        stream=iter_bytes(name.encode()),
+        system_tags=[Tag(name="filename", value=name)],
+    )
+
+
+@pytest.fixture
+def staging_store(monkeypatch):
+    store = FakeStagingStore()
+    monkeypatch.setattr(base, "get_staging_store", lambda: store)
+
+    async def invalidate_project(project_id):
+        pass
+
+    monkeypatch.setattr(
+        base, "SEARCH_CACHE", SimpleNamespace(invalidate_project=invalidate_project)
+    )
+    return store
+
+
+@pytest.fixture
+def content_index(monkeypatch):
+    # the content of "shared.txt" is already stored for another blob
+    digests = {
+        hashlib.sha256(b"shared.txt").hexdigest(): ("existing", None),
+    }
+
+    async def find_object(project_id, digest):
+        return digests.get(digest)
+
+    async def record_object(project_id, digest, object_name, encoding):
+        digests.setdefault(digest, (object_name, encoding))
+
+    monkeypatch.setattr(base, "find_object", find_object)
+    monkeypatch.setattr(base, "record_object", record_object)
+    monkeypatch.setattr(base.settings, "content_dedup_enabled", True)
+    return digests
+
+
+def test_a_failed_part_deletes_the_stored_parts(staging_store, content_index):
+    handler = FakeHandler()
+
+    async def parts():
+        yield Tag(name="field", value="value")
+        yield file_part("a.txt")
+        yield file_part("shared.txt")
+        yield file_part("b.txt")
+        raise HTTPException(status_code=400, detail="Truncated multipart body")
+
+    handler.objects["existing"] = b"shared.txt"
+    with pytest.raises(HTTPException):
+        asyncio.run(handler.update_blob_parts(PROJECT, parts(), "blob"))
+    # the content another blob references is kept
+    assert handler.objects == {"existing": b"shared.txt"}
+    assert len(content_index) == 1
+    assert handler.indexed == []
+    # the upload can be retried
+    assert "blob" in staging_store.documents
+
+
+def test_parts_that_failed_to_index_are_deleted(staging_store, content_index):
+    handler = FakeHandler(index_errors={"blob": "Throttled"})
+
+    async def parts():
+        yield file_part("a.txt")
+        yield file_part("b.txt")
+
+    results = asyncio.run(handler.update_blob_parts(PROJECT, parts(), "blob"))
+    assert [result.error for result in results] == ["Throttled", None]
+    # the indexed part is kept with its object, blob_id is consumed so it
+    # isn't stored a second time
+    assert list(handler.objects) == handler.indexed == [results[1].blob_id]
+    assert staging_store.documents == {}
+    # only the content of the indexed part can be referenced
+    assert [name for name, _ in content_index.values()] == [
+        "existing",
+        results[1].blob_id,
+    ]
+
+
+def test_a_form_whose_parts_all_failed_to_index_can_be_uploaded_again(
+    staging_store, content_index
+):
+    handler = FakeHandler(index_errors={"blob": "Throttled"})
+
+    async def parts():
+        yield file_part("a.txt")
+
+    results = asyncio.run(handler.update_blob_parts(PROJECT, parts(), "blob"))
+    assert results[0].error == "Throttled"
+    assert handler.objects == {}
+    assert "blob" in staging_store.documents
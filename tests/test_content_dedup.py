@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import shared.blob_data_handlers.base as base
+from shared.blob_data_handlers.base import BaseBlobHandler
+from shared.data_processors.base_data_processor import ProcessedData
+
+PROJECT = SimpleNamespace(project_id="project")
+
+
+class FakeHandler(BaseBlobHandler):
+    def __init__(self):
+        self.objects = {}
+        self.index_error = None
+
+    async def upload_object(self, full_project_structure, object_name, stream):
+        self.objects[object_name] = b"".join([chunk async for chunk in stream])
+
+    def build_document(self, blob_d, processed_data, blob_id):
+        return dict(blob_d, system_tags=processed_data.system_tags)
+
+    async def index_documents(self, full_project_structure, documents):
+        return [self.index_error for _ in documents]
+
+
+async def iter_bytes(data: bytes):
+    yield data
+
+
+def processed(data: bytes) -> ProcessedData:
+    return ProcessedData(stream=iter_bytes(data), system_tags=[])
+
+
+@pytest.fixture
+def content_index(monkeypatch):
+    staged = {"blob": {"id": "blob"}, "other": {"id": "other"}}
+    digests = {}
+
+    async def consume(blob_id):
+        return staged.pop(blob_id, None)
+
+    async def restore(document):
+        staged[document["id"]] = document
+
+    async def find_object(project_id, digest):
+        return digests.get(digest)
+
+    async def record_object(project_id, digest, object_name, encoding):
+        digests.setdefault(digest, (object_name, encoding))
+
+    async def invalidate_project(project_id):
+        pass
+
+    monkeypatch.setattr(
+        base,
+        "get_staging_store",
+        lambda: SimpleNamespace(consume=consume, restore=restore),
+    )
+    monkeypatch.setattr(base, "find_object", find_object)
+    monkeypatch.setattr(base, "record_object", record_object)
+    monkeypatch.setattr(
+        base, "SEARCH_CACHE", SimpleNamespace(invalidate_project=invalidate_project)
+    )
+    monkeypatch.setattr(base.settings, "content_dedup_enabled", True)
+    return digests
+
+
+def test_a_retry_with_other_data_does_not_change_deduplicated_content(
+    content_index,
+):
+    handler = FakeHandler()
+    handler.index_error = "Throttled"
+    with pytest.raises(HTTPException):
+        asyncio.run(handler.update_blob_data(PROJECT, processed(b"first"), "blob"))
+    # the content of a blob that wasn't indexed can't be referenced
+    assert content_index == {}
+
+    handler.index_error = None
+    asyncio.run(handler.update_blob_data(PROJECT, processed(b"second"), "blob"))
+    asyncio.run(handler.update_blob_data(PROJECT, processed(b"first"), "other"))
+    assert handler.objects == {"blob": b"second", "other": b"first"}
+    assert sorted(name for name, _ in content_index.values()) == ["blob", "other"]
+
+
+def test_indexed_content_is_referenced_by_later_uploads(content_index):
+    handler = FakeHandler()
+    asyncio.run(handler.update_blob_data(PROJECT, processed(b"data"), "blob"))
+    asyncio.run(handler.update_blob_data(PROJECT, processed(b"data"), "other"))
+    assert list(handler.objects) == ["blob"]
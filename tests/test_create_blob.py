@@ -0,0 +1,59 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import api.router.blob as blob_router_module
+from api.dependencies import get_current_project
+from api.models import SignedUrl
+from api.router.blob import blob_router
+
+PROJECT_ID = "6f1c8a52-6d0e-4b8f-9d43-4f6d0e1b2c3a"
+
+
+class FakeHandler:
+    async def insert_blob(self, full_project_structure, blob):
+        return "blob"
+
+    async def create_upload_url(self, full_project_structure, blob_id, content_type):
+        return SignedUrl(
+            url=f"https://storage.example/{blob_id}",
+            method="PUT",
+            headers={"Content-Type": content_type},
+            expires_at=datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc),
+        )
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def track_time(*args):
+        pass
+
+    monkeypatch.setattr(
+        blob_router_module.TimeTrackingBigQuery, "track_time", track_time
+    )
+    monkeypatch.setitem(blob_router_module.BLOB_HANDLER_CLASSES, "fake", FakeHandler)
+    app = FastAPI()
+    app.include_router(blob_router)
+    app.dependency_overrides[get_current_project] = lambda: SimpleNamespace(
+        deploy=SimpleNamespace(deploy_type="fake"), project_id=PROJECT_ID
+    )
+    return TestClient(app)
+
+
+def test_create_blob_returns_the_blob(client):
+    response = client.post(f"/v1/blobs/{PROJECT_ID}", json={"name": "a"})
+    assert response.status_code == 201
+    assert response.json()["blob_id"] == "blob"
+    assert "upload" not in response.json()
+
+
+def test_a_direct_upload_returns_the_upload_url(client):
+    response = client.post(
+        f"/v1/blobs/{PROJECT_ID}?direct_upload=true",
+        json={"name": "a", "content_type": "text/plain"},
+    )
+    assert response.status_code == 201
+    assert response.json()["upload"]["url"] == "https://storage.example/blob"
@@ -0,0 +1,52 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from shared.blob_data_handlers.gcp_data_handlers import gcp_1
+from shared.blob_data_handlers.gcp_data_handlers.gcp_1 import GCPBlobHandler1
+from utils.streams import read_all
+
+PROJECT = SimpleNamespace(
+    deploy=SimpleNamespace(
+        project_structure={
+            "bigquery": {"project": "p", "dataset": "d", "table": "blobs"}
+        }
+    )
+)
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    gcp_1.DATA_CACHE.clear()
+    rows = {"blob": SimpleNamespace(file=b"0123456789")}
+    queries = []
+
+    async def query_row(self, full_project_structure, table_id, blob_id, columns):
+        queries.append(blob_id)
+        return rows.get(blob_id)
+
+    monkeypatch.setattr(GCPBlobHandler1, "query_row", query_row)
+    yield queries
+    gcp_1.DATA_CACHE.clear()
+
+
+def test_the_range_requests_of_a_download_query_the_table_once(queries):
+    async def read_range(start: int, end: int) -> bytes:
+        stored_object = await GCPBlobHandler1().open_object(PROJECT, "blob")
+        return await read_all(stored_object.read(start, end))
+
+    async def run():
+        return [await read_range(0, 4), await read_range(5, 9)]
+
+    assert asyncio.run(run()) == [b"01234", b"56789"]
+    assert queries == ["blob"]
+
+
+def test_a_missing_row_is_queried_again(queries):
+    async def run():
+        for _ in range(2):
+            assert await GCPBlobHandler1().open_object(PROJECT, "other") is None
+
+    asyncio.run(run())
+    assert queries == ["other", "other"]
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+from api.models import Tag
+from shared.blob_data_handlers.gcp_data_handlers.gcp_2 import (
+    read_tag_blob_ids,
+    tag_prefix,
+)
+
+
+class FakeRows:
+    def __init__(self, keys: list[str]):
+        self.keys = keys
+        self.read = 0
+        self.cancelled = False
+
+    def __iter__(self):
+        for key in self.keys:
+            self.read += 1
+            yield SimpleNamespace(row_key=key.encode())
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeTable:
+    # the index rows of a Bigtable table, read in key order
+    def __init__(self, keys: list[str]):
+        self.keys = sorted(keys)
+        self.reads = []
+
+    def read_rows(self, start_key, end_key, filter_):
+        rows = FakeRows([key for key in self.keys if start_key <= key < end_key])
+        self.reads.append(rows)
+        return rows
+
+
+def index(tag: Tag, blob_ids: list[str]) -> list[str]:
+    return [tag_prefix(tag.name, tag.value) + blob_id for blob_id in blob_ids]
+
+
+RED = Tag(name="color", value="red")
+BIG = Tag(name="size", value="big")
+BLOB_IDS = [f"{i:04d}" for i in range(1000)]
+
+
+def test_the_tag_ranges_are_intersected_in_order():
+    table = FakeTable(index(RED, BLOB_IDS[::2]) + index(BIG, BLOB_IDS[::3]))
+    assert read_tag_blob_ids(table, [RED, BIG], None, 3) == ["0000", "0006", "0012"]
+    assert all(rows.cancelled for rows in table.reads)
+
+
+def test_a_page_reads_from_the_previous_one_on():
+    table = FakeTable(index(RED, BLOB_IDS[::2]) + index(BIG, BLOB_IDS[::3]))
+    blob_ids = read_tag_blob_ids(table, [RED, BIG], "0900", 2)
+    assert blob_ids == ["0906", "0912"]
+    # the rows before the previous page aren't read again
+    assert sum(rows.read for rows in table.reads) < 20
@@ -0,0 +1,55 @@
+import asyncio
+
+from starlette.datastructures import Headers
+
+from shared.data_processors.general_processor import GeneralDataProcessor
+from utils.streams import iter_bytes, read_all
+
+
+def process_head(content_type: str, head: bytes) -> dict[str, str]:
+    headers = Headers(
+        headers={"content-length": str(len(head)), "content-type": content_type}
+    )
+    tags = asyncio.run(GeneralDataProcessor().process_head(head, headers, True))
+    return {tag.name: tag.value for tag in tags}
+
+
+def test_data_without_a_processor_keeps_the_header_tags():
+    tags = process_head("application/octet-stream", b"\x00\x01")
+    assert tags == {
+        "content-length": "2",
+        "content-type": "application/octet-stream",
+    }
+
+
+def test_the_processor_of_the_content_type_extracts_tags():
+    tags = process_head("application/json", b'{"a": 1}')
+    assert tags["content-type"] == "application/json"
+    assert len(tags) > 2
+
+
+def test_a_form_part_without_a_processor_is_stored_as_is():
+    body = (
+        b"--b\r\n"
+        b'Content-Disposition: form-data; name="file"; filename="a.bin"\r\n'
+        b"Content-Type: application/octet-stream\r\n\r\n"
+        b"\x00\x01\x02\r\n"
+        b"--b--\r\n"
+    )
+    headers = Headers(headers={"content-type": "multipart/form-data; boundary=b"})
+
+    async def run():
+        parts = []
+        async for part in GeneralDataProcessor().iter_form_parts(
+            iter_bytes(body, 7), headers
+        ):
+            parts.append((part, await read_all(part.iter_chunks())))
+        return parts
+
+    [(part, data)] = asyncio.run(run())
+    assert data == b"\x00\x01\x02"
+    assert {tag.name: tag.value for tag in part.system_tags} == {
+        "content-type": "application/octet-stream",
+        "form-field": "file",
+        "filename": "a.bin",
+    }
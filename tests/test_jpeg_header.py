@@ -0,0 +1,53 @@
+import struct
+
+import pytest
+
+from shared.data_processors.jpeg_header import JpegHeaderError, parse_jpeg_header
+
+
+def segment(marker: int, payload: bytes) -> bytes:
+    return struct.pack(">BBH", 0xFF, marker, len(payload) + 2) + payload
+
+
+def exif(make: bytes, orientation: int) -> bytes:
+    # little endian TIFF with an IFD0 of two entries, the Make string after it
+    entries = 2
+    make_offset = 8 + 2 + entries * 12 + 4
+    ifd0 = struct.pack("<H", entries)
+    ifd0 += struct.pack("<HHLL", 0x010F, 2, len(make), make_offset)
+    ifd0 += struct.pack("<HHLHH", 0x0112, 3, 1, orientation, 0)
+    ifd0 += struct.pack("<L", 0)
+    return b"Exif\x00\x00" + b"II*\x00" + struct.pack("<L", 8) + ifd0 + make
+
+
+JFIF = segment(0xE0, b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00")
+SOF = segment(0xC0, struct.pack(">BHHB", 8, 480, 640, 3) + b"\x01\x22\x00" * 3)
+JPEG = b"\xff\xd8" + JFIF + segment(0xE1, exif(b"Canon\x00", 6)) + SOF + b"\xff\xda"
+
+
+def test_the_tags_are_read_from_a_jfif_exif_header():
+    assert parse_jpeg_header(JPEG) == {
+        "EXIF:Make": "Canon",
+        "EXIF:Orientation": 6,
+        "File:ImageWidth": 640,
+        "File:ImageHeight": 480,
+        "File:BitsPerSample": 8,
+        "File:ColorComponents": 3,
+    }
+
+
+def test_a_truncated_header_needs_more_bytes():
+    end_of_frame = JPEG.index(SOF) + len(SOF)
+    for size in (1, 10, len(JFIF) + 5, end_of_frame - 1):
+        assert parse_jpeg_header(JPEG[:size]) is None
+    assert parse_jpeg_header(JPEG[:end_of_frame]) is not None
+
+
+def test_other_data_is_not_a_jpeg():
+    with pytest.raises(JpegHeaderError):
+        parse_jpeg_header(b"\x89PNG\r\n\x1a\n")
+
+
+def test_image_data_without_a_frame_header_is_rejected():
+    with pytest.raises(JpegHeaderError):
+        parse_jpeg_header(b"\xff\xd8" + JFIF + b"\xff\xda\x00\x02")
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+from starlette.datastructures import Headers
+
+from shared.data_processors import json_data_processor
+from shared.data_processors.json_data_processor import JsonDataProcessor, JsonIngestMode
+from utils.streams import iter_bytes, read_all
+
+
+@pytest.fixture(autouse=True)
+def canonicalize(monkeypatch):
+    monkeypatch.setattr(
+        json_data_processor.settings, "json_ingest_mode", JsonIngestMode.CANONICALIZE
+    )
+
+
+def process(data: bytes) -> bytes:
+    async def run() -> bytes:
+        processed_data = await JsonDataProcessor().process_stream(
+            iter_bytes(data, 4), Headers(headers={"content-type": "application/json"})
+        )
+        return await read_all(processed_data.iter_chunks())
+
+    return asyncio.run(run())
+
+
+def test_documents_are_stored_compact_with_sorted_keys():
+    assert process(b'{"b": 1.5, "a": ["x", null]}') == b'{"a":["x",null],"b":1.5}'
+
+
+def test_integers_wider_than_64_bits_keep_their_digits():
+    data = (
+        b'{"id": 12345678901234567890123, "n": -9223372036854775809, "x": "\xc3\xa9"}'
+    )
+    assert process(data) == (
+        b'{"id":12345678901234567890123,"n":-9223372036854775809,"x":"\xc3\xa9"}'
+    )
@@ -0,0 +1,36 @@
+import uuid
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from api.dependencies import UnauthenticatedException
+from api.error_handling import handle_unauthenticated_exception
+from api.router.metrics import metrics_router
+from config import settings
+
+
+def build_client() -> TestClient:
+    app = FastAPI()
+    app.add_exception_handler(
+        UnauthenticatedException, handle_unauthenticated_exception
+    )
+    app.include_router(metrics_router)
+    return TestClient(app)
+
+
+def test_metrics_need_a_bearer_token():
+    assert build_client().get("/v1/metrics").status_code == 403
+
+
+def test_metrics_are_served_to_an_authenticated_user():
+    token = jwt.encode(
+        {"user_id": str(uuid.uuid4()), "aud": "fastapi-users:auth"},
+        settings.jwt_secret,
+        algorithm=jwt.ALGORITHMS.HS256,
+    )
+    response = build_client().get(
+        "/v1/metrics", headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    assert "project_cache" in response.json()
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from shared.data_processors.multipart_parser import MultipartError, MultipartParser
+from utils.streams import iter_bytes, read_all
+
+BODY = (
+    b"preamble\r\n"
+    b"--boundary\r\n"
+    b'Content-Disposition: form-data; name="field"\r\n\r\n'
+    b"value\r\n"
+    b"--boundary\r\n"
+    b'Content-Disposition: form-data; name="file"; filename="a.txt"\r\n'
+    b"Content-Type: text/plain\r\n\r\n"
+    b"line 1\r\nline 2 --boundar\r\n"
+    b"--boundary--\r\n"
+    b"epilogue"
+)
+
+
+def parse(body: bytes, chunk_size: int) -> list[tuple]:
+    async def run() -> list[tuple]:
+        parser = MultipartParser(iter_bytes(body, chunk_size), b"boundary", 1024)
+        return [
+            (part.name, part.filename, part.headers.get("content-type"), data)
+            async for part in parser.iter_parts()
+            for data in [await read_all(part.stream)]
+        ]
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 11, len(BODY)])
+def test_a_boundary_split_across_chunks_is_found(chunk_size):
+    assert parse(BODY, chunk_size) == [
+        ("field", None, None, b"value"),
+        ("file", "a.txt", "text/plain", b"line 1\r\nline 2 --boundar"),
+    ]
+
+
+def test_a_part_without_a_content_type_has_no_content_type_header():
+    body = (
+        b"--boundary\r\n"
+        b'Content-Disposition: form-data; name="file"; filename="a.bin"\r\n\r\n'
+        b"\x00\x01\r\n"
+        b"--boundary--\r\n"
+    )
+    assert parse(body, 5) == [("file", "a.bin", None, b"\x00\x01")]
+
+
+def test_a_body_without_the_final_boundary_is_truncated():
+    body = BODY[: BODY.index(b"--boundary--")]
+    with pytest.raises(MultipartError, match="Truncated"):
+        parse(body, 7)
+
+
+def test_a_body_without_a_boundary_is_rejected():
+    with pytest.raises(MultipartError, match="not found"):
+        parse(b"no parts here", 4)
@@ -0,0 +1,43 @@
+import uuid
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from jose import jwt
+
+import api.router.project as project_module
+from api.dependencies import PROJECT_CACHE
+from api.router.project import project_router
+from config import settings
+
+PROJECT_ID = str(uuid.uuid4())
+OTHER_PROJECT_ID = str(uuid.uuid4())
+
+
+def test_a_changed_project_is_dropped_for_every_user(monkeypatch):
+    invalidated = []
+
+    async def invalidate_project(project_id):
+        invalidated.append(project_id)
+
+    monkeypatch.setattr(
+        project_module.SEARCH_CACHE, "invalidate_project", invalidate_project
+    )
+    PROJECT_CACHE.clear()
+    for key in [("u1", PROJECT_ID), ("u2", PROJECT_ID), ("u1", OTHER_PROJECT_ID)]:
+        PROJECT_CACHE.set(key, object())
+
+    app = FastAPI()
+    app.include_router(project_router)
+    token = jwt.encode(
+        {"user_id": str(uuid.uuid4()), "aud": "fastapi-users:auth"},
+        settings.jwt_secret,
+        algorithm=jwt.ALGORITHMS.HS256,
+    )
+    response = TestClient(app).post(
+        f"/v1/projects/{PROJECT_ID}/invalidate",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 204
+    assert list(PROJECT_CACHE._entries) == [("u1", OTHER_PROJECT_ID)]
+    assert invalidated == [PROJECT_ID]
+    PROJECT_CACHE.clear()
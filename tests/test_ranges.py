@@ -0,0 +1,61 @@
+import pytest
+from fastapi import HTTPException
+
+from api.router.blob import etag_matches, parse_range
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-9", (0, 9)),
+        ("bytes=10-19", (10, 19)),
+        ("bytes=95-200", (95, 99)),  # the end is clamped
+        ("bytes=90-", (90, 99)),  # open ended
+        ("bytes=-10", (90, 99)),  # suffix
+        ("bytes=-500", (0, 99)),  # suffix longer than the object
+        ("BYTES = 0-0", (0, 0)),
+    ],
+)
+def test_a_single_range_is_served(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        "bytes=0-9,20-29",  # multiple ranges, the whole object is sent
+        "bytes=0-9, -5",
+        "items=0-9",
+        "bytes=9-0",
+        "bytes=a-b",
+        "bytes=",
+        "bytes=-",
+        "bytes=5",
+    ],
+)
+def test_other_ranges_send_the_whole_object(header):
+    assert parse_range(header, 100) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=100-200", "bytes=-0"])
+def test_an_unsatisfiable_range_is_a_416(header):
+    with pytest.raises(HTTPException) as e:
+        parse_range(header, 100)
+    assert e.value.status_code == 416
+    assert e.value.headers == {"Content-Range": "bytes */100"}
+
+
+@pytest.mark.parametrize(
+    "if_none_match, expected",
+    [
+        ('"abc"', True),
+        ('W/"abc"', True),  # weak comparison
+        ('"x", W/"abc" , "y"', True),
+        ('"x", "y"', False),
+        ('"abcd"', False),
+        ("*", True),
+        (" * ", True),
+    ],
+)
+def test_if_none_match(if_none_match, expected):
+    assert etag_matches(if_none_match, '"abc"') is expected
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+import database.search_generations
+from api.models import Blob, SearchPage
+from shared.search_cache import InMemorySearchCacheBackend, SearchCache
+
+
+class FakeCollection:
+    # the part of a motor collection the generations use
+    def __init__(self):
+        self.documents = {}
+        self.reads = 0
+
+    async def find_one(self, query, projection=None):
+        self.reads += 1
+        return self.documents.get(query["_id"])
+
+    async def update_one(self, query, update, upsert=False):
+        self.documents.setdefault(query["_id"], {}).update(update["$set"])
+
+
+def page(name: str) -> SearchPage:
+    return SearchPage(blobs=[Blob(name=name, blob_id=name)])
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = FakeCollection()
+    monkeypatch.setattr(
+        database.search_generations,
+        "get_search_generation_collection",
+        lambda: collection,
+    )
+    return collection
+
+
+async def search(cache: SearchCache, name: str) -> SearchPage:
+    async def run() -> SearchPage:
+        return page(name)
+
+    return await cache.get_or_search("project", "key", run)
+
+
+def test_a_write_on_one_worker_invalidates_the_pages_of_the_others(collection):
+    # one cache per worker, sharing the database
+    worker_1 = SearchCache(InMemorySearchCacheBackend(1024 * 1024), ttl=60)
+    worker_2 = SearchCache(
+        InMemorySearchCacheBackend(1024 * 1024), ttl=60, generation_ttl=0.05
+    )
+
+    async def scenario():
+        assert (await search(worker_2, "before")).blobs[0].name == "before"
+        assert (await search(worker_2, "cached")).blobs[0].name == "before"
+        await worker_1.invalidate_project("project")
+        # seen once the generation worker_2 read expired
+        await asyncio.sleep(0.1)
+        assert (await search(worker_2, "after")).blobs[0].name == "after"
+
+    asyncio.run(scenario())
+
+
+def test_cached_pages_are_served_without_reading_the_database(collection):
+    cache = SearchCache(InMemorySearchCacheBackend(1024 * 1024), ttl=60)
+
+    async def scenario():
+        assert (await search(cache, "before")).blobs[0].name == "before"
+        assert (await search(cache, "cached")).blobs[0].name == "before"
+        assert collection.reads == 1
+        # a write on this worker is seen right away
+        await cache.invalidate_project("project")
+        assert (await search(cache, "after")).blobs[0].name == "after"
+        assert collection.reads == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+import asyncio
+
+from database.staging_store import CachedStagingStore, StagingStore
+
+
+class SharedStore(StagingStore):
+    # the backing store both workers see
+    def __init__(self):
+        self.documents = {}
+        self.reads = 0
+
+    async def insert(self, document: dict):
+        self.documents[document["id"]] = dict(document)
+
+    async def get_many(self, blob_ids: list[str]) -> dict[str, dict]:
+        self.reads += 1
+        return {
+            blob_id: self.documents[blob_id]
+            for blob_id in blob_ids
+            if blob_id in self.documents
+        }
+
+    async def consume(self, blob_id: str) -> dict | None:
+        return self.documents.pop(blob_id, None)
+
+
+def test_a_record_is_consumed_by_one_worker_only():
+    store = SharedStore()
+    worker_1 = CachedStagingStore(store, max_size=10, ttl=60)
+    worker_2 = CachedStagingStore(store, max_size=10, ttl=60)
+
+    async def run():
+        await worker_1.insert({"id": "blob", "name": "a"})
+        # the other worker wins the upload of the record
+        assert (await worker_2.consume("blob"))["name"] == "a"
+        # the record is still in the cache of the worker that created it
+        assert await worker_1.consume("blob") is None
+
+    asyncio.run(run())
+
+
+def test_the_records_a_worker_created_are_read_from_its_cache():
+    store = SharedStore()
+    worker = CachedStagingStore(store, max_size=10, ttl=60)
+
+    async def run():
+        await worker.insert({"id": "a", "name": "a"})
+        await store.insert({"id": "b", "name": "b"})
+        return await worker.get_many(["a", "b"])
+
+    assert set(asyncio.run(run())) == {"a", "b"}
+    # only the record of another worker was read
+    assert store.reads == 1
+    assert worker.stats()["hits"] == 1